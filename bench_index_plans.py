@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Banc d'essai des index: plans d'exécution et durées des requêtes fréquentes
+avant et après la migration des index composites et partiels (version 4).
+
+Usage: python bench_index_plans.py [nb_transactions]
+La base de test est créée dans un répertoire temporaire puis supprimée.
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from modules import migrations
+from modules.database import day_key
+
+INDEX_VERSION = 4
+
+# Requêtes mesurées: (libellé, SQL, paramètres)
+QUERIES = [
+    (
+        "Transactions non facturées d'un client",
+        """
+            SELECT t.id, t.date_transaction, t.quantite, t.prix_unitaire, t.montant_total
+            FROM transactions t
+            WHERE t.client_id = ?
+              AND t.type_paiement = 'credit'
+              AND NOT EXISTS (SELECT 1 FROM lignes_facture lf WHERE lf.transaction_id = t.id)
+              AND t.jour >= ? AND t.jour < ?
+            ORDER BY t.date_transaction DESC
+        """,
+        (7, day_key("2024-01-01"), day_key("2024-12-31", 1))
+    ),
+    (
+        "Ancienne forme NOT IN (pour comparaison)",
+        """
+            SELECT t.id, t.date_transaction, t.quantite, t.prix_unitaire, t.montant_total
+            FROM transactions t
+            WHERE t.client_id = ?
+              AND t.type_paiement = 'credit'
+              AND t.id NOT IN (SELECT DISTINCT lf.transaction_id FROM lignes_facture lf
+                               WHERE lf.transaction_id IS NOT NULL)
+              AND t.jour >= ? AND t.jour < ?
+            ORDER BY t.date_transaction DESC
+        """,
+        (7, day_key("2024-01-01"), day_key("2024-12-31", 1))
+    ),
+    (
+        "Créances d'un client",
+        """
+            SELECT COUNT(*), COALESCE(SUM(montant_total), 0)
+            FROM transactions
+            WHERE client_id = ? AND type_paiement = 'credit'
+        """,
+        (7,)
+    ),
+    (
+        "Ventes à crédit du mois, tous clients",
+        """
+            SELECT COUNT(*), COALESCE(SUM(montant_total), 0)
+            FROM transactions
+            WHERE type_paiement = 'credit' AND jour >= ? AND jour < ?
+        """,
+        (day_key("2024-06-01"), day_key("2024-06-30", 1))
+    ),
+    (
+        "Paiements actifs du mois",
+        """
+            SELECT p.id, p.date_paiement, p.montant
+            FROM paiements_avance p
+            WHERE p.statut = 'actif' AND p.jour >= ?
+            ORDER BY p.date_paiement DESC
+        """,
+        (day_key("2024-06-01"),)
+    ),
+]
+
+
+def apply_migrations(conn, up_to):
+    """Appliquer les migrations jusqu'à la version up_to incluse"""
+    cursor = conn.cursor()
+    for version, description, apply in migrations.pending_migrations(migrations.current_version(conn)):
+        if version > up_to:
+            break
+        cursor.execute("BEGIN")
+        apply(cursor)
+        migrations.record_version(cursor, version, description)
+        cursor.execute("COMMIT")
+
+
+def populate(conn, nb_transactions):
+    """Générer clients, ventes, factures et paiements de test"""
+    rng = random.Random(42)
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    cursor.executemany("INSERT INTO clients (nom) VALUES (?)", ((f"Client {i}",) for i in range(200)))
+    cursor.executemany(
+        """INSERT INTO transactions (station_id, client_id, carburant_id, quantite, prix_unitaire,
+                                     montant_total, type_paiement, date_transaction)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        ((rng.randint(1, 6), rng.randint(1, 200), rng.randint(1, 4), 40.0, 12.5, 500.0,
+          rng.choice(("credit", "especes", "carte")),
+          f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(6, 22):02d}:00:00")
+         for _ in range(nb_transactions))
+    )
+    # Facturer environ la moitié des ventes à crédit
+    cursor.execute("""
+        INSERT INTO factures (numero_facture, client_id, station_id, date_facture, montant_ht, tva, montant_ttc)
+        VALUES ('BENCH-1', 1, 1, '2024-12-31', 0, 0, 0)
+    """)
+    cursor.execute("""
+        INSERT INTO lignes_facture (facture_id, transaction_id, description, quantite, prix_unitaire, montant)
+        SELECT 1, id, 'Vente', quantite, prix_unitaire, montant_total
+        FROM transactions WHERE type_paiement = 'credit' AND id % 2 = 0
+    """)
+    cursor.executemany(
+        "INSERT INTO paiements_avance (client_id, montant, mode_paiement, date_paiement, statut) VALUES (?, ?, ?, ?, ?)",
+        ((rng.randint(1, 200), 1000.0, "especes",
+          f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 09:00:00",
+          rng.choice(("actif", "actif", "annule")))
+         for _ in range(nb_transactions // 10))
+    )
+    cursor.execute("COMMIT")
+    cursor.execute("ANALYZE")
+
+
+def measure(conn, repeat=20):
+    """Plan et durée moyenne (ms) de chaque requête"""
+    results = []
+    for label, query, params in QUERIES:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(query, params).fetchall()
+        elapsed = (time.perf_counter() - start) / repeat * 1000
+        results.append((label, plan, elapsed))
+    return results
+
+
+def main():
+    nb_transactions = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    directory = tempfile.mkdtemp(prefix="bench_index_")
+    try:
+        conn = sqlite3.connect(os.path.join(directory, "bench.db"), isolation_level=None)
+        apply_migrations(conn, INDEX_VERSION - 1)
+        print(f"Génération de {nb_transactions} transactions...")
+        populate(conn, nb_transactions)
+        before = measure(conn)
+
+        apply_migrations(conn, INDEX_VERSION)
+        conn.execute("ANALYZE")
+        after = measure(conn)
+
+        for (label, plan_before, time_before), (_, plan_after, time_after) in zip(before, after):
+            print(f"\n=== {label} ===")
+            print(f"Avant ({time_before:.2f} ms):")
+            for line in plan_before:
+                print(f"    {line}")
+            print(f"Après ({time_after:.2f} ms):")
+            for line in plan_after:
+                print(f"    {line}")
+        conn.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -14,9 +14,10 @@ Version 2.0 - Avec gestion d'erreurs améliorée et validation des données
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, simpledialog
 import os
 import sys
+import platform
 import logging
 import traceback
 from datetime import datetime
@@ -28,6 +29,19 @@ from modules.database import DatabaseManager
 from modules.main_window import MainWindow
 from modules.auth import LoginDialog, AdminPanel
 
+# Répertoire des fichiers de ventes par station (None: une seule base)
+SHARDS_DIR = None
+
+# Réplication vers le siège: base centrale ou répertoire de dépôt (None: désactivée)
+REPLICATION_TARGET = None
+REPLICATION_SOURCE = None  # Identifiant de cette station au siège (par défaut: nom du poste)
+
+# Vérification de l'activité (ms) pour les checkpoints du WAL pendant les périodes calmes
+CHECKPOINT_CHECK_MS = 5000
+
+# Sauvegardes à chaud quotidiennes (rotation: 7 jours, 4 semaines, 12 mois)
+BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sauvegardes')
+
 
 class GazStationApp:
     def __init__(self):
@@ -66,7 +80,7 @@ class GazStationApp:
             self.root.columnconfigure(0, weight=1)
 
             # === Base de données ===
-            self.db_manager = DatabaseManager()
+            self.db_manager = DatabaseManager(shard_dir=SHARDS_DIR)
 
             # === Connexion utilisateur ===
             login = LoginDialog(self.root, self.db_manager)
@@ -154,6 +168,13 @@ class GazStationApp:
                 menubar.add_cascade(label="Administration", menu=admin_menu)
                 admin_menu.add_command(label="Panneau d'Administration", command=self.open_admin_panel)
                 admin_menu.add_command(label="Statistiques DB", command=self.show_db_stats)
+                admin_menu.add_command(label="Optimiser la base de données", command=self.optimize_database)
+                admin_menu.add_command(label="Conseiller d'index", command=self.show_index_advisor)
+                admin_menu.add_command(label="Sauvegarder maintenant", command=self.request_backup)
+                admin_menu.add_command(label="Clôture de poste (checkpoint)", command=self.close_shift)
+                admin_menu.add_command(label="Archiver un exercice clos...", command=self.archive_fiscal_year)
+                admin_menu.add_command(label="Restaurer un exercice archivé...", command=self.restore_fiscal_year)
+                admin_menu.add_command(label="Recalculer les ventes journalières", command=self.rebuild_daily_sales)
                 admin_menu.add_command(label="Réinitialiser stats DB", command=lambda: self.db_manager.reset_stats())
 
             # Menu Aide
@@ -207,21 +228,256 @@ Optimisé pour écran tactile
             stats_text += f"Hits du cache: {stats['cache_hits']}\n"
             stats_text += f"Misses du cache: {stats['cache_misses']}\n"
             stats_text += f"Ratio de hits: {stats['cache_hit_ratio']:.2%}\n"
-            stats_text += f"Taille du cache: {stats['cache_size']} entrées\n"
-            stats_text += f"Connexions actives: {stats['connection_pool_size']}\n\n"
+            stats_text += f"Évictions du cache: {stats['cache_evictions']}\n"
+            stats_text += f"Taille du cache: {stats['cache_size']} entrées "
+            stats_text += f"({stats['cache_bytes'] / 1048576:.1f} / {stats['cache_max_bytes'] / 1048576:.0f} Mo)\n"
+            pool = stats['pool']
+            stats_text += f"Connexions actives: {stats['connection_pool_size']} "
+            stats_text += f"(lecteurs en cours: {pool['readers_in_use']}/{pool['max_readers']})\n"
+            stats_text += f"Attente moyenne lecture/écriture: {pool['avg_reader_wait'] * 1000:.1f} / "
+            stats_text += f"{pool['avg_writer_wait'] * 1000:.1f} ms (max {pool['max_wait'] * 1000:.1f} ms)\n"
+            stats_text += f"Utilisation lecteurs/rédacteur: {pool['reader_utilization']:.1%} / "
+            stats_text += f"{pool['writer_utilization']:.1%}\n"
+            checkpoint = stats['checkpoint']
+            stats_text += f"Journal WAL: {checkpoint['wal_size'] / 1048576:.1f} Mo, "
+            stats_text += f"retard {checkpoint['lag_frames']} pages "
+            if checkpoint['seconds_since_checkpoint'] is None:
+                stats_text += "(aucun checkpoint)\n"
+            else:
+                stats_text += f"(dernier checkpoint {checkpoint['last_mode']} il y a "
+                stats_text += f"{checkpoint['seconds_since_checkpoint']:.0f} s, {checkpoint['last_duration'] * 1000:.0f} ms)\n"
+            backup = stats['backup']
+            if backup:
+                if backup['running']:
+                    stats_text += f"Sauvegarde en cours: {backup['progress']:.0%}\n"
+                stats_text += f"Dernière sauvegarde: {backup['last_backup'] or '-'} "
+                stats_text += f"({backup['last_duration']:.1f} s, {backup['last_size'] / 1048576:.1f} Mo, "
+                stats_text += f"{backup['kept']} conservées, {backup['failures']} échecs)\n"
+                if backup['last_error']:
+                    stats_text += f"  Dernière erreur: {backup['last_error']}\n"
+            replication = stats['replication']
+            if replication:
+                stats_text += f"Réplication vers le siège: {replication['changes']} modifications expédiées, "
+                stats_text += f"{replication['pending']} en attente (dernier envoi: {replication['last_ship'] or '-'})\n"
+                if replication['last_error']:
+                    stats_text += f"  Dernière erreur: {replication['last_error']}\n"
+            stats_text += "\n"
+            
+            # Requêtes les plus coûteuses, regroupées par empreinte
+            stats_text += "Requêtes les plus coûteuses (temps cumulé):\n"
+            for entry in stats['fingerprints']:
+                stats_text += f"- {entry['total_time']:.2f}s, {entry['count']} appels, {entry['rows']} lignes, "
+                stats_text += f"p50/p95/p99: {entry['p50'] * 1000:.1f} / {entry['p95'] * 1000:.1f} / "
+                stats_text += f"{entry['p99'] * 1000:.1f} ms\n  {entry['fingerprint'][:200]}\n"
+                if entry['full_scans']:
+                    stats_text += f"  PARCOURS COMPLET: {', '.join(entry['full_scans'])}\n"
+                if entry['plan']:
+                    stats_text += "".join(f"    {line}\n" for line in entry['plan'])
+            stats_text += "\n"
             
             if stats['slow_queries_count'] > 0:
                 stats_text += f"Requêtes lentes ({stats['slow_queries_count']} au total):\n"
                 for q in stats['slow_queries']:
-                    stats_text += f"- {q['timestamp']}: {q['time']:.3f}s - {q['query'][:50]}...\n"
+                    scans = f" [parcours complet: {', '.join(q['full_scans'])}]" if q['full_scans'] else ""
+                    stats_text += f"- {q['timestamp']}: {q['time']:.3f}s - {q['fingerprint'][:80]}...{scans}\n"
             else:
                 stats_text += "Aucune requête lente détectée."
-                
-            messagebox.showinfo("Statistiques DB", stats_text)
+            
+            # Fenêtre défilante: le rapport par empreinte dépasse une boîte de message
+            stats_window = tk.Toplevel(self.root)
+            stats_window.title("Statistiques DB")
+            stats_window.geometry("900x600")
+            
+            frame = tk.Frame(stats_window)
+            frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+            
+            scrollbar = tk.Scrollbar(frame)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            
+            text_widget = tk.Text(frame, wrap=tk.WORD, yscrollcommand=scrollbar.set)
+            text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            scrollbar.config(command=text_widget.yview)
+            
+            text_widget.insert(tk.END, stats_text)
+            text_widget.config(state=tk.DISABLED)  # Lecture seule
+            
+            button_frame = tk.Frame(stats_window)
+            button_frame.pack(pady=10)
+            tk.Button(button_frame, text="Réinitialiser",
+                     command=lambda: (self.db_manager.reset_stats(), stats_window.destroy())).pack(side=tk.LEFT, padx=5)
+            tk.Button(button_frame, text="Fermer", command=stats_window.destroy).pack(side=tk.LEFT, padx=5)
         except Exception as e:
             self.log_error(f"Erreur lors de l'affichage des statistiques: {str(e)}")
             messagebox.showerror("Erreur", f"Impossible d'afficher les statistiques: {str(e)}")
     
+    def optimize_database(self):
+        """Maintenance: mettre à jour les statistiques du planificateur (PRAGMA optimize)"""
+        try:
+            self.db_manager.optimize()
+            messagebox.showinfo("Maintenance", "Statistiques de la base de données mises à jour.")
+        except Exception as e:
+            self.log_error("Erreur lors de l'optimisation de la base", e)
+            messagebox.showerror("Erreur", f"Impossible d'optimiser la base:\n{str(e)}")
+    
+    def show_index_advisor(self):
+        """Proposer des index à partir des requêtes enregistrées depuis le démarrage"""
+        try:
+            proposals = self.db_manager.advise_indexes()
+            
+            if not proposals:
+                messagebox.showinfo("Conseiller d'index",
+                                    "Aucun parcours complet coûteux dans les requêtes enregistrées.\n"
+                                    "Utilisez l'application quelques temps puis relancez l'analyse.")
+                return
+            
+            report = "Index proposés d'après les requêtes enregistrées\n"
+            report += "(coût estimé en lignes lues, cumulé sur les appels)\n\n"
+            for proposal in proposals:
+                report += f"{proposal['sql']}\n"
+                report += f"  Table: {proposal['table']} ({proposal['rows']} lignes), {proposal['calls']} appels\n"
+                report += f"  Coût estimé: {proposal['cost_before']:.0f} -> {proposal['cost_after']:.0f}\n"
+                for query in proposal['queries']:
+                    report += f"  - {query['fingerprint'][:150]}\n"
+                    report += f"    avant: {'; '.join(query['plan_before'])}\n"
+                    report += f"    après: {'; '.join(query['plan_after'])}\n"
+                report += "\n"
+            
+            advisor_window = tk.Toplevel(self.root)
+            advisor_window.title("Conseiller d'index")
+            advisor_window.geometry("900x600")
+            
+            frame = tk.Frame(advisor_window)
+            frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+            
+            scrollbar = tk.Scrollbar(frame)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            
+            text_widget = tk.Text(frame, wrap=tk.WORD, yscrollcommand=scrollbar.set)
+            text_widget.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            scrollbar.config(command=text_widget.yview)
+            
+            text_widget.insert(tk.END, report)
+            text_widget.config(state=tk.DISABLED)  # Lecture seule
+            
+            def create_indexes():
+                if not messagebox.askyesno("Confirmation",
+                                           f"Créer {len(proposals)} index? La création peut prendre "
+                                           "du temps sur une base volumineuse."):
+                    return
+                try:
+                    created = self.db_manager.apply_index_proposals(proposals)
+                    logging.info(f"Index créés par le conseiller: {', '.join(created)}")
+                    messagebox.showinfo("Conseiller d'index", f"{len(created)} index créés.")
+                    advisor_window.destroy()
+                except Exception as e:
+                    self.log_error("Erreur lors de la création des index", e)
+                    messagebox.showerror("Erreur", f"Impossible de créer les index:\n{str(e)}")
+            
+            button_frame = tk.Frame(advisor_window)
+            button_frame.pack(pady=10)
+            tk.Button(button_frame, text="Créer les index", command=create_indexes).pack(side=tk.LEFT, padx=5)
+            tk.Button(button_frame, text="Fermer", command=advisor_window.destroy).pack(side=tk.LEFT, padx=5)
+            
+        except Exception as e:
+            self.log_error("Erreur lors de l'analyse des index", e)
+            messagebox.showerror("Erreur", f"Impossible d'analyser les index:\n{str(e)}")
+    
+    def request_backup(self):
+        """Lancer une sauvegarde immédiate sur le thread de sauvegarde"""
+        try:
+            backup_manager = self.db_manager.start_backups(BACKUP_DIR)
+            backup_manager.request()
+            messagebox.showinfo("Sauvegarde",
+                                "Sauvegarde lancée en arrière-plan.\n"
+                                "Sa progression est visible dans Statistiques DB.")
+        except Exception as e:
+            self.log_error("Erreur lors du lancement de la sauvegarde", e)
+            messagebox.showerror("Erreur", f"Impossible de lancer la sauvegarde:\n{str(e)}")
+    
+    def close_shift(self):
+        """Clôture de poste: maintenance de la base et checkpoint TRUNCATE pour repartir avec un WAL vide"""
+        if not messagebox.askyesno("Clôture de poste",
+                                   "Mettre à jour les statistiques, recopier le journal WAL dans la base et le vider ?\n"
+                                   "Les ventes en cours seront brièvement mises en attente."):
+            return
+        self.run_in_background("la clôture de poste", self.show_shift_close, self.db_manager.close_shift)
+    
+    def show_shift_close(self, result):
+        """Résultat du checkpoint TRUNCATE"""
+        busy, log_frames, checkpointed = result
+        if busy:
+            messagebox.showwarning("Clôture de poste",
+                                   "Des lectures étaient encore en cours: le journal n'a pas pu être vidé.\n"
+                                   "Réessayez dans quelques instants.")
+        else:
+            messagebox.showinfo("Clôture de poste", f"Journal WAL vidé ({checkpointed} pages recopiées).")
+    
+    def archive_fiscal_year(self):
+        """Déplacer un exercice clos dans son fichier d'archive"""
+        year = simpledialog.askinteger("Archiver un exercice", "Exercice clos à archiver (année):",
+                                       parent=self.root, minvalue=2000, maxvalue=datetime.now().year - 1)
+        if year is None or not messagebox.askyesno(
+                "Archiver un exercice",
+                f"Déplacer les transactions, lignes de facture et paiements de {year} dans archive_{year}.db ?\n"
+                "Les écritures sont suspendues pendant le déplacement."):
+            return
+        self.run_in_background(f"l'archivage de {year}",
+                               lambda moved: self.show_archive_result(f"Exercice {year} archivé", moved),
+                               self.db_manager.archive_year, year)
+    
+    def restore_fiscal_year(self):
+        """Remettre un exercice archivé dans les tables courantes"""
+        years = self.db_manager.archived_years()
+        if not years:
+            messagebox.showinfo("Restaurer un exercice", "Aucun exercice archivé.")
+            return
+        year = simpledialog.askinteger("Restaurer un exercice",
+                                       f"Exercice à restaurer ({', '.join(str(y) for y in years)}):",
+                                       parent=self.root, minvalue=min(years), maxvalue=max(years))
+        if year is None or year not in years:
+            return
+        self.run_in_background(f"la restauration de {year}",
+                               lambda restored: self.show_archive_result(f"Exercice {year} restauré", restored),
+                               self.db_manager.restore_year, year)
+    
+    def show_archive_result(self, title, counts):
+        """Lignes déplacées par table (vérifiées par nombre et empreinte)"""
+        details = "\n".join(f"- {table}: {count} lignes" for table, count in counts.items())
+        messagebox.showinfo(title, f"{details}\n\nNombre de lignes et empreintes vérifiés.")
+    
+    def rebuild_daily_sales(self):
+        """Recalculer les cumuls journaliers du tableau de bord depuis les transactions"""
+        if not messagebox.askyesno("Ventes journalières",
+                                   "Recalculer les cumuls journaliers des ventes depuis les transactions ?\n"
+                                   "Les écritures sont suspendues pendant le calcul."):
+            return
+        self.run_in_background("le recalcul des ventes journalières",
+                               lambda _: messagebox.showinfo("Ventes journalières", "Cumuls journaliers recalculés."),
+                               self.db_manager.rebuild_daily_sales)
+    
+    def run_in_background(self, label, callback, func, *args):
+        """Exécuter une opération longue sur un thread de travail puis afficher
+        son résultat (callback) sans bloquer l'interface"""
+        try:
+            future = self.db_manager.run_in_executor(func, *args)
+        except Exception as e:
+            self.log_error(f"Erreur lors du lancement de {label}", e)
+            messagebox.showerror("Erreur", f"Impossible de lancer {label}:\n{str(e)}")
+            return
+        
+        def check():
+            if not future.done():
+                self.root.after(100, check)
+                return
+            try:
+                result = future.result()
+            except Exception as e:
+                self.log_error(f"Erreur lors de {label}", e)
+                messagebox.showerror("Erreur", f"Échec de {label}:\n{str(e)}")
+                return
+            callback(result)
+        self.root.after(100, check)
+    
     def show_logs(self):
         """Afficher le fichier log le plus récent"""
         try:
@@ -277,8 +533,17 @@ Optimisé pour écran tactile
                 self.setup_exception_handler()
                 # Nettoyer les connexions inactives toutes les 5 minutes
                 self.root.after(300000, self.cleanup_db_connections)
+                # Checkpoints du WAL pendant les périodes calmes
+                self.root.after(CHECKPOINT_CHECK_MS, self.checkpoint_when_idle)
+                # Expédier les ventes au siège au fil de l'eau
+                if REPLICATION_TARGET:
+                    self.db_manager.start_replication(REPLICATION_SOURCE or platform.node(), REPLICATION_TARGET)
+                # Sauvegarde quotidienne en arrière-plan (ne bloque pas les ventes)
+                self.db_manager.start_backups(BACKUP_DIR)
                 logging.info(f"Application démarrée par l'utilisateur: {self.current_user} ({self.user_role})")
                 self.root.mainloop()
+                self.db_manager.stop_replication()
+                self.db_manager.stop_backups()
         except Exception as e:
             self.log_error("Erreur lors de l'exécution de l'application", e)
             messagebox.showerror("Erreur critique", 
@@ -293,6 +558,14 @@ Optimisé pour écran tactile
         except Exception as e:
             self.log_error(f"Erreur lors du nettoyage des connexions: {str(e)}")
     
+    def checkpoint_when_idle(self):
+        """Lancer un checkpoint PASSIVE en arrière-plan quand les ventes marquent une pause"""
+        try:
+            self.db_manager.checkpoint_if_idle()
+        except Exception as e:
+            self.log_error(f"Erreur lors du checkpoint: {str(e)}")
+        self.root.after(CHECKPOINT_CHECK_MS, self.checkpoint_when_idle)
+    
     def setup_exception_handler(self):
         """Configure un gestionnaire global d'exceptions non gérées"""
         def handle_exception(exc_type, exc_value, exc_traceback):
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Archivage des exercices clos
+Les transactions, lignes de facture et paiements d'un exercice clos sont
+déplacés dans archive_<année>.db: les tables courantes (et leurs index) ne
+gardent que les exercices ouverts. Chaque connexion attache les archives et
+crée les vues temporaires historique_<table> (UNION ALL des tables courantes
+et archivées) pour les rapports qui portent sur tout l'historique.
+
+Le déplacement est vérifié (nombre de lignes et empreinte SHA-256 des lignes
+copiées) avant la suppression, et réversible (restore). En WAL, une
+transaction n'est pas atomique entre fichiers: la copie (INSERT OR REPLACE,
+ID conservés) précède la suppression, une reprise termine l'opération.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+from datetime import date, datetime
+
+from . import migrations
+from .sharding import SHARDED_TABLES, shard_definitions
+
+# Tables archivées, dans l'ordre de copie (les lignes de facture suivent leur
+# transaction; les suppressions se font dans l'ordre inverse)
+ARCHIVED_TABLES = ("transactions", "lignes_facture", "paiements_avance")
+
+_NAME_RE = re.compile(r"^archive_(\d{4})\.db$")
+_CREATE_INDEX_RE = re.compile(r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(IF\s+NOT\s+EXISTS\s+)?", re.IGNORECASE)
+
+
+def year_bounds(year):
+    """Bornes de clé de jour (aaaammjj) d'un exercice"""
+    return year * 10000 + 101, year * 10000 + 1231
+
+
+def table_columns(conn, schema, table, generated=True):
+    """Colonnes d'une table (sans les colonnes générées si generated=False)"""
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_xinfo({table})")
+            if generated or row[6] not in (2, 3)]
+
+
+def checksum(conn, query, params=()):
+    """(nombre de lignes, empreinte SHA-256) du résultat d'une requête triée"""
+    digest = hashlib.sha256()
+    count = 0
+    for row in conn.execute(query, params):
+        digest.update(repr(row).encode("utf-8"))
+        count += 1
+    return count, digest.hexdigest()
+
+
+class ArchiveVerificationError(sqlite3.DatabaseError):
+    """Les lignes copiées ne correspondent pas aux lignes d'origine"""
+
+
+class ArchiveStore:
+    """Fichiers d'archive par exercice: déplacement, restauration, attache et vues"""
+    
+    def __init__(self, db_manager, directory):
+        self.db_manager = db_manager
+        self.directory = directory
+        self.years = []  # Exercices archivés présents dans le répertoire
+        self.columns = {}  # table -> colonnes de la table courante
+        self.archive_columns = {}  # (année, table) -> colonnes de la table archivée
+    
+    def archive_path(self, year):
+        """Chemin du fichier d'archive d'un exercice"""
+        return os.path.join(self.directory, f"archive_{year}.db")
+    
+    @staticmethod
+    def schema_name(year):
+        """Nom d'attache du fichier d'archive d'un exercice"""
+        return f"archive_{year}"
+    
+    @staticmethod
+    def view_name(table):
+        """Vue temporaire courant + archives d'une table"""
+        return f"historique_{table}"
+    
+    def scan(self, conn):
+        """Relever les archives présentes et les colonnes des tables"""
+        self.columns = {table: table_columns(conn, "main", table) for table in ARCHIVED_TABLES}
+        self.years = []
+        self.archive_columns = {}
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                match = _NAME_RE.match(name)
+                if match:
+                    self.years.append(int(match.group(1)))
+        for year in self.years:
+            archive = sqlite3.connect(self.archive_path(year))
+            try:
+                for table in ARCHIVED_TABLES:
+                    self.archive_columns[(year, table)] = table_columns(archive, "main", table)
+            finally:
+                archive.close()
+    
+    # ------------------------------------------------------------------
+    # Attache (chaque connexion du pool, après les fichiers des stations)
+    # ------------------------------------------------------------------
+    def attach(self, conn):
+        """Attacher les archives et créer les vues historique_<table>"""
+        for year in self.years:
+            conn.execute(f"ATTACH DATABASE ? AS {self.schema_name(year)}", (self.archive_path(year),))
+        for table in ARCHIVED_TABLES:
+            conn.execute(f"DROP VIEW IF EXISTS temp.{self.view_name(table)}")
+            conn.execute(f"CREATE TEMP VIEW {self.view_name(table)} AS {self.union_sql(table)}")
+    
+    def union_sql(self, table):
+        """UNION ALL de la table courante (non qualifiée: vue de fédération des
+        stations le cas échéant) et des tables archivées; une colonne ajoutée
+        après l'archivage vaut NULL dans les lignes archivées"""
+        columns = self.columns[table]
+        selects = [f"SELECT {', '.join(columns)} FROM {table}"]
+        for year in self.years:
+            archived = self.archive_columns.get((year, table), [])
+            values = ", ".join(column if column in archived else f"NULL AS {column}" for column in columns)
+            selects.append(f"SELECT {values} FROM {self.schema_name(year)}.{table}")
+        return " UNION ALL ".join(selects)
+    
+    # ------------------------------------------------------------------
+    # Déplacements (connexion dédiée, hors transaction)
+    # ------------------------------------------------------------------
+    def _hot_sources(self, table):
+        """Tables courantes d'une table: la base de référence et, pour une table
+        répartie, la table de chaque station ((nom qualifié, station_id ou None))"""
+        sources = [(f"main.{table}", None)]
+        shards = self.db_manager.shards
+        if shards is not None and table in SHARDED_TABLES:
+            sources.extend((shards.table_name(table, station_id), station_id) for station_id in shards.station_ids)
+        return sources
+    
+    def _attach_for_move(self, conn, year):
+        """Attacher l'archive et les fichiers des stations (sans vues)"""
+        conn.execute(f"ATTACH DATABASE ? AS {self.schema_name(year)}", (self.archive_path(year),))
+        for station_id, path in self.db_manager.shard_paths().items():
+            conn.execute(f"ATTACH DATABASE ? AS {self.db_manager.shards.schema_name(station_id)}", (path,))
+    
+    def _selection(self, table, year):
+        """Condition des lignes d'une table qui appartiennent à l'exercice.
+        
+        Une ligne de facture suit sa transaction; une ligne sans transaction
+        suit la date de sa facture"""
+        schema = self.schema_name(year)
+        first, last = year_bounds(year)
+        if table == "lignes_facture":
+            return (f"(transaction_id IN (SELECT id FROM {schema}.transactions) OR "
+                    f"(transaction_id IS NULL AND facture_id IN "
+                    f"(SELECT id FROM main.factures WHERE jour BETWEEN {first} AND {last})))")
+        return f"jour BETWEEN {first} AND {last}"
+    
+    def _hot_union(self, table, columns):
+        return " UNION ALL ".join(f"SELECT {columns} FROM {source}" for source, _ in self._hot_sources(table))
+    
+    def _create_tables(self, conn, schema):
+        """Créer les tables de l'archive (sans clés étrangères) et leurs index"""
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.archive_info (
+                nom_table TEXT PRIMARY KEY,
+                lignes INTEGER NOT NULL,
+                empreinte TEXT NOT NULL,
+                date_archivage TIMESTAMP NOT NULL
+            )
+        """)
+        for table in ARCHIVED_TABLES:
+            sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                               (table,)).fetchone()[0]
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {schema}.{table} ({', '.join(shard_definitions(sql))})")
+            for (index_sql,) in conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'index' "
+                                             "AND tbl_name = ? AND sql IS NOT NULL", (table,)).fetchall():
+                conn.execute(_CREATE_INDEX_RE.sub(
+                    lambda m: f"CREATE {m.group(1) or ''}INDEX IF NOT EXISTS {schema}.", index_sql, count=1))
+    
+    def _verify(self, conn, table, year, ids_query):
+        """Comparer les lignes courantes et archivées dont l'ID est dans ids_query"""
+        schema = self.schema_name(year)
+        columns = ", ".join(table_columns(conn, "main", table, generated=False))
+        hot = checksum(conn, f"SELECT {columns} FROM ({self._hot_union(table, columns)}) "
+                             f"WHERE id IN ({ids_query}) ORDER BY id")
+        archived = checksum(conn, f"SELECT {columns} FROM {schema}.{table} WHERE id IN ({ids_query}) ORDER BY id")
+        if hot != archived:
+            raise ArchiveVerificationError(
+                f"Vérification de {table} ({year}) échouée: {hot[0]} lignes courantes, {archived[0]} archivées")
+        return hot[0]
+    
+    def _record_info(self, conn, schema):
+        """Nombre de lignes et empreinte du contenu de chaque table archivée"""
+        for table in ARCHIVED_TABLES:
+            columns = ", ".join(table_columns(conn, schema, table, generated=False))
+            count, digest = checksum(conn, f"SELECT {columns} FROM {schema}.{table} ORDER BY id")
+            conn.execute(f"INSERT OR REPLACE INTO {schema}.archive_info VALUES (?, ?, ?, ?)",
+                         (table, count, digest, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    
+    def _bump_counters(self, conn):
+        """Signaler la modification aux caches des autres processus (les tables
+        des stations n'ont pas de trigger de compteur)"""
+        if conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = 'compteurs_modifications'").fetchone():
+            conn.executemany("UPDATE main.compteurs_modifications SET version = version + 1 WHERE nom_table = ?",
+                             [(table,) for table in ARCHIVED_TABLES])
+    
+    def archive(self, conn, year):
+        """Déplacer un exercice clos dans son fichier d'archive (rejouable);
+        retourne {table: lignes déplacées}"""
+        if year >= date.today().year:
+            raise ValueError(f"L'exercice {year} n'est pas clos")
+        os.makedirs(self.directory, exist_ok=True)
+        schema = self.schema_name(year)
+        capture = conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = 'journal_modifications'").fetchone()
+        
+        self._attach_for_move(conn, year)
+        try:
+            self._create_tables(conn, schema)
+            moved = {}
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ARCHIVED_TABLES:
+                    columns = ", ".join(table_columns(conn, "main", table, generated=False))
+                    condition = self._selection(table, year)
+                    for source, _ in self._hot_sources(table):
+                        conn.execute(f"INSERT OR REPLACE INTO {schema}.{table} ({columns}) "
+                                     f"SELECT {columns} FROM {source} WHERE {condition}")
+                    selected = self._hot_union(table, "id, " + self._selection_columns(table))
+                    moved[table] = self._verify(conn, table, year, f"SELECT id FROM ({selected}) WHERE {condition}")
+                
+                # Un archivage n'est pas une suppression à répliquer vers le siège
+                if capture:
+                    migrations.suspend_capture(conn)
+                for table in reversed(ARCHIVED_TABLES):
+                    condition = self._selection(table, year)
+                    for source, _ in self._hot_sources(table):
+                        conn.execute(f"DELETE FROM {source} WHERE {condition}")
+                if capture:
+                    migrations.suspend_capture(conn, False)
+                self._bump_counters(conn)
+                self._record_info(conn, schema)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.execute("DETACH DATABASE " + schema)
+        return moved
+    
+    @staticmethod
+    def _selection_columns(table):
+        """Colonnes lues par la condition de sélection d'une table"""
+        return "transaction_id, facture_id" if table == "lignes_facture" else "jour"
+    
+    def restore(self, conn, year):
+        """Remettre un exercice archivé dans les tables courantes; retourne
+        {table: lignes restaurées}. Le fichier d'archive est conservé (à
+        supprimer une fois les connexions fermées)"""
+        schema = self.schema_name(year)
+        if not os.path.exists(self.archive_path(year)):
+            raise FileNotFoundError(f"Aucune archive pour l'exercice {year}")
+        capture = conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = 'journal_modifications'").fetchone()
+        
+        self._attach_for_move(conn, year)
+        try:
+            restored = {}
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if capture:
+                    migrations.suspend_capture(conn)
+                for table in ARCHIVED_TABLES:
+                    columns = ", ".join(table_columns(conn, schema, table, generated=False))
+                    sources = self._hot_sources(table)
+                    stations = [str(station_id) for _, station_id in sources if station_id is not None]
+                    for source, station_id in sources:
+                        if station_id is not None:
+                            condition = f"station_id = {station_id}"
+                        elif stations:
+                            condition = f"station_id NOT IN ({', '.join(stations)})"
+                        else:
+                            condition = "1"
+                        conn.execute(f"INSERT OR REPLACE INTO {source} ({columns}) "
+                                     f"SELECT {columns} FROM {schema}.{table} WHERE {condition}")
+                    restored[table] = self._verify(conn, table, year, f"SELECT id FROM {schema}.{table}")
+                if capture:
+                    migrations.suspend_capture(conn, False)
+                self._bump_counters(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.execute("DETACH DATABASE " + schema)
+        return restored
+    
+    def verify(self, year):
+        """Recalculer le nombre de lignes et l'empreinte de chaque table d'une
+        archive et les comparer à ceux enregistrés à l'archivage"""
+        archive = sqlite3.connect(self.archive_path(year))
+        try:
+            recorded = {row[0]: (row[1], row[2]) for row in
+                        archive.execute("SELECT nom_table, lignes, empreinte FROM archive_info")}
+            result = {}
+            for table in ARCHIVED_TABLES:
+                columns = ", ".join(table_columns(archive, "main", table, generated=False))
+                actual = checksum(archive, f"SELECT {columns} FROM {table} ORDER BY id")
+                expected = recorded.get(table, (0, None))
+                if expected[0] != actual[0]:
+                    raise ArchiveVerificationError(
+                        f"Archive {year} altérée: {table} contient {actual[0]} lignes (attendu: {expected[0]})")
+                if expected[1] != actual[1]:
+                    raise ArchiveVerificationError(f"Archive {year} altérée: empreinte de {table} différente")
+                result[table] = actual[0]
+            return result
+        finally:
+            archive.close()
@@ -826,6 +826,8 @@ class StationEditDialog:
                 """
                 params = (nom, adresse, responsable)
                 self.db_manager.execute_insert(query, params)
+                # Fichier des ventes de la nouvelle station (répartition par station)
+                self.db_manager.refresh_shards()
                 messagebox.showinfo("Succès", "Station créée avec succès")
             
             self.callback()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Sauvegardes à chaud de la base avec rotation
+Copier gaz_station.db pendant que le WAL est actif donne une copie incohérente:
+la sauvegarde passe par l'API de sauvegarde SQLite, par étapes de quelques
+pages entrecoupées de pauses, sur une transaction de lecture qui ne bloque
+jamais les ventes (mode WAL). Chaque copie est vérifiée par PRAGMA quick_check
+avant d'être conservée; la rotation garde les dernières sauvegardes
+quotidiennes, hebdomadaires et mensuelles.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+_NAME_RE = re.compile(r"^(?P<base>.+)_(?P<stamp>\d{8}_\d{6})(?:_station_(?P<station>\d+)|_archive_(?P<year>\d{4}))?\.db$")
+_STAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def kept_stamps(stamps, daily=7, weekly=4, monthly=12):
+    """Horodatages à conserver: la plus récente sauvegarde de chacun des daily
+    derniers jours, des weekly dernières semaines et des monthly derniers mois"""
+    kept = set()
+    for count, period in ((daily, lambda d: d.date()),
+                          (weekly, lambda d: d.isocalendar()[:2]),
+                          (monthly, lambda d: (d.year, d.month))):
+        seen = []
+        for stamp in sorted(stamps, reverse=True):
+            key = period(datetime.strptime(stamp, _STAMP_FORMAT))
+            if key not in seen:
+                seen.append(key)
+                if len(seen) > count:
+                    break
+                kept.add(stamp)
+    return kept
+
+
+class BackupManager:
+    """Sauvegardes planifiées sur un thread de fond, avec métriques"""
+    
+    def __init__(self, db_manager, directory="sauvegardes", interval=24 * 3600, pages=256, sleep=0.01,
+                 keep_daily=7, keep_weekly=4, keep_monthly=12):
+        self.db_manager = db_manager
+        self.directory = directory
+        self.interval = interval  # Secondes entre deux sauvegardes planifiées
+        self.pages = pages  # Pages copiées par étape
+        self.sleep = sleep  # Pause entre deux étapes (laisse passer les écritures)
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.keep_monthly = keep_monthly
+        self.base_name = os.path.splitext(os.path.basename(db_manager.db_path))[0]
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.requested = False
+        self.thread = None
+        self.metrics = {
+            "runs": 0,
+            "failures": 0,
+            "running": False,
+            "progress": 0.0,
+            "last_backup": None,
+            "last_duration": 0.0,
+            "last_size": 0,
+            "last_error": None
+        }
+    
+    # ------------------------------------------------------------------
+    # Sauvegarde
+    # ------------------------------------------------------------------
+    def backup_now(self):
+        """Sauvegarder la base (avec les fichiers des stations et les archives) puis
+        appliquer la rotation; retourne les chemins des copies vérifiées"""
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            stamp = datetime.now().strftime(_STAMP_FORMAT)
+            sources = [(self.db_manager.db_path, f"{self.base_name}_{stamp}.db")]
+            for station_id, path in self.db_manager.shard_paths().items():
+                sources.append((path, f"{self.base_name}_{stamp}_station_{station_id}.db"))
+            # Les archives des exercices clos sont la seule copie de ces ventes
+            for year in self.db_manager.archived_years():
+                sources.append((self.db_manager.archives.archive_path(year), f"{self.base_name}_{stamp}_archive_{year}.db"))
+            
+            start = time.time()
+            self.metrics["running"] = True
+            self.metrics["progress"] = 0.0
+            written = []
+            try:
+                for index, (source_path, name) in enumerate(sources):
+                    target_path = os.path.join(self.directory, name)
+                    self._copy(source_path, target_path + ".partiel", index, len(sources))
+                    os.replace(target_path + ".partiel", target_path)
+                    written.append(target_path)
+            except Exception as e:
+                for path in written:
+                    self._remove(path)
+                self.metrics["failures"] += 1
+                self.metrics["last_error"] = str(e)
+                self.db_manager._log_error(f"Échec de la sauvegarde: {str(e)}")
+                raise
+            finally:
+                self.metrics["running"] = False
+            
+            self.metrics["runs"] += 1
+            self.metrics["progress"] = 1.0
+            self.metrics["last_backup"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.metrics["last_duration"] = time.time() - start
+            self.metrics["last_size"] = sum(os.path.getsize(path) for path in written)
+            self.metrics["last_error"] = None
+            self.rotate()
+            return written
+    
+    def _copy(self, source_path, target_path, index, count):
+        """Copier une base par étapes puis vérifier la copie (quick_check)"""
+        def progress(status, remaining, total):
+            done = (total - remaining) / total if total else 1.0
+            self.metrics["progress"] = (index + done) / count
+        
+        source = sqlite3.connect(source_path, timeout=20, isolation_level=None)
+        target = sqlite3.connect(target_path)
+        try:
+            source.execute("PRAGMA query_only = ON")
+            # Transaction de lecture ouverte: la copie porte sur une seule version de
+            # la base et ne redémarre pas quand une vente est validée entre deux étapes
+            source.execute("BEGIN")
+            try:
+                source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+                source.backup(target, pages=self.pages, progress=progress, sleep=self.sleep)
+            finally:
+                source.execute("COMMIT")
+            
+            result = target.execute("PRAGMA quick_check").fetchall()
+            if result != [("ok",)]:
+                raise sqlite3.DatabaseError(
+                    f"Copie corrompue ({os.path.basename(source_path)}): {'; '.join(row[0] for row in result[:5])}")
+        except Exception:
+            target.close()
+            self._remove(target_path)
+            raise
+        finally:
+            source.close()
+        target.close()
+    
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    # ------------------------------------------------------------------
+    # Rotation
+    # ------------------------------------------------------------------
+    def list_backups(self):
+        """Sauvegardes présentes: {horodatage: [chemins]} (base, stations et archives)"""
+        backups = {}
+        if not os.path.isdir(self.directory):
+            return backups
+        for name in os.listdir(self.directory):
+            match = _NAME_RE.match(name)
+            if match and match.group("base") == self.base_name:
+                backups.setdefault(match.group("stamp"), []).append(os.path.join(self.directory, name))
+        return backups
+    
+    def rotate(self):
+        """Supprimer les sauvegardes hors rotation; retourne le nombre de fichiers supprimés"""
+        backups = self.list_backups()
+        kept = kept_stamps(backups, self.keep_daily, self.keep_weekly, self.keep_monthly)
+        removed = 0
+        for stamp, paths in backups.items():
+            if stamp not in kept:
+                for path in paths:
+                    self._remove(path)
+                    removed += 1
+        return removed
+    
+    def last_backup_time(self):
+        """Date de la dernière sauvegarde présente dans le répertoire (ou None)"""
+        stamps = self.list_backups()
+        if not stamps:
+            return None
+        return datetime.strptime(max(stamps), _STAMP_FORMAT)
+    
+    # ------------------------------------------------------------------
+    # Planification sur un thread de fond
+    # ------------------------------------------------------------------
+    def start(self, check_every=60):
+        """Sauvegarder toutes les interval secondes (vérifié toutes les check_every secondes)"""
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, args=(check_every,), name="sauvegarde", daemon=True)
+            self.thread.start()
+    
+    def request(self):
+        """Demander une sauvegarde immédiate au thread de fond"""
+        self.requested = True
+        self.wake_event.set()
+    
+    def stop(self):
+        """Arrêter la planification (une sauvegarde en cours est terminée)"""
+        if self.thread is not None:
+            self.stop_event.set()
+            self.wake_event.set()
+            self.thread.join()
+            self.thread = None
+    
+    def _due(self):
+        last = self.last_backup_time()
+        return last is None or (datetime.now() - last).total_seconds() >= self.interval
+    
+    def _run(self, check_every):
+        while not self.stop_event.is_set():
+            if self.requested or self._due():
+                self.requested = False
+                try:
+                    self.backup_now()
+                except Exception:
+                    pass  # Erreur journalisée et comptée; nouvel essai au prochain passage
+            self.wake_event.wait(check_every)
+            self.wake_event.clear()
+    
+    def get_metrics(self):
+        """Métriques de la dernière sauvegarde et nombre de sauvegardes conservées"""
+        metrics = dict(self.metrics)
+        metrics["kept"] = len(self.list_backups())
+        return metrics
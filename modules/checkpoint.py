@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Points de contrôle (checkpoints) du journal WAL
+Le fichier -wal grossit tant que ses pages ne sont pas recopiées dans la base,
+et les lectures ralentissent avec lui. Les checkpoints PASSIVE (qui ne bloquent
+personne) sont faits pendant les périodes calmes, ou dès que le WAL dépasse une
+taille limite; un checkpoint TRUNCATE remet le WAL à zéro à la clôture de poste.
+Le checkpoint automatique de SQLite, exécuté par la vente qui valide, ne sert
+plus que de garde-fou.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Garde-fou: checkpoint automatique dans le thread qui valide au-delà de N pages
+AUTOCHECKPOINT_PAGES = 10000
+
+
+class CheckpointManager:
+    """Checkpoints du WAL de la base (et des fichiers des stations) avec métriques"""
+    
+    def __init__(self, db_manager, idle_seconds=5.0, wal_limit_bytes=16 * 1024 * 1024):
+        self.db_manager = db_manager
+        self.idle_seconds = idle_seconds  # Délai sans écriture avant un checkpoint PASSIVE
+        self.wal_limit_bytes = wal_limit_bytes  # Au-delà: checkpoint PASSIVE même en activité
+        self.lock = threading.Lock()
+        self.pending = None  # Checkpoint soumis au thread de travail et pas encore terminé
+        self.metrics = {
+            "passive": 0,
+            "truncate": 0,
+            "busy": 0,
+            "last_mode": None,
+            "last_checkpoint": None,
+            "last_checkpoint_time": None,
+            "last_duration": 0.0,
+            "log_frames": 0,
+            "checkpointed_frames": 0
+        }
+    
+    def _wal_paths(self):
+        """Fichiers -wal de la base et des fichiers des stations"""
+        paths = [self.db_manager.db_path]
+        paths.extend(self.db_manager.shard_paths().values())
+        return [path + "-wal" for path in paths]
+    
+    def wal_size(self):
+        """Taille totale des fichiers -wal (octets)"""
+        size = 0
+        for path in self._wal_paths():
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+    
+    def idle_time(self):
+        """Secondes écoulées depuis la dernière écriture dans un WAL"""
+        last_write = 0.0
+        for path in self._wal_paths():
+            try:
+                last_write = max(last_write, os.path.getmtime(path))
+            except OSError:
+                pass
+        return time.time() - last_write if last_write else float("inf")
+    
+    def checkpoint(self, mode="PASSIVE"):
+        """Exécuter un checkpoint (PASSIVE, FULL, RESTART ou TRUNCATE) sur une
+        connexion dédiée; retourne (bloqué, pages du WAL, pages recopiées).
+        
+        PASSIVE recopie ce qui peut l'être sans attendre personne. TRUNCATE
+        attend la fin des écritures et des lectures en cours (délai de la
+        connexion) puis vide le fichier -wal."""
+        mode = mode.upper()
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Mode de checkpoint inconnu: {mode}")
+        
+        with self.lock:
+            start = time.time()
+            conn = sqlite3.connect(self.db_manager.db_path, timeout=20, isolation_level=None)
+            try:
+                schemas = ["main"]
+                for station_id, path in self.db_manager.shard_paths().items():
+                    schema = f"station_{station_id}"
+                    conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+                    schemas.append(schema)
+                
+                busy, log_frames, checkpointed = 0, 0, 0
+                for schema in schemas:
+                    row = conn.execute(f"PRAGMA {schema}.wal_checkpoint({mode})").fetchone()
+                    busy += row[0]
+                    log_frames += max(row[1], 0)
+                    checkpointed += max(row[2], 0)
+            except sqlite3.Error as e:
+                self.db_manager._log_error(f"Erreur lors du checkpoint {mode}: {str(e)}")
+                raise
+            finally:
+                conn.close()
+            
+            self.metrics[mode.lower()] = self.metrics.get(mode.lower(), 0) + 1
+            if busy:
+                self.metrics["busy"] += 1
+            self.metrics["last_mode"] = mode
+            self.metrics["last_checkpoint"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.metrics["last_checkpoint_time"] = time.time()
+            self.metrics["last_duration"] = time.time() - start
+            self.metrics["log_frames"] = log_frames
+            self.metrics["checkpointed_frames"] = checkpointed
+            return busy, log_frames, checkpointed
+    
+    def checkpoint_if_idle(self):
+        """Lancer un checkpoint PASSIVE sur un thread de travail si la base est
+        calme (ou si le WAL dépasse la limite); retourne le Future, ou None.
+        
+        Prévu pour un minuteur de l'interface: la vérification ne lit que la
+        taille et la date des fichiers -wal."""
+        if self.pending is not None and not self.pending.done():
+            return None
+        size = self.wal_size()
+        if not size:
+            return None
+        if size <= self.wal_limit_bytes:
+            idle = self.idle_time()
+            if idle < self.idle_seconds:
+                return None  # Ventes en cours: attendre une période calme
+            last = self.metrics["last_checkpoint_time"]
+            lag = self.metrics["log_frames"] - self.metrics["checkpointed_frames"]
+            if last and idle > time.time() - last and not lag:
+                return None  # Rien d'écrit depuis le dernier checkpoint complet
+        self.pending = self.db_manager.run_in_executor(self.checkpoint, "PASSIVE")
+        return self.pending
+    
+    def get_metrics(self):
+        """Taille du WAL, retard (pages non recopiées au dernier checkpoint) et compteurs"""
+        metrics = dict(self.metrics)
+        metrics["wal_size"] = self.wal_size()
+        metrics["lag_frames"] = metrics["log_frames"] - metrics["checkpointed_frames"]
+        last = metrics.pop("last_checkpoint_time")
+        metrics["seconds_since_checkpoint"] = time.time() - last if last else None
+        return metrics
@@ -9,6 +9,17 @@ from tkinter import ttk, messagebox
 from datetime import datetime
 import re
 
+from .money import format_centimes
+
+
+def client_credit_text(exposure):
+    """Complément d'affichage du crédit encore disponible d'un client
+    (vide si le client n'a pas de plafond de crédit)"""
+    if not exposure or exposure["disponible"] is None:
+        return ""
+    return f" | Crédit disponible: {format_centimes(exposure['disponible'])}"
+
+
 class ClientManagement:
     def __init__(self, parent, db_manager):
         self.parent = parent
@@ -271,8 +282,14 @@ class ClientManagement:
         # Mettre à jour l'affichage
         client_name = values[1]  # Nom complet
         solde = values[3]  # Solde
+        try:
+            # Encours mémoïsé: recalculé seulement après une vente, un paiement ou une modification du client
+            credit = client_credit_text(self.db_manager.client_exposure(self.current_client))
+        except Exception as e:
+            credit = ""
+            messagebox.showerror("Erreur", f"Erreur lors du calcul de l'encours: {str(e)}")
         self.selected_client_label.config(
-            text=f"Client: {client_name} | Solde: {solde} DH"
+            text=f"Client: {client_name} | Solde: {solde} DH{credit}"
         )
         
         # Charger les véhicules
@@ -501,12 +518,12 @@ class VehicleDialog:
     def load_vehicle_data(self):
         """Charger les données du véhicule à modifier"""
         try:
-            query = "SELECT * FROM vehicules WHERE id = ?"
+            fields = ['id', 'client_id', 'matricule', 'marque', 'modele', 'type_carburant']
+            query = f"SELECT {', '.join(fields)} FROM vehicules WHERE id = ?"
             result = self.db_manager.execute_query(query, (self.vehicle_id,))
             
             if result:
                 vehicle_data = result[0]
-                fields = ['id', 'client_id', 'matricule', 'marque', 'modele', 'type_carburant']
                 
                 for i, field in enumerate(fields):
                     if field in self.vehicle_vars:
@@ -5,96 +5,848 @@ Optimisé pour de meilleures performances avec mise en cache et indexation
 """
 
 import sqlite3
+import asyncio
 import os
-import hashlib
+import sys
+import math
 import time
+import queue
 import functools
-from datetime import datetime, date
+import itertools
+import re
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
 import threading
 from threading import RLock
 
+from . import migrations
+from .archive import ArchiveStore
+from .backup import BackupManager
+from .checkpoint import AUTOCHECKPOINT_PAGES, CheckpointManager
+from .index_advisor import IndexAdvisor
+from .memoize import invalidate_tables, memo_stats, memoized
+from .money import to_centimes
+from .replication import Replicator
+from .report_snapshot import ReportSnapshot
+from .sharding import ShardRouter
+
+# Codes d'action de l'autorisateur SQLite correspondant à une écriture
+WRITE_ACTIONS = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+
+# Tables inconnues (requête non préparée sous l'autorisateur): dépend de toutes les tables
+ALL_TABLES = frozenset(["*"])
+
+
+def day_key(value, days=0):
+    """Clé de jour entière aaaammjj (colonne 'jour') d'une date, d'un datetime
+    ou d'une chaîne commençant par 'AAAA-MM-JJ', décalée de days jours.
+    
+    Une période incluant le jour de fin s'écrit en intervalle semi-ouvert:
+    jour >= day_key(debut) AND jour < day_key(fin, 1)"""
+    if isinstance(value, str):
+        value = datetime.strptime(value.strip()[:10], "%Y-%m-%d")
+    if days:
+        value = value + timedelta(days=days)
+    return value.year * 10000 + value.month * 100 + value.day
+
+
+class ConnectionPool:
+    """Pool borné de connexions SQLite: un rédacteur unique et N lecteurs.
+    
+    En mode WAL, les lecteurs (ouverts en query_only) lisent en parallèle
+    pendant que le rédacteur écrit. Les connexions sont empruntées puis
+    rendues au pool au lieu d'être attachées à un thread."""
+    
+    def __init__(self, factory, readers=4, timeout=20):
+        self.factory = factory  # factory(read_only) -> sqlite3.Connection
+        self.max_readers = readers
+        self.timeout = timeout
+        self.idle_readers = queue.LifoQueue()  # (connexion, heure de restitution, génération)
+        self.reader_count = 0
+        self.generation = 0  # Incrémentée par close_all: les lecteurs plus anciens sont fermés au retour
+        self.writer_conn = None
+        self.write_lock = RLock()  # Réentrant: un thread peut imbriquer les écritures
+        self.lock = RLock()
+        self.borrowed = {}  # Génération -> lecteurs empruntés (voir wait_retired)
+        self.returned = threading.Condition(self.lock)
+        self.created_at = time.time()
+        self.metrics = {
+            "reader_checkouts": 0,
+            "writer_checkouts": 0,
+            "reader_wait_total": 0.0,
+            "writer_wait_total": 0.0,
+            "max_wait": 0.0,
+            "readers_in_use": 0,
+            "peak_readers_in_use": 0,
+            "reader_busy_time": 0.0,
+            "writer_busy_time": 0.0
+        }
+    
+    def _record_wait(self, kind, waited):
+        """Comptabiliser un emprunt et son temps d'attente"""
+        with self.lock:
+            self.metrics[f"{kind}_checkouts"] += 1
+            self.metrics[f"{kind}_wait_total"] += waited
+            self.metrics["max_wait"] = max(self.metrics["max_wait"], waited)
+    
+    def _discard_reader(self, conn):
+        """Fermer un lecteur et libérer sa place dans le pool"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self.lock:
+            self.reader_count -= 1
+    
+    def _take_idle_reader(self, timeout=None):
+        """Reprendre un lecteur inactif de la génération courante (None si aucun)"""
+        while True:
+            try:
+                if timeout is None:
+                    conn, _, generation = self.idle_readers.get_nowait()
+                else:
+                    conn, _, generation = self.idle_readers.get(timeout=timeout)
+            except queue.Empty:
+                return None, None
+            if generation == self.generation:
+                return conn, generation
+            self._discard_reader(conn)  # Rendu pendant un close_all: configuration périmée
+    
+    @contextmanager
+    def reader(self):
+        """Emprunter une connexion en lecture seule"""
+        start = time.time()
+        conn, generation = self._take_idle_reader()
+        if conn is None:
+            with self.lock:
+                can_open = self.reader_count < self.max_readers
+                if can_open:
+                    self.reader_count += 1
+                    generation = self.generation
+            if can_open:
+                try:
+                    conn = self.factory(read_only=True)
+                except Exception:
+                    with self.lock:
+                        self.reader_count -= 1
+                    raise
+            else:
+                conn, generation = self._take_idle_reader(timeout=self.timeout)
+                if conn is None:
+                    raise sqlite3.OperationalError("Aucune connexion de lecture disponible (pool saturé)")
+        
+        checked_out = time.time()
+        self._record_wait("reader", checked_out - start)
+        with self.lock:
+            self.borrowed[generation] = self.borrowed.get(generation, 0) + 1
+            self.metrics["readers_in_use"] += 1
+            self.metrics["peak_readers_in_use"] = max(self.metrics["peak_readers_in_use"],
+                                                      self.metrics["readers_in_use"])
+        try:
+            yield conn
+        finally:
+            with self.lock:
+                self.metrics["readers_in_use"] -= 1
+                self.metrics["reader_busy_time"] += time.time() - checked_out
+                self.borrowed[generation] -= 1
+                if not self.borrowed[generation]:
+                    del self.borrowed[generation]
+                    self.returned.notify_all()
+                current = generation == self.generation
+                if current:
+                    # Remettre la connexion à disposition avec l'heure de restitution
+                    self.idle_readers.put((conn, time.time(), generation))
+            if not current:
+                # Empruntée avant un close_all: ne pas la remettre dans le pool
+                self._discard_reader(conn)
+    
+    @contextmanager
+    def writer(self):
+        """Emprunter la connexion d'écriture (exclusive)"""
+        start = time.time()
+        if not self.write_lock.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("Connexion d'écriture indisponible (délai dépassé)")
+        checked_out = time.time()
+        self._record_wait("writer", checked_out - start)
+        try:
+            if self.writer_conn is None:
+                self.writer_conn = self.factory(read_only=False)
+            yield self.writer_conn
+        finally:
+            with self.lock:
+                self.metrics["writer_busy_time"] += time.time() - checked_out
+            self.write_lock.release()
+    
+    def close_idle_readers(self, max_age=0):
+        """Fermer les lecteurs inutilisés depuis plus de max_age secondes"""
+        now = time.time()
+        kept = []
+        while True:
+            try:
+                conn, released_at, generation = self.idle_readers.get_nowait()
+            except queue.Empty:
+                break
+            if now - released_at >= max_age or generation != self.generation:
+                self._discard_reader(conn)
+            else:
+                kept.append((conn, released_at, generation))
+        for item in kept:
+            self.idle_readers.put(item)
+    
+    def for_each_idle_reader(self, func):
+        """Appliquer func(conn) à chaque lecteur inactif, retenu le temps de l'appel"""
+        taken = []
+        while True:
+            try:
+                taken.append(self.idle_readers.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            for conn, _, generation in taken:
+                if generation == self.generation:
+                    func(conn)
+        finally:
+            for item in taken:
+                self.idle_readers.put(item)
+    
+    def wait_retired(self, timeout=None):
+        """Attendre que les lecteurs empruntés avant le dernier close_all soient
+        rendus (et donc fermés); retourne False si le délai est dépassé"""
+        with self.returned:
+            return self.returned.wait_for(
+                lambda: all(generation == self.generation for generation in self.borrowed), timeout)
+    
+    def close_all(self):
+        """Fermer les lecteurs inactifs et la connexion d'écriture; les lecteurs
+        empruntés (génération précédente) seront fermés à leur restitution"""
+        with self.lock:
+            self.generation += 1
+        self.close_idle_readers()
+        with self.write_lock:
+            if self.writer_conn is not None:
+                try:
+                    self.writer_conn.close()
+                except sqlite3.Error:
+                    pass
+                self.writer_conn = None
+    
+    def get_metrics(self):
+        """Retourner les métriques d'attente et d'utilisation du pool"""
+        with self.lock:
+            metrics = dict(self.metrics)
+            open_connections = self.reader_count + (1 if self.writer_conn is not None else 0)
+        elapsed = max(time.time() - self.created_at, 1e-6)
+        metrics["open_connections"] = open_connections
+        metrics["max_readers"] = self.max_readers
+        metrics["avg_reader_wait"] = metrics["reader_wait_total"] / max(1, metrics["reader_checkouts"])
+        metrics["avg_writer_wait"] = metrics["writer_wait_total"] / max(1, metrics["writer_checkouts"])
+        metrics["reader_utilization"] = metrics["reader_busy_time"] / (elapsed * self.max_readers)
+        metrics["writer_utilization"] = metrics["writer_busy_time"] / elapsed
+        return metrics
+
+
+class WriteQueue:
+    """Thread rédacteur unique avec validation groupée (group commit).
+    
+    Les écritures soumises par tous les threads sont prises dans une file et
+    validées par petits lots: un seul COMMIT (donc un seul fsync) par lot, au
+    prix d'une latence d'au plus max_latency secondes. Chaque écriture est
+    isolée dans un SAVEPOINT: un échec n'annule pas les autres du lot."""
+    
+    def __init__(self, db_manager, max_batch=64, max_latency=0.005):
+        self.db_manager = db_manager
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+        self.metrics = {"writes": 0, "batches": 0, "max_batch_size": 0, "failures": 0}
+        self.last_batch_size = 1
+        self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self.thread.start()
+    
+    def submit(self, kind, query, params, table=None):
+        """Mettre une écriture en file; le Future reçoit lastrowid ('insert') ou rowcount ('update')"""
+        future = Future()
+        self.requests.put((kind, query, params, table, future))
+        return future
+    
+    def stop(self):
+        """Vider la file puis arrêter le thread rédacteur"""
+        self.requests.put(None)
+        self.thread.join()
+    
+    def is_writer_thread(self):
+        """Indiquer si l'appelant est le thread rédacteur lui-même"""
+        return threading.current_thread() is self.thread
+    
+    def _collect_batch(self, first):
+        """Compléter le lot jusqu'à max_batch écritures ou max_latency secondes"""
+        batch = [first]
+        deadline = time.time() + self.max_latency
+        # N'attendre que tant que le lot est plus petit que le précédent: sous faible
+        # charge (lots d'une écriture) la latence ajoutée est nulle
+        expected = self.last_batch_size
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            try:
+                if len(batch) < expected and remaining > 0:
+                    item = self.requests.get(timeout=remaining)
+                else:
+                    item = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.requests.put(None)  # Traiter l'arrêt après ce lot
+                break
+            batch.append(item)
+        return batch
+    
+    def _run(self):
+        while True:
+            first = self.requests.get()
+            if first is None:
+                return
+            batch = self._collect_batch(first)
+            self.last_batch_size = len(batch)
+            self._commit_batch(batch)
+    
+    def _commit_batch(self, batch):
+        """Exécuter un lot dans une seule transaction puis résoudre les Futures"""
+        db = self.db_manager
+        outcomes = []
+        try:
+            with db.transaction() as conn:
+                cursor = conn.cursor()
+                for kind, query, params, table, future in batch:
+                    start_time = time.time()
+                    conn.execute("SAVEPOINT ecriture")
+                    try:
+                        _, write_tables = db._execute_tracked(cursor, query, params)
+                        result = db._write_result(conn, cursor, kind, write_tables)
+                        db.profiler.record(query, params, time.time() - start_time, cursor.rowcount, conn)
+                        conn.execute("RELEASE ecriture")
+                        db._invalidate_written(write_tables, table)
+                        outcomes.append((future, result, None))
+                    except sqlite3.Error as e:
+                        conn.execute("ROLLBACK TO ecriture")
+                        conn.execute("RELEASE ecriture")
+                        db._log_error(f"Erreur d'écriture groupée: {str(e)}\nRequête: {query}\nParamètres: {params}")
+                        outcomes.append((future, None, sqlite3.Error(f"Erreur d'écriture dans la base de données: {str(e)}")))
+        except sqlite3.Error as e:
+            # Le COMMIT du lot a échoué: aucune écriture n'est validée
+            error = sqlite3.Error(f"Erreur de validation du lot d'écritures: {str(e)}")
+            outcomes = [(item[4], None, error) for item in batch]
+        
+        self.metrics["writes"] += len(batch)
+        self.metrics["batches"] += 1
+        self.metrics["max_batch_size"] = max(self.metrics["max_batch_size"], len(batch))
+        for future, result, error in outcomes:
+            if error is not None:
+                self.metrics["failures"] += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+    
+    def get_metrics(self):
+        """Retourner les métriques de validation groupée"""
+        metrics = dict(self.metrics)
+        metrics["avg_batch_size"] = metrics["writes"] / max(1, metrics["batches"])
+        metrics["queued"] = self.requests.qsize()
+        return metrics
+
+
+class QueryProfiler:
+    """Statistiques de latence par empreinte de requête.
+    
+    L'empreinte est le texte SQL sans ses littéraux (chaînes, nombres, listes IN),
+    de sorte que les variantes d'une même requête d'écran soient regroupées. Pour
+    chaque empreinte on garde un histogramme logarithmique des durées (p50/p95/p99)
+    et le nombre de lignes; au-delà du seuil, le plan (EXPLAIN QUERY PLAN) est
+    relevé une fois et les parcours complets de table sont signalés."""
+    
+    # Bornes supérieures des classes de l'histogramme: 50 µs × 1.5^i (jusqu'à ~2 min)
+    BUCKET_BOUNDS = tuple(0.00005 * 1.5 ** i for i in range(37))
+    
+    _COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+    _STRING_RE = re.compile(r"'(?:[^']|'')*'")
+    _NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+    _IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.I)
+    _SPACE_RE = re.compile(r"\s+")
+    _SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)(.*)$")
+    
+    def __init__(self, slow_threshold=0.1, max_slow=100):
+        self.slow_threshold = slow_threshold
+        self.lock = threading.Lock()
+        self.fingerprints = {}  # Texte SQL -> empreinte (mémorisé)
+        self.entries = {}  # Empreinte -> statistiques
+        self.slow_queries = deque(maxlen=max_slow)
+        self.slow_count = 0
+    
+    def fingerprint(self, query):
+        """Normaliser une requête: littéraux remplacés par ?, listes IN réduites"""
+        known = self.fingerprints.get(query)
+        if known is not None:
+            return known
+        text = self._COMMENT_RE.sub(" ", query)
+        text = self._STRING_RE.sub("?", text)
+        text = self._NUMBER_RE.sub("?", text)
+        text = self._IN_LIST_RE.sub("IN (...)", text)
+        text = self._SPACE_RE.sub(" ", text).strip()
+        if len(self.fingerprints) > 2000:
+            self.fingerprints.clear()
+        self.fingerprints[query] = text
+        return text
+    
+    def record(self, query, params, elapsed, rows, conn=None):
+        """Comptabiliser une exécution; conn sert à relever le plan d'une requête lente"""
+        fingerprint = self.fingerprint(query)
+        bucket = self._bucket(elapsed)
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            if entry is None:
+                entry = self.entries[fingerprint] = {
+                    "count": 0,
+                    "total_time": 0.0,
+                    "max_time": 0.0,
+                    "rows": 0,
+                    "histogram": [0] * (len(self.BUCKET_BOUNDS) + 1),
+                    "slow_count": 0,
+                    "plan": None,
+                    "full_scans": [],
+                    "sample": (query, params)  # Exemple rejouable (conseiller d'index)
+                }
+            entry["count"] += 1
+            entry["total_time"] += elapsed
+            entry["max_time"] = max(entry["max_time"], elapsed)
+            entry["rows"] += max(rows or 0, 0)
+            entry["histogram"][bucket] += 1
+            
+            if elapsed <= self.slow_threshold:
+                return
+            entry["slow_count"] += 1
+            entry["sample"] = (query, params)
+            need_plan = entry["plan"] is None
+        
+        if need_plan and conn is not None:
+            plan = self.explain(conn, query, params)
+            with self.lock:
+                entry["plan"] = plan
+                entry["full_scans"] = self.full_scans(plan)
+        
+        with self.lock:
+            self.slow_count += 1
+            self.slow_queries.append({
+                "query": query,
+                "fingerprint": fingerprint,
+                "params": params,
+                "time": elapsed,
+                "rows": rows,
+                "full_scans": entry["full_scans"],
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+    
+    @classmethod
+    def _bucket(cls, elapsed):
+        """Indice de la classe d'histogramme d'une durée"""
+        if elapsed <= cls.BUCKET_BOUNDS[0]:
+            return 0
+        index = int(math.ceil(math.log(elapsed / cls.BUCKET_BOUNDS[0], 1.5)))
+        return min(index, len(cls.BUCKET_BOUNDS))
+    
+    @classmethod
+    def percentile(cls, histogram, fraction):
+        """Estimer un percentile (borne supérieure de la classe qui le contient)"""
+        total = sum(histogram)
+        if not total:
+            return 0.0
+        rank = fraction * total
+        cumulative = 0
+        for index, count in enumerate(histogram):
+            cumulative += count
+            if cumulative >= rank:
+                return cls.BUCKET_BOUNDS[min(index, len(cls.BUCKET_BOUNDS) - 1)]
+        return cls.BUCKET_BOUNDS[-1]
+    
+    @staticmethod
+    def explain(conn, query, params=None):
+        """Relever EXPLAIN QUERY PLAN d'une requête (liste de lignes de détail)"""
+        try:
+            cursor = conn.execute(f"EXPLAIN QUERY PLAN {query}", params or ())
+            return [row[3] for row in cursor.fetchall()]
+        except sqlite3.Error:
+            return []
+    
+    @classmethod
+    def full_scans(cls, plan):
+        """Tables parcourues entièrement (SCAN sans index) dans un plan"""
+        tables = []
+        for detail in plan or ():
+            match = cls._SCAN_RE.match(detail)
+            if match and "USING" not in match.group(2) and match.group(1) != "CONSTANT":
+                tables.append(match.group(1))
+        return tables
+    
+    def samples(self):
+        """Charge enregistrée: (empreinte, requête exemple, paramètres, nombre d'appels)"""
+        with self.lock:
+            return [(fingerprint, entry["sample"][0], entry["sample"][1], entry["count"])
+                    for fingerprint, entry in self.entries.items()]
+    
+    def report(self, limit=10, order="total_time"):
+        """Empreintes triées par temps cumulé (ou 'p95', 'count', 'rows')"""
+        with self.lock:
+            items = [(fingerprint, dict(entry, histogram=list(entry["histogram"])))
+                     for fingerprint, entry in self.entries.items()]
+        
+        report = []
+        for fingerprint, entry in items:
+            histogram = entry.pop("histogram")
+            entry.pop("sample")
+            entry["fingerprint"] = fingerprint
+            entry["avg_time"] = entry["total_time"] / entry["count"]
+            entry["p50"] = self.percentile(histogram, 0.50)
+            entry["p95"] = self.percentile(histogram, 0.95)
+            entry["p99"] = self.percentile(histogram, 0.99)
+            report.append(entry)
+        report.sort(key=lambda entry: entry[order], reverse=True)
+        return report[:limit]
+    
+    def reset(self):
+        """Effacer toutes les statistiques"""
+        with self.lock:
+            self.entries.clear()
+            self.slow_queries.clear()
+            self.slow_count = 0
+
+
 class DatabaseManager:
-    def __init__(self, db_path="gaz_station.db"):
-        """Initialiser la connexion à la base de données"""
+    def __init__(self, db_path="gaz_station.db", readers=4, group_commit=False, shard_dir=None,
+                 archive_dir=None):
+        """Initialiser la connexion à la base de données.
+        
+        Avec shard_dir, les ventes de chaque station sont stockées dans un fichier
+        séparé de ce répertoire (voir enable_shards). Les exercices archivés sont
+        dans archive_dir (par défaut: le répertoire 'archives' de la base)."""
         self.db_path = db_path
-        self.connection_pool = {}
-        self.connection_lock = RLock()
-        self.query_cache = {}
+        self.connection_pool = ConnectionPool(self._open_connection, readers=readers)
+        self.executor = None  # Threads de travail de l'API asynchrone (créés à la demande)
+        self.executor_workers = readers + 1
+        self.executor_lock = threading.Lock()
+        self.query_cache = OrderedDict()  # Cache LRU: les entrées récentes en fin de liste
+        self.cache_lock = RLock()
+        self.cache_bytes = 0  # Taille estimée des résultats en cache
+        self.cache_max_bytes = 64 * 1024 * 1024  # Budget mémoire du cache (64 Mo)
+        self.cache_index = {}  # Index inverse: table -> clés de cache qui la lisent
+        self.reference_id_sets = {}  # Registre des identifiants des petites tables de référence
+        self.reference_id_generation = 0  # Incrémenté à chaque invalidation du registre
+        self.query_tables = {}  # Tables lues/écrites par texte SQL (relevées par l'autorisateur)
+        self.tracking = threading.local()
         self.cache_timeout = 60  # Durée de vie du cache en secondes
+        
+        # Cohérence du cache entre processus: PRAGMA data_version (connexion dédiée)
+        # puis compteurs de modifications par table (voir _check_coherence)
+        self.coherence_conn = None
+        self.coherence_lock = threading.Lock()
+        self.data_version = None
+        self.table_versions = {}
+        self.coherence_generation = 0  # Incrémenté à chaque invalidation par les compteurs
+        self.shards = None  # Répartition des ventes par station (activée après les migrations)
+        self.archives = None  # Exercices archivés (relevés après les migrations)
+        self.client_search_fts = None  # Index plein texte des clients (relevé à la première recherche)
         self.init_database()
         
+        # Archives attachées et vues historique_<table> sur toutes les connexions
+        if archive_dir is None:
+            archive_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), "archives")
+        archives = ArchiveStore(self, archive_dir)
+        with self.get_connection() as conn:
+            archives.scan(conn)
+        self.archives = archives
+        self.connection_pool.close_all()
+        
         # Statistiques de performance
         self.stats = {
             "cache_hits": 0,
             "cache_misses": 0,
-            "query_count": 0,
-            "slow_queries": []
+            "cache_evictions": 0,
+            "coherence_invalidations": 0,
+            "query_count": 0
         }
+        
+        # Latences par empreinte de requête et requêtes lentes (> 100ms)
+        self.profiler = QueryProfiler(slow_threshold=0.1)
+        
+        # File d'écriture optionnelle avec validation groupée
+        self.write_queue = None
+        if group_commit:
+            self.enable_write_queue()
     
-    def get_connection(self):
-        """Obtenir une connexion à la base de données avec gestion d'erreurs et pool de connexions"""
+        # Instantané des rapports lourds (créé au premier usage)
+        self.report_snapshot = None
+        self.snapshot_lock = threading.Lock()
+        
+        # Réplication vers le siège (voir start_replication)
+        self.replicator = None
+        
+        # Sauvegardes planifiées (voir start_backups)
+        self.backup_manager = None
+        
+        # Checkpoints du WAL pendant les périodes calmes (voir checkpoint_if_idle)
+        self.checkpoints = CheckpointManager(self)
+        
+        if shard_dir:
+            self.enable_shards(shard_dir)
+        
+        # Reprises des migrations appliquées à ce démarrage qui doivent voir les
+        # ventes réparties et archivées (rien à faire sur une base à jour)
+        self._run_after_attach()
+    
+    def _open_connection(self, read_only=False):
+        """Ouvrir une connexion configurée pour le pool"""
         try:
-            # Utiliser un pool de connexions pour réduire le temps d'ouverture
-            with self.connection_lock:
-                # Identifier le thread actuel
-                thread_id = id(threading.current_thread()) if threading else 0
-                
-                # Vérifier si une connexion existe déjà pour ce thread
-                if thread_id in self.connection_pool and self.connection_pool[thread_id]['conn']:
-                    # Vérifier que la connexion est toujours valide
-                    try:
-                        self.connection_pool[thread_id]['conn'].execute("SELECT 1")
-                        return self.connection_pool[thread_id]['conn']
-                    except sqlite3.Error:
-                        # La connexion n'est plus valide, la fermer
-                        try:
-                            self.connection_pool[thread_id]['conn'].close()
-                        except:
-                            pass
-                
-                # Créer une nouvelle connexion
-                conn = sqlite3.connect(self.db_path, timeout=20, isolation_level=None)
-                
-                # Optimisations SQLite
-                conn.execute("PRAGMA foreign_keys = ON")
-                conn.execute("PRAGMA journal_mode = WAL")  # Write-Ahead Logging pour de meilleures performances
-                conn.execute("PRAGMA synchronous = NORMAL")  # Réduire les opérations d'I/O synchrones
-                conn.execute("PRAGMA cache_size = 10000")  # Augmenter la taille du cache
-                conn.execute("PRAGMA temp_store = MEMORY")  # Stocker les tables temporaires en mémoire
-                
-                # Stocker la connexion dans le pool
-                self.connection_pool[thread_id] = {
-                    'conn': conn,
-                    'timestamp': time.time()
-                }
-                
-                return conn
+            # Connexion partageable entre threads: le pool garantit un seul emprunteur à la fois
+            conn = sqlite3.connect(self.db_path, timeout=20, isolation_level=None,
+                                   check_same_thread=False)
+            
+            # Optimisations SQLite
+            conn.execute("PRAGMA foreign_keys = ON")
+            conn.execute("PRAGMA journal_mode = WAL")  # Write-Ahead Logging pour de meilleures performances
+            conn.execute("PRAGMA synchronous = NORMAL")  # Réduire les opérations d'I/O synchrones
+            conn.execute("PRAGMA cache_size = 10000")  # Augmenter la taille du cache
+            conn.execute("PRAGMA temp_store = MEMORY")  # Stocker les tables temporaires en mémoire
+            # Checkpoints faits hors des ventes (CheckpointManager); l'automatique reste un garde-fou
+            conn.execute(f"PRAGMA wal_autocheckpoint = {AUTOCHECKPOINT_PAGES}")
+            if self.shards is not None:
+                self.shards.attach(conn)  # Fichiers des stations et vues de fédération
+            if self.archives is not None:
+                self.archives.attach(conn)  # Exercices archivés et vues historique_<table>
+            if read_only:
+                conn.execute("PRAGMA query_only = ON")  # Lecteur: toute écriture est refusée
+            
+            # Relever les tables réellement lues/écrites par chaque requête
+            conn.set_authorizer(self._authorizer)
+            return conn
         except sqlite3.Error as e:
             # Journaliser l'erreur et la propager
             self._log_error(f"Erreur de connexion à la base de données: {str(e)}")
             raise
     
-    def close_all_connections(self):
-        """Fermer toutes les connexions du pool"""
-        with self.connection_lock:
-            for thread_id, conn_data in list(self.connection_pool.items()):
+    @contextmanager
+    def get_connection(self, read_only=False):
+        """Emprunter une connexion au pool (lecture seule ou écriture) le temps d'un bloc with"""
+        if read_only:
+            with self.connection_pool.reader() as conn:
+                yield conn
+        else:
+            with self.connection_pool.writer() as conn:
+                yield conn
+    
+    @contextmanager
+    def transaction(self):
+        """Unité de travail: regrouper plusieurs écritures dans un seul commit atomique.
+        
+        Usage: with db.transaction(): ...
+        Les execute_insert/execute_update/execute_query du même thread utilisent la
+        connexion d'écriture de la transaction; l'invalidation du cache est différée
+        jusqu'au commit. Un bloc imbriqué devient un SAVEPOINT."""
+        state = getattr(self.tracking, "transaction", None)
+        
+        if state is not None:
+            # Transaction imbriquée: savepoint sur la même connexion
+            state["depth"] += 1
+            savepoint = f"sp_{state['depth']}"
+            conn = state["conn"]
+            conn.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield conn
+                conn.execute(f"RELEASE {savepoint}")
+            except BaseException:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+                raise
+            finally:
+                state["depth"] -= 1
+            return
+        
+        with self.connection_pool.writer() as conn:
+            state = {"conn": conn, "depth": 0, "tables": set()}
+            self.tracking.transaction = state
+            try:
+                # IMMEDIATE: prendre le verrou d'écriture dès le début pour éviter les interblocages
+                conn.execute("BEGIN IMMEDIATE")
                 try:
-                    conn_data['conn'].close()
-                except:
-                    pass
-                del self.connection_pool[thread_id]
+                    yield conn
+                except BaseException:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    raise
+                
+                try:
+                    conn.execute("COMMIT")
+                except sqlite3.Error as e:
+                    self._log_error(f"Erreur lors de la validation de la transaction: {str(e)}")
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                    raise
+            finally:
+                self.tracking.transaction = None
+            
+            # Invalidation différée: une seule fois, après le commit
+            if state["tables"]:
+                self.invalidate_cache(state["tables"])
+    
+    def in_transaction(self):
+        """Indiquer si le thread courant est dans un bloc db.transaction()"""
+        return getattr(self.tracking, "transaction", None) is not None
+    
+    def _invalidate_written(self, write_tables, table=None):
+        """Invalider les tables écrites, ou les différer jusqu'au commit de la transaction"""
+        tables = set(write_tables) | self._normalize_tables(table)
+        if not tables:
+            return
+        state = getattr(self.tracking, "transaction", None)
+        if state is not None:
+            state["tables"].update(tables)
+        else:
+            self.invalidate_cache(tables)
+    
+    def enable_write_queue(self, max_batch=64, max_latency=0.005):
+        """Activer le thread rédacteur unique: execute_insert/execute_update hors
+        transaction passent alors par la file et sont validés par lots"""
+        if self.write_queue is None:
+            self.write_queue = WriteQueue(self, max_batch=max_batch, max_latency=max_latency)
+    
+    def disable_write_queue(self):
+        """Arrêter le thread rédacteur après avoir traité les écritures en attente"""
+        if self.write_queue is not None:
+            self.write_queue.stop()
+            self.write_queue = None
+    
+    def _use_write_queue(self):
+        """La file est utilisée hors transaction et hors du thread rédacteur"""
+        return (self.write_queue is not None and not self.in_transaction()
+                and not self.write_queue.is_writer_thread())
+    
+    def submit_insert(self, query, params, table=None):
+        """Soumettre une insertion et retourner un Future de l'ID généré"""
+        if self._use_write_queue():
+            self.stats["query_count"] += 1
+            return self.write_queue.submit("insert", query, params, table)
+        return self._completed_future(self.execute_insert, query, params, table)
+    
+    def submit_update(self, query, params, table=None):
+        """Soumettre une mise à jour et retourner un Future du nombre de lignes affectées"""
+        if self._use_write_queue():
+            self.stats["query_count"] += 1
+            return self.write_queue.submit("update", query, params, table)
+        return self._completed_future(self.execute_update, query, params, table)
+    
+    @staticmethod
+    def _completed_future(func, query, params, table):
+        """Exécuter immédiatement une écriture et l'envelopper dans un Future terminé"""
+        future = Future()
+        try:
+            future.set_result(func(query, params, table=table))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    def close_all_connections(self):
+        """Fermer toutes les connexions du pool et arrêter les threads de l'API asynchrone"""
+        self.stop_replication()
+        self.stop_backups()
+        self.disable_write_queue()
+        if self.report_snapshot is not None:
+            self.report_snapshot.close()
+            self.report_snapshot = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.connection_pool.close_all()
+        with self.coherence_lock:
+            if self.coherence_conn is not None:
+                self.coherence_conn.close()
+                self.coherence_conn = None
+                self.data_version = None
     
     def cleanup_old_connections(self, max_age=300):
-        """Nettoyer les connexions inactives depuis plus de max_age secondes"""
-        current_time = time.time()
-        with self.connection_lock:
-            for thread_id, conn_data in list(self.connection_pool.items()):
-                if current_time - conn_data['timestamp'] > max_age:
-                    try:
-                        conn_data['conn'].close()
-                    except:
-                        pass
-                    del self.connection_pool[thread_id]
+        """Fermer les connexions de lecture inactives depuis plus de max_age secondes"""
+        self.connection_pool.close_idle_readers(max_age)
+    
+    def _authorizer(self, action, arg1, arg2, db_name, trigger):
+        """Callback SQLite appelé à la préparation: note les tables lues et écrites"""
+        collector = getattr(self.tracking, "collector", None)
+        if collector is None:
+            return sqlite3.SQLITE_OK
+        collector[2].append(action)  # La requête a bien été préparée
+        if arg1 and not arg1.startswith("sqlite_"):
+            if action == sqlite3.SQLITE_READ:
+                collector[0].add(arg1.lower())
+            elif action in WRITE_ACTIONS:
+                collector[1].add(arg1.lower())
+        return sqlite3.SQLITE_OK
+    
+    def _execute_tracked(self, cursor, query, params=None, many=False):
+        """Exécuter une requête et retourner les tables (lues, écrites) qu'elle touche.
+        
+        L'autorisateur n'est appelé que lors de la préparation; une requête déjà
+        présente dans le cache de statements de sqlite3 ne le déclenche plus, d'où
+        la mémorisation par texte SQL. Une requête préparée avant le relevé
+        (migrations, conn.execute direct) a des tables inconnues: ALL_TABLES,
+        sans mémorisation, jusqu'à une préparation observée. Avec many=True,
+        params est une séquence de jeux de paramètres passée à executemany."""
+        def run():
+            if many:
+                cursor.executemany(query, params)
+            elif params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+        
+        known = self.query_tables.get(query)
+        if known is not None:
+            run()
+            return known
+        
+        self.tracking.collector = (set(), set(), [])
+        try:
+            run()
+            read_tables, write_tables, actions = self.tracking.collector
+        finally:
+            self.tracking.collector = None
+        
+        if not actions:
+            # Statement repris du cache de sqlite3: l'autorisateur n'a rien vu
+            return ALL_TABLES, ALL_TABLES
+        
+        tables = (frozenset(read_tables), frozenset(write_tables))
+        # Les requêtes construites dynamiquement peuvent faire grossir la table
+        if len(self.query_tables) > 2000:
+            self.query_tables.clear()
+        self.query_tables[query] = tables
+        return tables
+    
+    def _write_result(self, conn, cursor, kind, write_tables):
+        """ID généré ('insert') ou nombre de lignes affectées ('update').
+        
+        Une écriture sur une table répartie par station passe par un trigger
+        INSTEAD OF: cursor.lastrowid et cursor.rowcount ne la voient pas. Tables
+        inconnues (ALL_TABLES): seul le compteur des écritures routées tranche."""
+        if self.shards is not None and self.shards.routes(write_tables):
+            last_id, rows = self.shards.last_write(conn)
+            if rows or write_tables != ALL_TABLES:
+                return last_id if kind == "insert" else rows
+        return cursor.lastrowid if kind == "insert" else cursor.rowcount
+    
+    @staticmethod
+    def _normalize_tables(table):
+        """Normaliser le paramètre table (nom, liste ou None) en ensemble de noms"""
+        if not table:
+            return set()
+        if isinstance(table, str):
+            return {table.lower()}
+        return {t.lower() for t in table if t}
     
     def _log_error(self, message):
         """Journaliser les erreurs dans un fichier de log"""
@@ -109,301 +861,145 @@ class DatabaseManager:
             f.write(f"[{timestamp}] {message}\n")
     
     def init_database(self):
-        """Créer les tables et les index si elles n'existent pas"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            conn.execute("BEGIN TRANSACTION")  # Accélérer les créations de tables avec une transaction
-            
-            # Table des stations
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS stations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nom TEXT NOT NULL,
-                    adresse TEXT,
-                    telephone TEXT,
-                    responsable TEXT,
-                    date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Table des clients (simplifiée)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS clients (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nom TEXT NOT NULL,
-                    prenom TEXT,
-                    telephone TEXT,
-                    solde_actuel REAL DEFAULT 0,
-                    date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Table des véhicules clients avec matricule marocain
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS vehicules (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    client_id INTEGER NOT NULL,
-                    matricule TEXT NOT NULL,
-                    marque TEXT,
-                    modele TEXT,
-                    type_carburant TEXT,
-                    FOREIGN KEY (client_id) REFERENCES clients (id)
-                )
-            """)
-            
-            # Table des types de carburant
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS carburants (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nom TEXT NOT NULL,
-                    prix_unitaire REAL NOT NULL,
-                    unite TEXT DEFAULT 'litre',
-                    couleur TEXT DEFAULT '#FF0000'
-                )
-            """)
-            
-            # Table des transactions de carburant
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    station_id INTEGER NOT NULL,
-                    client_id INTEGER NOT NULL,
-                    vehicule_id INTEGER,
-                    carburant_id INTEGER NOT NULL,
-                    quantite REAL NOT NULL,
-                    prix_unitaire REAL NOT NULL,
-                    montant_total REAL NOT NULL,
-                    type_paiement TEXT DEFAULT 'credit',
-                    date_transaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    numero_pompe INTEGER,
-                    notes TEXT,
-                    FOREIGN KEY (station_id) REFERENCES stations (id),
-                    FOREIGN KEY (client_id) REFERENCES clients (id),
-                    FOREIGN KEY (vehicule_id) REFERENCES vehicules (id),
-                    FOREIGN KEY (carburant_id) REFERENCES carburants (id)
-                )
-            """)
-            
-            # Table des paiements d'avance
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS paiements_avance (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    client_id INTEGER NOT NULL,
-                    montant REAL NOT NULL,
-                    mode_paiement TEXT NOT NULL,
-                    date_paiement TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    reference_paiement TEXT,
-                    notes TEXT,
-                    statut TEXT DEFAULT 'actif',
-                    FOREIGN KEY (client_id) REFERENCES clients (id)
-                )
-            """)
-            
-            # Table des factures
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS factures (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    numero_facture TEXT UNIQUE NOT NULL,
-                    client_id INTEGER NOT NULL,
-                    station_id INTEGER NOT NULL,
-                    date_facture DATE NOT NULL,
-                    montant_ht REAL NOT NULL,
-                    tva REAL NOT NULL,
-                    montant_ttc REAL NOT NULL,
-                    statut TEXT DEFAULT 'impayee',
-                    date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    notes TEXT,
-                    FOREIGN KEY (client_id) REFERENCES clients (id),
-                    FOREIGN KEY (station_id) REFERENCES stations (id)
-                )
-            """)
-            
-            # Table des lignes de facture
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS lignes_facture (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    facture_id INTEGER NOT NULL,
-                    transaction_id INTEGER,
-                    description TEXT NOT NULL,
-                    quantite REAL NOT NULL,
-                    prix_unitaire REAL NOT NULL,
-                    montant REAL NOT NULL,
-                    FOREIGN KEY (facture_id) REFERENCES factures (id),
-                    FOREIGN KEY (transaction_id) REFERENCES transactions (id)
-                )
-            """)
-            
-            # Table des utilisateurs pour le système de login
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS utilisateurs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nom_utilisateur TEXT UNIQUE NOT NULL,
-                    mot_de_passe TEXT NOT NULL,
-                    role TEXT NOT NULL CHECK (role IN ('administrateur', 'employe')),
-                    nom_complet TEXT,
-                    actif BOOLEAN DEFAULT 1,
-                    date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Créer des index pour optimiser les requêtes fréquentes
-            self.create_indexes(cursor)
-            
-            conn.commit()
-            
-            # Insérer des données initiales si la base est vide
-            self.insert_initial_data(cursor)
-            conn.commit()
-    
-    def create_indexes(self, cursor):
-        """Créer des index pour optimiser les requêtes fréquentes"""
-        # Index pour les recherches de clients
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_clients_nom ON clients (nom)")
-        
-        # Index pour les recherches de véhicules par client
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_vehicules_client ON vehicules (client_id)")
-        
-        # Index pour les recherches de transactions par client
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_client ON transactions (client_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date_transaction)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_station ON transactions (station_id)")
-        
-        # Index pour les recherches de paiements par client
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_paiements_client ON paiements_avance (client_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_paiements_date ON paiements_avance (date_paiement)")
-        
-        # Index pour les recherches de factures par client
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_factures_client ON factures (client_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_factures_date ON factures (date_facture)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_factures_numero ON factures (numero_facture)")
-        
-        # Index pour les lignes de facture
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_lignes_facture ON lignes_facture (facture_id)")
-        
-        # Analyser la base pour optimiser le planificateur de requêtes
-        cursor.execute("ANALYZE")
-    
-    def insert_initial_data(self, cursor):
-        """Insérer les données initiales"""
-        # Vérifier si des stations existent déjà
-        cursor.execute("SELECT COUNT(*) FROM stations")
-        if cursor.fetchone()[0] == 0:
-            # Insérer les 6 stations
-            stations = [
-                ("Station Timizar", "route Sidi Kacem", "05********", "Yassin Tyal"),
-                ("Station 2", "Local 2", "05********", "Géront 2"),
-                ("Station 3", "Local 3", "05********", "Géront 3"),
-                ("Station 4", "Local 4", "05********", "Géront 4"),
-                ("Station 5", "Local 5", "05********", "Géront 5"),
-                ("Station 6", "Local 6", "05********", "Géront 6")
-            ]
-            
-            for station in stations:
-                cursor.execute(
-                    "INSERT INTO stations (nom, adresse, telephone, responsable) VALUES (?, ?, ?, ?)",
-                    station
-                )
-        
-        # Vérifier si des carburants existent déjà
-        cursor.execute("SELECT COUNT(*) FROM carburants")
-        if cursor.fetchone()[0] == 0:
-            # Insérer les types de carburant
-            carburants = [
-                ("Essence", 14.50, "litre", "#FF4444"),
-                ("Diesel", 11.80, "litre", "#44FF44"),
-                ("Électrique", 0.00, "kWh", "#00FFFF"),
-                ("Hybride", 13.20, "litre", "#FF8800")
-            ]
-            
-            for carburant in carburants:
-                cursor.execute(
-                    "INSERT INTO carburants (nom, prix_unitaire, unite, couleur) VALUES (?, ?, ?, ?)",
-                    carburant
-                )
-        
-        # Vérifier si des utilisateurs existent déjà
-        cursor.execute("SELECT COUNT(*) FROM utilisateurs")
-        if cursor.fetchone()[0] == 0:
-            # Créer l'utilisateur administrateur par défaut
-            admin_password = hashlib.sha256("admin123".encode()).hexdigest()
-            employe_password = hashlib.sha256("employe123".encode()).hexdigest()
-            
-            utilisateurs = [
-                ("admin", admin_password, "administrateur", "Administrateur"),
-                ("employe", employe_password, "employe", "Employé")
-            ]
+        """Mettre le schéma à jour en appliquant les migrations en attente.
+        
+        Une base déjà à jour ne coûte qu'une lecture de schema_version; chaque
+        migration est validée dans sa propre transaction avec sa version."""
+        with self.get_connection(read_only=True) as conn:
+            version = migrations.current_version(conn)
+        
+        applied = False
+        self.applied_migrations = []
+        for number, description, apply in migrations.pending_migrations(version):
+            try:
+                with self.transaction() as conn:
+                    cursor = conn.cursor()
+                    apply(cursor)
+                    migrations.record_version(cursor, number, description)
+            except sqlite3.Error as e:
+                self._log_error(f"Échec de la migration {number} ({description}): {str(e)}")
+                raise
+            applied = True
+            self.applied_migrations.append(number)
+        
+        if applied:
+            # Les triggers de capture figent la liste des colonnes, et une table créée
+            # par une migration a besoin de son compteur de modifications
+            with self.transaction() as conn:
+                migrations.create_capture_triggers(conn.cursor())
+                migrations.create_change_counters(conn.cursor())
             
-            for utilisateur in utilisateurs:
-                cursor.execute(
-                    "INSERT INTO utilisateurs (nom_utilisateur, mot_de_passe, role, nom_complet) VALUES (?, ?, ?, ?)",
-                    utilisateur
-                )
-    
-    def execute_query(self, query, params=None, use_cache=True, cache_timeout=None, table=None):
-        """Exécuter une requête SQL avec gestion d'erreurs, mise en cache et mesure de performance"""
+            # Les migrations ont pu modifier tables et index: repartir d'un cache vide
+            self.query_tables.clear()
+            self.invalidate_cache()
+            self.optimize()
+    
+    def _run_after_attach(self):
+        """Compléter les migrations appliquées à ce démarrage sur les données des
+        fichiers attachés (stations, archives), invisibles pendant la migration"""
+        for number in self.applied_migrations:
+            step = migrations.AFTER_ATTACH.get(number)
+            if step is None:
+                continue
+            try:
+                with self.transaction() as conn:
+                    step(conn.cursor(), self.history_table)
+            except sqlite3.Error as e:
+                self._log_error(f"Échec de la reprise de la migration {number}: {str(e)}")
+                raise
+        self.applied_migrations = []
+    
+    def optimize(self, conn=None):
+        """Mettre à jour les statistiques du planificateur avec PRAGMA optimize.
+        
+        Contrairement à ANALYZE, seules les tables dont les statistiques manquent
+        ou sont périmées pour les requêtes de la connexion sont analysées, avec un
+        échantillonnage borné (analysis_limit). Sans conn, le rédacteur puis les
+        lecteurs inactifs sont traités. Appelé après les migrations et par
+        l'action de maintenance, jamais à chaque démarrage."""
+        if conn is None:
+            with self.connection_pool.writer() as writer:
+                self.optimize(writer)
+                self.connection_pool.for_each_idle_reader(self.optimize)
+            return
+        
+        # Un lecteur est en query_only: lever la restriction sous le verrou d'écriture,
+        # sans attendre si une écriture est en cours
+        if not self.connection_pool.write_lock.acquire(blocking=False):
+            return
+        try:
+            read_only = conn.execute("PRAGMA query_only").fetchone()[0]
+            conn.execute("PRAGMA query_only = OFF")
+            try:
+                conn.execute("PRAGMA analysis_limit = 1000")
+                conn.execute("PRAGMA optimize")
+            finally:
+                if read_only:
+                    conn.execute("PRAGMA query_only = ON")
+        except sqlite3.Error as e:
+            self._log_error(f"Erreur lors de PRAGMA optimize: {str(e)}")
+        finally:
+            self.connection_pool.write_lock.release()
+    
+    def execute_query(self, query, params=None, use_cache=True, cache_timeout=None, table=None,
+                      use_snapshot=False):
+        """Exécuter une requête SQL avec gestion d'erreurs, mise en cache et mesure de performance.
+        
+        Avec use_snapshot=True, une lecture est servie par l'instantané des rapports
+        (copie cohérente de la base, voir get_report_snapshot)."""
         start_time = time.time()
         self.stats["query_count"] += 1
         
         # Déterminer si la requête est en lecture seule (SELECT)
-        is_select = query.strip().upper().startswith("SELECT")
+        is_select = query.lstrip().upper().startswith(("SELECT", "WITH"))
+        
+        # Dans une transaction, lire sur la connexion d'écriture (données non validées)
+        # sans passer par le cache
+        in_transaction = self.in_transaction()
+        if in_transaction:
+            use_cache = False
+        elif use_snapshot and is_select:
+            return self._execute_on_snapshot(query, params, start_time)
         
         # Utiliser le cache uniquement pour les requêtes SELECT si activé
         if is_select and use_cache:
+            # Écarter d'abord les entrées périmées par un autre processus; un résultat
+            # lu pendant une invalidation n'est pas mis en cache (il peut être ancien)
+            self._check_coherence()
+            generation = self.coherence_generation
+            
             # Créer une clé de cache basée sur la requête et les paramètres
             cache_key = f"{query}_{str(params)}"
             
             # Vérifier si la requête est dans le cache et toujours valide
-            if cache_key in self.query_cache:
-                cache_entry = self.query_cache[cache_key]
-                cache_age = time.time() - cache_entry["timestamp"]
-                timeout = cache_timeout or self.cache_timeout
-                
-                if cache_age < timeout:
-                    self.stats["cache_hits"] += 1
-                    return cache_entry["data"]
+            cached = self._cache_get(cache_key, cache_timeout or self.cache_timeout)
+            if cached is not None:
+                self.stats["cache_hits"] += 1
+                return cached
             
             self.stats["cache_misses"] += 1
         
         try:
-            with self.get_connection() as conn:
+            # Les lectures passent par un lecteur du pool, le reste par le rédacteur
+            with self.get_connection(read_only=is_select and not in_transaction) as conn:
                 cursor = conn.cursor()
                 
-                # Exécuter la requête avec ou sans paramètres
-                if params:
-                    cursor.execute(query, params)
-                else:
-                    cursor.execute(query)
+                # Exécuter la requête en relevant les tables qu'elle touche
+                read_tables, write_tables = self._execute_tracked(cursor, query, params)
                 
                 # Récupérer les résultats
                 results = cursor.fetchall()
                 
-                # Mesurer le temps d'exécution
-                execution_time = time.time() - start_time
-                
-                # Enregistrer les requêtes lentes (> 100ms)
-                if execution_time > 0.1:
-                    self.stats["slow_queries"].append({
-                        "query": query,
-                        "params": params,
-                        "time": execution_time,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    })
-                    
-                    # Limiter la liste des requêtes lentes à 100 entrées
-                    if len(self.stats["slow_queries"]) > 100:
-                        self.stats["slow_queries"].pop(0)
+                # Mesurer le temps d'exécution (plan relevé si la requête est lente)
+                self.profiler.record(query, params, time.time() - start_time, len(results), conn)
                 
                 # Mettre en cache les résultats pour les requêtes SELECT
-                if is_select and use_cache:
-                    self.query_cache[cache_key] = {
-                        "data": results,
-                        "timestamp": time.time(),
-                        "table": table  # Stocker la table associée pour une invalidation plus précise
-                    }
-                    
-                    # Nettoyer le cache si trop grand (> 1000 entrées)
-                    if len(self.query_cache) > 1000:
-                        self.clean_cache()
+                if is_select and use_cache and generation == self.coherence_generation:
+                    tables = set(read_tables) | self._normalize_tables(table)
+                    self._cache_store(cache_key, results, tables)
+                elif write_tables:
+                    # Écriture passée par execute_query (ex: préférences)
+                    self._invalidate_written(write_tables)
                 
                 return results
         except sqlite3.Error as e:
@@ -412,67 +1008,363 @@ class DatabaseManager:
             # Propager l'erreur avec un message plus informatif
             raise sqlite3.Error(f"Erreur de base de données: {str(e)}") from e
     
-    def clean_cache(self):
-        """Nettoyer les entrées expirées du cache"""
-        current_time = time.time()
-        expired_keys = []
+    def start_replication(self, source, target, interval=5.0):
+        """Expédier en continu le journal des modifications vers le siège.
         
-        # Identifier les entrées expirées
-        for key, entry in self.query_cache.items():
-            if current_time - entry["timestamp"] > self.cache_timeout:
-                expired_keys.append(key)
+        source identifie cette station dans la base centrale; target est le
+        fichier de la base centrale ou un répertoire de dépôt (voir replication)."""
+        if self.replicator is None:
+            self.replicator = Replicator(self, source, target, interval=interval)
+            self.replicator.start()
+        return self.replicator
+    
+    def stop_replication(self):
+        """Arrêter l'expédition continue (le journal garde les modifications en attente)"""
+        if self.replicator is not None:
+            self.replicator.stop()
+            self.replicator = None
+    
+    def start_backups(self, directory="sauvegardes", **options):
+        """Sauvegarder la base à chaud sur un thread de fond, avec rotation
+        (options: interval, pages, sleep, keep_daily, keep_weekly, keep_monthly)"""
+        if self.backup_manager is None:
+            self.backup_manager = BackupManager(self, directory, **options)
+            self.backup_manager.start()
+        return self.backup_manager
+    
+    def stop_backups(self):
+        """Arrêter les sauvegardes planifiées"""
+        if self.backup_manager is not None:
+            self.backup_manager.stop()
+            self.backup_manager = None
+    
+    def checkpoint(self, mode="PASSIVE"):
+        """Checkpoint du WAL (PASSIVE en journée, TRUNCATE à la clôture de poste);
+        retourne (bloqué, pages du WAL, pages recopiées)"""
+        return self.checkpoints.checkpoint(mode)
+    
+    def checkpoint_if_idle(self):
+        """Checkpoint PASSIVE en arrière-plan si aucune écriture depuis quelques
+        secondes ou si le WAL est trop gros (retourne le Future ou None)"""
+        return self.checkpoints.checkpoint_if_idle()
+    
+    def close_shift(self):
+        """Maintenance de clôture de poste: point de solde des clients du mois
+        s'il manque, statistiques du planificateur (optimize) puis checkpoint
+        TRUNCATE; retourne le résultat du checkpoint"""
+        # Point de solde au début du mois (première clôture du mois)
+        month_start = date.today().replace(day=1).strftime("%Y-%m-%d")
+        if not self.execute_query("SELECT EXISTS (SELECT 1 FROM soldes_clients_points WHERE date_point = ?) "
+                                  "OR NOT EXISTS (SELECT 1 FROM mouvements_compte WHERE date_mouvement < ?)",
+                                  (month_start, month_start), use_cache=False)[0][0]:
+            self.record_balance_points(month_start)
+        self.optimize()
+        return self.checkpoint("TRUNCATE")
+    
+    # ------------------------------------------------------------------
+    # Répartition des ventes par station (un fichier par station)
+    # ------------------------------------------------------------------
+    def enable_shards(self, directory):
+        """Stocker les ventes de chaque station dans directory/station_<id>.db.
         
-        # Supprimer les entrées expirées
-        for key in expired_keys:
-            del self.query_cache[key]
+        Les lignes existantes sont déplacées vers les fichiers des stations; chaque
+        connexion les attache et la vue temporaire 'transactions' (UNION ALL)
+        remplace la table pour les lectures comme pour les écritures."""
+        router = ShardRouter(self, directory)
+        self._prepare_shards(router)
+        self.shards = router
+        self._reopen_connections()
+    
+    def refresh_shards(self):
+        """Prendre en compte une station ajoutée (création de son fichier)"""
+        if self.shards is not None:
+            self._prepare_shards(self.shards)
+            self._reopen_connections()
+    
+    def _prepare_shards(self, router):
+        """Créer et mettre à niveau les fichiers sur une connexion dédiée, sous le
+        verrou d'écriture du pool (le rédacteur a déjà ses propres attaches)"""
+        with self.connection_pool.writer():
+            conn = sqlite3.connect(self.db_path, timeout=20, isolation_level=None)
+            try:
+                conn.execute("PRAGMA foreign_keys = ON")
+                router.prepare(conn)
+            except sqlite3.Error as e:
+                self._log_error(f"Erreur lors de la préparation des fichiers des stations: {str(e)}")
+                raise
+            finally:
+                conn.close()
+    
+    def _reopen_connections(self):
+        """Fermer les connexions du pool: les suivantes sont ouvertes avec les attaches à jour"""
+        self.connection_pool.close_all()
+        self.query_tables.clear()
+        self.invalidate_cache()
+    
+    def shard_paths(self):
+        """Fichiers des stations {station_id: chemin} (vide sans répartition)"""
+        if self.shards is None:
+            return {}
+        return {station_id: self.shards.shard_path(station_id) for station_id in self.shards.station_ids}
+    
+    def vacuum_shard(self, station_id):
+        """Compacter le fichier d'une seule station"""
+        with self.connection_pool.writer() as conn:
+            conn.execute(f"VACUUM {self.shards.schema_name(station_id)}")
+    
+    # ------------------------------------------------------------------
+    # Archivage des exercices clos (un fichier par exercice)
+    # ------------------------------------------------------------------
+    def archived_years(self):
+        """Exercices présents dans les archives"""
+        return list(self.archives.years)
+    
+    def history_table(self, table, since=None):
+        """Table à interroger pour une période commençant à la clé de jour since
+        (aaaammjj, None: tout l'historique): la vue historique_<table> si la
+        période touche un exercice archivé, sinon la table courante seule"""
+        years = self.archives.years if self.archives is not None else []
+        if any(since is None or year >= since // 10000 for year in years):
+            return self.archives.view_name(table)
+        return table
+    
+    def archive_year(self, year):
+        """Déplacer les transactions, lignes de facture et paiements d'un exercice
+        clos dans son fichier d'archive; retourne {table: lignes déplacées}"""
+        return self._run_archive_operation(self.archives.archive, year, "l'archivage")
+    
+    def restore_year(self, year):
+        """Remettre un exercice archivé dans les tables courantes puis supprimer
+        son fichier d'archive; retourne {table: lignes restaurées}"""
+        restored = self._run_archive_operation(self.archives.restore, year, "la restauration")
+        # Plus aucune connexion ne doit attacher le fichier: ATTACH recréerait un fichier vide
+        self.archives.years.remove(year)
+        self._close_archive_connections()
+        # Un lecteur encore emprunté attache l'archive (Windows refuse alors la suppression)
+        if not self.connection_pool.wait_retired(self.connection_pool.timeout):
+            self._log_error(f"Lecteurs encore ouverts sur l'archive {year} lors de sa suppression")
+        os.remove(self.archives.archive_path(year))
+        return restored
+    
+    def rebuild_daily_sales(self, year=None):
+        """Recalculer les cumuls journaliers des ventes (ventes_journalieres)
+        depuis les transactions courantes et archivées, pour une année ou pour
+        toute la table.
         
-        # Si le cache est toujours trop grand, supprimer les entrées les plus anciennes
-        if len(self.query_cache) > 500:
-            sorted_entries = sorted(self.query_cache.items(), key=lambda x: x[1]["timestamp"])
-            for key, _ in sorted_entries[:len(sorted_entries) // 2]:
-                del self.query_cache[key]
+        Les triggers les tiennent à jour (archivage et restauration les laissent
+        intacts); le recalcul sert après un import direct dans les fichiers."""
+        first = last = None
+        if year is not None:
+            first, last = year * 10000, (year + 1) * 10000
+        try:
+            with self.transaction() as conn:
+                migrations.rebuild_daily_sales(conn.cursor(), first, last,
+                                               source=self.history_table("transactions"))
+        except sqlite3.Error as e:
+            self._log_error(f"Erreur lors du recalcul des ventes journalières: {str(e)}")
+            raise
+        self.invalidate_cache("ventes_journalieres")
     
-    def invalidate_cache(self, table=None):
-        """Invalider le cache, soit complètement soit pour une table spécifique"""
-        if table:
-            # Supprimer uniquement les entrées liées à la table spécifiée
-            keys_to_remove = []
-            for key in self.query_cache.keys():
-                if f"FROM {table}" in key or f"JOIN {table}" in key:
-                    keys_to_remove.append(key)
+    def verify_archive(self, year):
+        """Contrôler le nombre de lignes et l'empreinte des tables d'une archive"""
+        return self.archives.verify(year)
+    
+    def _run_archive_operation(self, operation, year, label):
+        """Déplacement sur une connexion dédiée, sous le verrou d'écriture du pool,
+        puis réouverture des connexions avec les archives à jour"""
+        with self.connection_pool.writer():
+            conn = sqlite3.connect(self.db_path, timeout=20, isolation_level=None)
+            try:
+                conn.execute("PRAGMA foreign_keys = ON")
+                result = operation(conn, year)
+                self.archives.scan(conn)
+            except sqlite3.Error as e:
+                self._log_error(f"Erreur lors de {label} de l'exercice {year}: {str(e)}")
+                raise
+            finally:
+                conn.close()
+        self._close_archive_connections()
+        return result
+    
+    def _close_archive_connections(self):
+        """Fermer les connexions (et l'instantané des rapports) qui attachent
+        l'ancienne liste d'archives"""
+        self._reopen_connections()
+        with self.snapshot_lock:
+            if self.report_snapshot is not None:
+                self.report_snapshot.close()
+                self.report_snapshot = None
+    
+    def get_report_snapshot(self):
+        """Instantané en mémoire de la base pour les rapports lourds (créé au premier appel)"""
+        with self.snapshot_lock:
+            if self.report_snapshot is None:
+                self.report_snapshot = ReportSnapshot(self)
+            return self.report_snapshot
+    
+    def refresh_report_snapshot(self):
+        """Recopier immédiatement la base dans l'instantané des rapports"""
+        self.get_report_snapshot().refresh(force=True)
+    
+    def _execute_on_snapshot(self, query, params, start_time):
+        """Lecture sur l'instantané des rapports: pas de cache (la copie est déjà figée)"""
+        try:
+            results = self.get_report_snapshot().query(query, params)
+        except sqlite3.Error as e:
+            error_msg = f"Erreur d'exécution de requête (instantané): {str(e)}\nRequête: {query}\nParamètres: {params}"
+            self._log_error(error_msg)
+            raise sqlite3.Error(f"Erreur de base de données: {str(e)}") from e
+        self.profiler.record(query, params, time.time() - start_time, len(results))
+        return results
+    
+    @staticmethod
+    def _estimate_size(results):
+        """Estimer l'empreinte mémoire (octets) d'une liste de tuples de résultats"""
+        size = sys.getsizeof(results)
+        for row in results:
+            size += sys.getsizeof(row)
+            for value in row:
+                size += sys.getsizeof(value)
+        return size
+    
+    def _cache_get(self, cache_key, timeout):
+        """Lire une entrée du cache (O(1)) et la marquer comme la plus récente"""
+        with self.cache_lock:
+            entry = self.query_cache.get(cache_key)
+            if entry is None:
+                return None
+            if time.time() - entry["timestamp"] >= timeout:
+                self._cache_drop(cache_key)
+                return None
+            self.query_cache.move_to_end(cache_key)
+            return entry["data"]
+    
+    def _cache_store(self, cache_key, results, tables):
+        """Mettre un résultat en cache et l'inscrire dans l'index inverse des tables.
+        
+        Les entrées les moins récemment utilisées sont évincées tant que le budget
+        mémoire est dépassé; un résultat trop volumineux n'est pas mis en cache."""
+        size = self._estimate_size(results)
+        if size > self.cache_max_bytes // 4:
+            return
+        
+        with self.cache_lock:
+            if cache_key in self.query_cache:
+                self._cache_drop(cache_key)
             
-            for key in keys_to_remove:
-                del self.query_cache[key]
-        else:
-            # Vider complètement le cache
-            self.query_cache.clear()
+            while self.query_cache and self.cache_bytes + size > self.cache_max_bytes:
+                oldest_key = next(iter(self.query_cache))
+                self._cache_drop(oldest_key)
+                self.stats["cache_evictions"] += 1
+            
+            self.query_cache[cache_key] = {
+                "data": results,
+                "timestamp": time.time(),
+                "size": size,
+                "tables": frozenset(tables)  # Tables lues, pour une invalidation exacte
+            }
+            self.cache_bytes += size
+            for name in tables:
+                self.cache_index.setdefault(name, set()).add(cache_key)
+    
+    def _cache_drop(self, cache_key):
+        """Retirer une entrée du cache et de l'index inverse"""
+        with self.cache_lock:
+            entry = self.query_cache.pop(cache_key, None)
+            if entry is None:
+                return
+            self.cache_bytes -= entry["size"]
+            for name in entry["tables"]:
+                keys = self.cache_index.get(name)
+                if keys is not None:
+                    keys.discard(cache_key)
+                    if not keys:
+                        del self.cache_index[name]
+    
+    def _check_coherence(self):
+        """Invalider les entrées du cache dont les tables ont été modifiées par
+        un autre processus (ou une autre connexion).
+        
+        PRAGMA data_version ne change, pour une connexion, que si une autre
+        connexion a validé une écriture: tant qu'il est stable, la vérification
+        ne coûte que ce PRAGMA. Sinon les compteurs de modifications tenus par
+        les triggers désignent les tables à invalider."""
+        with self.coherence_lock:
+            try:
+                if self.coherence_conn is None:
+                    self.coherence_conn = sqlite3.connect(self.db_path, timeout=20, isolation_level=None,
+                                                          check_same_thread=False)
+                    self.coherence_conn.execute("PRAGMA query_only = ON")
+                version = self.coherence_conn.execute("PRAGMA data_version").fetchone()[0]
+                if version == self.data_version:
+                    return
+                rows = self.coherence_conn.execute(
+                    "SELECT nom_table, version FROM compteurs_modifications").fetchall()
+            except sqlite3.Error as e:
+                self._log_error(f"Erreur de vérification de la cohérence du cache: {str(e)}")
+                return
+            
+            self.data_version = version
+            changed = [name for name, counter in rows if self.table_versions.get(name) != counter]
+            self.table_versions = dict(rows)
+            if changed:
+                self.coherence_generation += 1
+                self.stats["coherence_invalidations"] += 1
+                self.invalidate_cache(changed)
+    
+    def clean_cache(self):
+        """Supprimer les entrées expirées du cache (l'éviction LRU est automatique)"""
+        current_time = time.time()
+        with self.cache_lock:
+            expired_keys = [key for key, entry in self.query_cache.items()
+                            if current_time - entry["timestamp"] > self.cache_timeout]
+            for key in expired_keys:
+                self._cache_drop(key)
+    
+    def invalidate_cache(self, table=None):
+        """Invalider le cache, soit complètement soit pour une ou plusieurs tables.
+        
+        Seules les entrées qui lisent effectivement la table sont supprimées,
+        via l'index inverse (coût proportionnel au nombre d'entrées touchées)."""
+        names = self._normalize_tables(table)
+        with self.cache_lock:
+            if names and "*" not in names:
+                # Les entrées aux tables inconnues dépendent de toutes les tables
+                for name in names | ALL_TABLES:
+                    for key in list(self.cache_index.get(name, ())):
+                        self._cache_drop(key)
+                    if name in self.reference_id_sets or name in self.REFERENCE_ID_TABLES:
+                        self.reference_id_sets.pop(name, None)
+                        self.reference_id_generation += 1
+                invalidate_tables(names, owner=self)
+            else:
+                # Vider complètement le cache
+                self.query_cache.clear()
+                self.cache_index.clear()
+                self.cache_bytes = 0
+                self.reference_id_sets.clear()
+                self.reference_id_generation += 1
+                invalidate_tables(owner=self)
     
     def execute_insert(self, query, params, table=None):
         """Exécuter une insertion avec gestion d'erreurs et retourner l'ID généré"""
+        if self._use_write_queue():
+            return self.submit_insert(query, params, table).result()
+        
         start_time = time.time()
         self.stats["query_count"] += 1
         
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute(query, params)
-                last_id = cursor.lastrowid
+                _, write_tables = self._execute_tracked(cursor, query, params)
+                last_id = self._write_result(conn, cursor, "insert", write_tables)
                 
                 # Mesurer le temps d'exécution
-                execution_time = time.time() - start_time
-                
-                # Enregistrer les requêtes lentes (> 100ms)
-                if execution_time > 0.1:
-                    self.stats["slow_queries"].append({
-                        "query": query,
-                        "params": params,
-                        "time": execution_time,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    })
+                self.profiler.record(query, params, time.time() - start_time, cursor.rowcount, conn)
                 
-                # Invalider le cache pour la table concernée
-                if table:
-                    self.invalidate_cache(table)
+                # Invalider le cache pour les tables écrites (y compris par des triggers)
+                self._invalidate_written(write_tables, table)
                 
                 return last_id
         except sqlite3.Error as e:
@@ -483,36 +1375,23 @@ class DatabaseManager:
     
     def execute_update(self, query, params, table=None):
         """Exécuter une mise à jour avec gestion d'erreurs et retourner le nombre de lignes affectées"""
+        if self._use_write_queue():
+            return self.submit_update(query, params, table).result()
+        
         start_time = time.time()
         self.stats["query_count"] += 1
         
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute(query, params)
-                rows_affected = cursor.rowcount
+                _, write_tables = self._execute_tracked(cursor, query, params)
+                rows_affected = self._write_result(conn, cursor, "update", write_tables)
                 
                 # Mesurer le temps d'exécution
-                execution_time = time.time() - start_time
+                self.profiler.record(query, params, time.time() - start_time, rows_affected, conn)
                 
-                # Enregistrer les requêtes lentes (> 100ms)
-                if execution_time > 0.1:
-                    self.stats["slow_queries"].append({
-                        "query": query,
-                        "params": params,
-                        "time": execution_time,
-                        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    })
-                
-                # Invalider le cache pour la table concernée
-                if table:
-                    self.invalidate_cache(table)
-                else:
-                    # Essayer de déterminer la table à partir de la requête
-                    query_upper = query.upper()
-                    if "UPDATE" in query_upper:
-                        table_name = query_upper.split("UPDATE")[1].strip().split(" ")[0]
-                        self.invalidate_cache(table_name)
+                # Invalider le cache pour les tables écrites (y compris par des triggers)
+                self._invalidate_written(write_tables, table)
                 
                 return rows_affected
         except sqlite3.Error as e:
@@ -521,145 +1400,415 @@ class DatabaseManager:
             # Propager l'erreur avec un message plus informatif
             raise sqlite3.Error(f"Erreur de mise à jour dans la base de données: {str(e)}") from e
     
+    def adjust_client_balance(self, client_id, centimes, type_mouvement="ajustement",
+                              source_table=None, source_id=None, libelle=None):
+        """Ajouter centimes (négatif pour un débit) au solde d'un client et
+        inscrire le mouvement dans mouvements_compte, dans le même commit.
+        
+        Le solde est cumulé en centimes entiers, solde_actuel en reçoit le
+        reflet exact en DH (aucune dérive d'arrondi d'une écriture à l'autre).
+        source_table/source_id désignent la vente ou le paiement concerné."""
+        with self.transaction():
+            if centimes:
+                self.execute_insert("""
+                    INSERT INTO mouvements_compte (client_id, montant_centimes, type_mouvement,
+                                                   source_table, source_id, libelle)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (client_id, centimes, type_mouvement, source_table, source_id, libelle),
+                    table='mouvements_compte')
+            return self.execute_update("""
+                UPDATE clients
+                SET solde_centimes = solde_centimes + ?, solde_actuel = (solde_centimes + ?) / 100.0
+                WHERE id = ?
+            """, (centimes, centimes, client_id), table='clients')
+    
+    # Colonnes renvoyées par search_clients
+    CLIENT_SEARCH_COLUMNS = "c.id, c.nom, c.prenom, c.entreprise, c.type_client, c.solde_actuel"
+    
+    def search_clients(self, term, limit=10, active_only=False):
+        """Clients dont le nom, le prénom, l'entreprise, le téléphone ou une
+        plaque de véhicule contient term (autocomplétion).
+        
+        Retourne au plus limit lignes (id, nom, prenom, entreprise, type_client,
+        solde_actuel) triées par nom. Les mots de 3 caractères ou plus sont
+        cherchés dans l'index à trigrammes recherche_clients; un terme plus
+        court (ou une base sans FTS5) est cherché avec LIKE. Sans ORDER BY,
+        la recherche s'arrête aux limit premiers clients trouvés: un trigramme
+        fréquent ne coûte pas le classement de milliers de résultats."""
+        term = (term or "").strip()
+        if len(term) < 2:
+            return []
+        
+        # Numéro de téléphone ou plaque saisis avec espaces/tirets: forme compacte indexée
+        compact = term.replace(" ", "").replace("-", "")
+        words = [compact] if compact.isdigit() else term.split()
+        words = [word for word in words if len(word) >= 3]
+        status = "AND c.statut = 'actif'" if active_only else ""
+        
+        if self.client_search_fts is None:
+            # Index absent si FTS5/trigram indisponible à la migration
+            self.client_search_fts = bool(self.execute_query(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'recherche_clients'", use_cache=False))
+        
+        if self.client_search_fts and words:
+            match = " AND ".join('"' + word.replace('"', '""') + '"' for word in words)
+            try:
+                rows = self.execute_query(f"""
+                    SELECT {self.CLIENT_SEARCH_COLUMNS}
+                    FROM recherche_clients r
+                    JOIN clients c ON c.id = r.rowid
+                    WHERE recherche_clients MATCH ? {status}
+                    LIMIT ?
+                """, (match, limit), use_cache=False)
+                return sorted(rows, key=lambda row: ((row[1] or "").lower(), (row[2] or "").lower()))
+            except sqlite3.Error as e:
+                self._log_error(f"Erreur de recherche plein texte des clients: {str(e)}")
+        
+        pattern = f"%{term.lower()}%"
+        rows = self.execute_query(f"""
+            SELECT {self.CLIENT_SEARCH_COLUMNS}
+            FROM clients c
+            WHERE (LOWER(c.nom) LIKE ? OR LOWER(c.prenom) LIKE ? OR LOWER(c.entreprise) LIKE ?
+                   OR c.telephone LIKE ?) {status}
+            LIMIT ?
+        """, (pattern, pattern, pattern, f"%{term}%", limit), use_cache=False)
+        return sorted(rows, key=lambda row: ((row[1] or "").lower(), (row[2] or "").lower()))
+    
+    @staticmethod
+    def _balance_cutoff(when):
+        """Borne exclue d'un solde à date: lendemain d'une date (solde en fin de
+        journée), instant exact d'un datetime, texte 'AAAA-MM-JJ[ HH:MM:SS]'"""
+        if isinstance(when, datetime):
+            return when.strftime("%Y-%m-%d %H:%M:%S")
+        if isinstance(when, date):
+            return (when + timedelta(days=1)).strftime("%Y-%m-%d")
+        when = when.strip()
+        if len(when) <= 10:
+            return (datetime.strptime(when, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        return when
+    
+    def client_balance_as_of(self, client_id, when):
+        """Solde d'un client (centimes) à une date (fin de journée) ou à un instant.
+        
+        Une lecture du dernier point de solde antérieur plus la somme des
+        mouvements suivants, lue dans l'index (client_id, date_mouvement)."""
+        cutoff = self._balance_cutoff(when)
+        return self.execute_query("""
+            WITH point AS (
+                SELECT date_point, solde_centimes FROM soldes_clients_points
+                WHERE client_id = ? AND date_point <= ?
+                ORDER BY date_point DESC LIMIT 1
+            )
+            SELECT COALESCE((SELECT solde_centimes FROM point), 0)
+                 + COALESCE((SELECT SUM(montant_centimes) FROM mouvements_compte
+                             WHERE client_id = ? AND date_mouvement >= COALESCE((SELECT date_point FROM point), '')
+                               AND date_mouvement < ?), 0)
+        """, (client_id, cutoff, client_id, cutoff), use_cache=False)[0][0]
+    
+    def client_statement(self, client_id, date_from, date_to):
+        """Relevé de compte d'un client sur [date_from, date_to] (dates incluses):
+        solde d'ouverture, mouvements (date, type, libellé, montant, solde) et
+        solde de clôture, en centimes"""
+        opening = self.client_balance_as_of(client_id, self._day_before(date_from))
+        rows = self.execute_query("""
+            SELECT date_mouvement, type_mouvement, libelle, source_table, source_id, montant_centimes
+            FROM mouvements_compte
+            WHERE client_id = ? AND date_mouvement >= ? AND date_mouvement < ?
+            ORDER BY date_mouvement, id
+        """, (client_id, self._balance_cutoff(self._day_before(date_from)), self._balance_cutoff(date_to)),
+            use_cache=False)
+        
+        movements = []
+        balance = opening
+        for date_mouvement, type_mouvement, libelle, source_table, source_id, montant in rows:
+            balance += montant
+            movements.append({
+                "date": date_mouvement,
+                "type": type_mouvement,
+                "libelle": libelle,
+                "source": (source_table, source_id) if source_table else None,
+                "montant": montant,
+                "solde": balance
+            })
+        return {"ouverture": opening, "mouvements": movements, "cloture": balance}
+    
+    @staticmethod
+    def _day_before(value):
+        """Veille d'une date (date ou texte 'AAAA-MM-JJ')"""
+        if isinstance(value, str):
+            value = datetime.strptime(value.strip()[:10], "%Y-%m-%d").date()
+        elif isinstance(value, datetime):
+            value = value.date()
+        return value - timedelta(days=1)
+    
+    def record_balance_points(self, date_point=None):
+        """Enregistrer le solde de chaque client au début de date_point (par
+        défaut le 1er du mois courant), calculé depuis son point précédent.
+        
+        Retourne le nombre de clients enregistrés (ceux qui ont des mouvements)."""
+        if date_point is None:
+            date_point = date.today().replace(day=1)
+        if not isinstance(date_point, str):
+            date_point = date_point.strftime("%Y-%m-%d")
+        try:
+            with self.transaction() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT OR REPLACE INTO soldes_clients_points (client_id, date_point, solde_centimes)
+                    SELECT c.client_id, :point,
+                           COALESCE((SELECT p.solde_centimes FROM soldes_clients_points p
+                                     WHERE p.client_id = c.client_id AND p.date_point = c.precedent), 0)
+                         + COALESCE((SELECT SUM(m.montant_centimes) FROM mouvements_compte m
+                                     WHERE m.client_id = c.client_id AND m.date_mouvement >= COALESCE(c.precedent, '')
+                                       AND m.date_mouvement < :point), 0)
+                    FROM (
+                        SELECT cl.id AS client_id,
+                               (SELECT MAX(p.date_point) FROM soldes_clients_points p
+                                WHERE p.client_id = cl.id AND p.date_point < :point) AS precedent
+                        FROM clients cl
+                        WHERE EXISTS (SELECT 1 FROM mouvements_compte m
+                                      WHERE m.client_id = cl.id AND m.date_mouvement < :point)
+                    ) c
+                """, {"point": date_point})
+                count = cursor.rowcount
+        except sqlite3.Error as e:
+            self._log_error(f"Erreur lors de l'enregistrement des soldes au {date_point}: {str(e)}")
+            raise
+        self.invalidate_cache("soldes_clients_points")
+        return count
+    
+    def execute_many(self, query, rows, table=None, chunk_size=500):
+        """Exécuter une écriture pour chaque jeu de paramètres de rows (itérable).
+        
+        Les lignes sont consommées par paquets de chunk_size, chacun passé à
+        executemany dans sa propre transaction, avec une seule invalidation du
+        cache par paquet. Dans un bloc db.transaction(), les paquets rejoignent
+        la transaction englobante. Retourne le nombre total de lignes affectées."""
+        rows = iter(rows)
+        total = 0
+        
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            
+            start_time = time.time()
+            self.stats["query_count"] += 1
+            try:
+                with self.transaction() as conn:
+                    cursor = conn.cursor()
+                    _, write_tables = self._execute_tracked(cursor, query, chunk, many=True)
+                    total += max(self._write_result(conn, cursor, "update", write_tables), 0)
+                    self._invalidate_written(write_tables, table)
+                    # Mesurer le paquet (plan relevé avec le premier jeu de paramètres)
+                    self.profiler.record(query, chunk[0], time.time() - start_time, cursor.rowcount, conn)
+            except sqlite3.Error as e:
+                error_msg = f"Erreur d'écriture groupée: {str(e)}\nRequête: {query}\nLignes du paquet: {len(chunk)}"
+                self._log_error(error_msg)
+                raise sqlite3.Error(f"Erreur d'écriture groupée dans la base de données: {str(e)}") from e
+        
+        return total
+    
+    # ------------------------------------------------------------------
+    # API asynchrone: les requêtes s'exécutent sur des threads de travail
+    # ------------------------------------------------------------------
+    def _get_executor(self):
+        """Créer à la demande le pool de threads de l'API asynchrone"""
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.executor_workers,
+                                                   thread_name_prefix="db-worker")
+            return self.executor
+    
+    def run_in_executor(self, func, *args, **kwargs):
+        """Exécuter une fonction bloquante sur un thread de travail du
+        gestionnaire; retourne un concurrent.futures.Future"""
+        return self._get_executor().submit(func, *args, **kwargs)
+    
+    async def arun(self, func, *args, **kwargs):
+        """Version asynchrone de run_in_executor: await db.arun(func, ...)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(),
+                                          functools.partial(func, *args, **kwargs))
+    
+    async def aquery(self, query, params=None, **kwargs):
+        """Version asynchrone de execute_query: await db.aquery(...)"""
+        return await self.arun(self.execute_query, query, params, **kwargs)
+    
+    async def aexecute(self, query, params=None, table=None):
+        """Version asynchrone de execute_update (retourne le nombre de lignes affectées)"""
+        return await self.arun(self.execute_update, query, params or (), table=table)
+    
+    async def ainsert(self, query, params, table=None):
+        """Version asynchrone de execute_insert (retourne l'ID généré)"""
+        return await self.arun(self.execute_insert, query, params, table=table)
+    
     def get_performance_stats(self):
         """Retourner les statistiques de performance de la base de données"""
+        pool = self.connection_pool.get_metrics()
         return {
             "query_count": self.stats["query_count"],
             "cache_hits": self.stats["cache_hits"],
             "cache_misses": self.stats["cache_misses"],
             "cache_hit_ratio": self.stats["cache_hits"] / max(1, (self.stats["cache_hits"] + self.stats["cache_misses"])),
-            "slow_queries_count": len(self.stats["slow_queries"]),
-            "slow_queries": self.stats["slow_queries"][-10:],  # 10 dernières requêtes lentes
+            "slow_queries_count": self.profiler.slow_count,
+            "slow_queries": list(self.profiler.slow_queries)[-10:],  # 10 dernières requêtes lentes
+            "fingerprints": self.profiler.report(limit=10),  # Empreintes les plus coûteuses
+            "cache_evictions": self.stats["cache_evictions"],
+            "coherence_invalidations": self.stats["coherence_invalidations"],
             "cache_size": len(self.query_cache),
-            "connection_pool_size": len(self.connection_pool)
+            "cache_bytes": self.cache_bytes,
+            "cache_max_bytes": self.cache_max_bytes,
+            "connection_pool_size": pool["open_connections"],
+            "pool": pool,
+            "write_queue": self.write_queue.get_metrics() if self.write_queue else None,
+            "snapshot": dict(self.report_snapshot.metrics) if self.report_snapshot else None,
+            "replication": self.replicator.get_metrics() if self.replicator else None,
+            "backup": self.backup_manager.get_metrics() if self.backup_manager else None,
+            "checkpoint": self.checkpoints.get_metrics(),
+            "memoization": memo_stats(),
+            "shards": {station_id: os.path.getsize(path) if os.path.exists(path) else 0
+                       for station_id, path in self.shard_paths().items()}
         }
     
+    def advise_indexes(self, min_rows=1000, apply=False):
+        """Conseiller d'index: rejouer les empreintes enregistrées avec EXPLAIN QUERY
+        PLAN et proposer des index couvrants pour les parcours complets des tables
+        d'au moins min_rows lignes, avec le coût estimé avant/après.
+        Avec apply=True, les index proposés sont créés."""
+        advisor = IndexAdvisor(self, min_rows=min_rows)
+        proposals = advisor.advise()
+        if apply and proposals:
+            advisor.apply(proposals)
+        return proposals
+    
+    def apply_index_proposals(self, proposals):
+        """Créer des index proposés par advise_indexes (retourne leurs noms)"""
+        return IndexAdvisor(self).apply(proposals)
+    
     def reset_stats(self):
         """Réinitialiser les statistiques de performance"""
         self.stats = {
             "cache_hits": 0,
             "cache_misses": 0,
-            "query_count": 0,
-            "slow_queries": []
+            "cache_evictions": 0,
+            "coherence_invalidations": 0,
+            "query_count": 0
         }
+        self.profiler.reset()
     
-    # Décorateur pour mettre en cache les résultats des méthodes fréquemment appelées
+    # Décorateur conservé pour compatibilité: voir modules/memoize.py
     @staticmethod
-    def cached_method(timeout=60):
-        """Décorateur pour mettre en cache les résultats des méthodes"""
-        def decorator(func):
-            cache = {}
-            
-            @functools.wraps(func)
-            def wrapper(*args, **kwargs):
-                # Créer une clé de cache basée sur les arguments
-                key = str(args) + str(kwargs)
-                
-                # Vérifier si le résultat est dans le cache et toujours valide
-                if key in cache:
-                    result, timestamp = cache[key]
-                    if time.time() - timestamp < timeout:
-                        return result
-                
-                # Exécuter la méthode et mettre en cache le résultat
-                result = func(*args, **kwargs)
-                cache[key] = (result, time.time())
-                
-                # Nettoyer le cache si trop grand
-                if len(cache) > 100:
-                    current_time = time.time()
-                    expired_keys = [k for k, (_, t) in cache.items() if current_time - t > timeout]
-                    for k in expired_keys:
-                        del cache[k]
-                
-                return result
-            
-            # Ajouter une méthode pour invalider le cache
-            def clear_cache():
-                cache.clear()
-            
-            wrapper.clear_cache = clear_cache
-            return wrapper
-        
-        return decorator
+    def cached_method(timeout=60, maxsize=100, tables=None):
+        """Décorateur pour mettre en cache les résultats des méthodes
+        (un cache par instance, invalidé par les écritures dans tables)"""
+        return memoized(maxsize=maxsize, ttl=timeout, tables=tables)
+    
+    # ------------------------------------------------------------------
+    # Valeurs dérivées coûteuses (mémoïsées, invalidées par les écritures)
+    # ------------------------------------------------------------------
+    
+    # Avant un résultat mémoïsé: écarter ceux périmés par un autre processus
+    @memoized(maxsize=512, ttl=300, tables=["clients", "transactions", "paiements_avance"],
+              before=_check_coherence)
+    def client_exposure(self, client_id):
+        """Encours d'un client en centimes: solde, plafond de crédit, ventes à
+        crédit, paiements d'avance et crédit encore disponible (None si le
+        client n'a pas de plafond)"""
+        rows = self.execute_query("""
+            SELECT
+                c.solde_centimes,
+                c.credit_limite,
+                (SELECT COALESCE(SUM(montant_centimes), 0) FROM transactions
+                 WHERE client_id = c.id AND type_paiement = 'credit'),
+                (SELECT COALESCE(SUM(montant_centimes), 0) FROM paiements_avance
+                 WHERE client_id = c.id)
+            FROM clients c
+            WHERE c.id = ?
+        """, (client_id,), use_cache=False)
+        if not rows:
+            return None
+        solde, limite, credit, paiements = rows[0]
+        limite = to_centimes(limite)
+        return {
+            "solde": solde,
+            "credit_limite": limite,
+            "ventes_credit": credit,
+            "paiements": paiements,
+            "disponible": limite + solde if limite else None
+        }
+    
+    @memoized(maxsize=256, ttl=300, tables=["transactions"], before=_check_coherence)
+    def station_kpis(self, station_id, date_from=None, date_to=None):
+        """Indicateurs d'une station sur [date_from, date_to] (dates ou textes
+        'AAAA-MM-JJ', bornes incluses): ventes, litres, chiffre d'affaires et
+        panier moyen en centimes, clients distincts"""
+        conditions = ["station_id = ?"]
+        params = [station_id]
+        if date_from:
+            conditions.append("jour >= ?")
+            params.append(day_key(date_from))
+        if date_to:
+            conditions.append("jour < ?")
+            params.append(day_key(date_to, 1))
+        ventes, litres, ca, clients = self.execute_query(f"""
+            SELECT COUNT(*), COALESCE(SUM(quantite), 0), COALESCE(SUM(montant_centimes), 0),
+                   COUNT(DISTINCT client_id)
+            FROM transactions
+            WHERE {" AND ".join(conditions)}
+        """, params, use_cache=False)[0]
+        return {
+            "ventes": ventes,
+            "litres": litres,
+            "chiffre_affaires": ca,
+            "panier_moyen": ca // ventes if ventes else 0,
+            "clients": clients
+        }
+    
+    # Règles de validation par table
+    VALIDATION_RULES = {
+        'stations': {
+            'required': ['nom'],
+            'max_length': {'nom': 100, 'adresse': 200, 'telephone': 20, 'responsable': 100}
+        },
+        'clients': {
+            'required': ['nom'],
+            'max_length': {'nom': 100, 'prenom': 100, 'telephone': 20},
+            'numeric': ['solde_actuel']
+        },
+        'vehicules': {
+            'required': ['client_id', 'matricule'],
+            'max_length': {'matricule': 20, 'marque': 50, 'modele': 50, 'type_carburant': 30},
+            'foreign_key': {'client_id': 'clients'}
+        },
+        'carburants': {
+            'required': ['nom', 'prix_unitaire'],
+            'max_length': {'nom': 50, 'unite': 20, 'couleur': 20},
+            'numeric': ['prix_unitaire']
+        },
+        'transactions': {
+            'required': ['station_id', 'client_id', 'carburant_id', 'quantite', 'prix_unitaire', 'montant_total'],
+            'numeric': ['quantite', 'prix_unitaire', 'montant_total', 'numero_pompe'],
+            'foreign_key': {'station_id': 'stations', 'client_id': 'clients', 
+                           'vehicule_id': 'vehicules', 'carburant_id': 'carburants'}
+        },
+        'paiements_avance': {
+            'required': ['client_id', 'montant'],
+            'numeric': ['montant'],
+            'foreign_key': {'client_id': 'clients'}
+        }
+    }
+    
+    # Petites tables de référence dont tous les identifiants sont gardés en mémoire
+    REFERENCE_ID_TABLES = ('stations', 'carburants')
     
     def validate_data(self, table, data):
         """Valider les données avant insertion ou mise à jour"""
-        # Définir les règles de validation par table
-        validation_rules = {
-            'stations': {
-                'required': ['nom'],
-                'max_length': {'nom': 100, 'adresse': 200, 'telephone': 20, 'responsable': 100}
-            },
-            'clients': {
-                'required': ['nom'],
-                'max_length': {'nom': 100, 'prenom': 100, 'telephone': 20},
-                'numeric': ['solde_actuel']
-            },
-            'vehicules': {
-                'required': ['client_id', 'matricule'],
-                'max_length': {'matricule': 20, 'marque': 50, 'modele': 50, 'type_carburant': 30},
-                'foreign_key': {'client_id': 'clients'}
-            },
-            'carburants': {
-                'required': ['nom', 'prix_unitaire'],
-                'max_length': {'nom': 50, 'unite': 20, 'couleur': 20},
-                'numeric': ['prix_unitaire']
-            },
-            'transactions': {
-                'required': ['station_id', 'client_id', 'carburant_id', 'quantite', 'prix_unitaire', 'montant_total'],
-                'numeric': ['quantite', 'prix_unitaire', 'montant_total', 'numero_pompe'],
-                'foreign_key': {'station_id': 'stations', 'client_id': 'clients', 
-                               'vehicule_id': 'vehicules', 'carburant_id': 'carburants'}
-            },
-            'paiements_avance': {
-                'required': ['client_id', 'montant'],
-                'numeric': ['montant'],
-                'foreign_key': {'client_id': 'clients'}
-            }
-        }
-        
         # Si la table n'a pas de règles définies, retourner True
-        if table not in validation_rules:
+        if table not in self.VALIDATION_RULES:
             return True
         
-        rules = validation_rules[table]
-        errors = []
-        
-        # Vérifier les champs requis
-        if 'required' in rules:
-            for field in rules['required']:
-                if field not in data or data[field] is None or data[field] == '':
-                    errors.append(f"Le champ '{field}' est requis.")
-        
-        # Vérifier les longueurs maximales
-        if 'max_length' in rules:
-            for field, max_len in rules['max_length'].items():
-                if field in data and data[field] and len(str(data[field])) > max_len:
-                    errors.append(f"Le champ '{field}' dépasse la longueur maximale de {max_len} caractères.")
-        
-        # Vérifier les champs numériques
-        if 'numeric' in rules:
-            for field in rules['numeric']:
-                if field in data and data[field] is not None:
-                    try:
-                        float(data[field])
-                    except (ValueError, TypeError):
-                        errors.append(f"Le champ '{field}' doit être une valeur numérique.")
-        
-        # Vérifier les clés étrangères
-        if 'foreign_key' in rules:
-            for field, ref_table in rules['foreign_key'].items():
-                if field in data and data[field] is not None and data[field] != '':
-                    try:
-                        # Vérifier si l'ID existe dans la table référencée
-                        query = f"SELECT COUNT(*) FROM {ref_table} WHERE id = ?"
-                        result = self.execute_query(query, (data[field],))
-                        if result[0][0] == 0:
-                            errors.append(f"La référence '{field}' n'existe pas dans la table '{ref_table}'.")
-                    except sqlite3.Error as e:
-                        self._log_error(f"Erreur lors de la validation de clé étrangère: {str(e)}")
-                        errors.append(f"Erreur de validation pour le champ '{field}'.")
+        errors = self._validation_errors(table, [data])[0]
         
         # Si des erreurs sont trouvées, lever une exception
         if errors:
@@ -668,3 +1817,132 @@ class DatabaseManager:
             raise ValueError(f"Erreurs de validation: {error_message}")
         
         return True
+    
+    def validate_many(self, table, rows, max_errors=20):
+        """Valider un lot de lignes (import) avant insertion.
+        
+        Les clés étrangères de tout le lot sont vérifiées avec une requête
+        IN (...) par table référencée et par paquet de 500 identifiants, au
+        lieu d'une requête par champ et par ligne. Lève ValueError en listant
+        les lignes fautives (numérotées à partir de 1, max_errors au plus)."""
+        if table not in self.VALIDATION_RULES:
+            return True
+        
+        rows = list(rows)
+        failures = [(index, errors) for index, errors in enumerate(self._validation_errors(table, rows), 1)
+                    if errors]
+        
+        if failures:
+            lines = [f"Ligne {index}: {' '.join(errors)}" for index, errors in failures[:max_errors]]
+            if len(failures) > max_errors:
+                lines.append(f"... et {len(failures) - max_errors} autre(s) ligne(s) en erreur.")
+            error_message = "\n".join(lines)
+            self._log_error(f"Erreurs de validation pour la table '{table}' "
+                            f"({len(failures)}/{len(rows)} lignes): {error_message}")
+            raise ValueError(f"Erreurs de validation: {error_message}")
+        
+        return True
+    
+    def _validation_errors(self, table, rows):
+        """Erreurs de validation de chaque ligne (liste de messages par ligne)"""
+        rules = self.VALIDATION_RULES[table]
+        results = []
+        
+        for data in rows:
+            errors = []
+            
+            # Vérifier les champs requis
+            if 'required' in rules:
+                for field in rules['required']:
+                    if field not in data or data[field] is None or data[field] == '':
+                        errors.append(f"Le champ '{field}' est requis.")
+            
+            # Vérifier les longueurs maximales
+            if 'max_length' in rules:
+                for field, max_len in rules['max_length'].items():
+                    if field in data and data[field] and len(str(data[field])) > max_len:
+                        errors.append(f"Le champ '{field}' dépasse la longueur maximale de {max_len} caractères.")
+            
+            # Vérifier les champs numériques
+            if 'numeric' in rules:
+                for field in rules['numeric']:
+                    if field in data and data[field] is not None:
+                        try:
+                            float(data[field])
+                        except (ValueError, TypeError):
+                            errors.append(f"Le champ '{field}' doit être une valeur numérique.")
+            
+            results.append(errors)
+        
+        # Vérifier les clés étrangères: identifiants de tout le lot résolus ensemble
+        for field, ref_table in rules.get('foreign_key', {}).items():
+            values = [data.get(field) for data in rows]
+            ids = {self._id_key(value) for value in values if value is not None and value != ''}
+            ids.discard(None)
+            try:
+                missing = self._missing_ids(ref_table, ids)
+            except sqlite3.Error as e:
+                self._log_error(f"Erreur lors de la validation de clé étrangère: {str(e)}")
+                for value, errors in zip(values, results):
+                    if value is not None and value != '':
+                        errors.append(f"Erreur de validation pour le champ '{field}'.")
+                continue
+            
+            for value, errors in zip(values, results):
+                if value is None or value == '':
+                    continue
+                key = self._id_key(value)
+                if key is None or key in missing:
+                    errors.append(f"La référence '{field}' n'existe pas dans la table '{ref_table}'.")
+        
+        return results
+    
+    @staticmethod
+    def _id_key(value):
+        """Identifiant entier d'une valeur (3, '3', 3.0), ou None s'il n'en est pas un"""
+        if isinstance(value, bool):
+            return None
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None
+        return int(number) if number.is_integer() else None
+    
+    def _missing_ids(self, ref_table, ids, chunk_size=500):
+        """Identifiants de ids absents de ref_table.
+        
+        Les petites tables de référence sont comparées au registre en mémoire;
+        pour les autres, une requête IN (...) par paquet de chunk_size."""
+        if not ids:
+            return set()
+        if ref_table in self.REFERENCE_ID_TABLES:
+            return set(ids) - self.reference_ids(ref_table)
+        
+        ids = sorted(ids)
+        found = set()
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.execute_query(f"SELECT id FROM {ref_table} WHERE id IN ({placeholders})",
+                                      chunk, use_cache=False)
+            found.update(row[0] for row in rows)
+        return set(ids) - found
+    
+    def reference_ids(self, table):
+        """Ensemble (frozenset) des identifiants d'une petite table de référence.
+        
+        Chargé à la première demande puis gardé jusqu'à une écriture dans la
+        table (invalidate_cache, y compris depuis un autre processus)."""
+        self._check_coherence()
+        with self.cache_lock:
+            ids = self.reference_id_sets.get(table)
+            if ids is not None:
+                return ids
+            generation = self.reference_id_generation
+        
+        ids = frozenset(row[0] for row in self.execute_query(f"SELECT id FROM {table}", use_cache=False))
+        with self.cache_lock:
+            # Une écriture pendant la lecture rend l'ensemble périmé: ne pas le garder
+            if generation == self.reference_id_generation:
+                self.reference_id_sets[table] = ids
+        return ids
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Pont entre l'API asynchrone du DatabaseManager et l'interface Tkinter
+Les requêtes tournent hors du thread Tk; les résultats reviennent via after()
+"""
+
+import asyncio
+import queue
+import threading
+
+
+class TkAsyncBridge:
+    """Exécute des coroutines sur une boucle asyncio dédiée et livre les
+    résultats au thread Tk.
+    
+    Tkinter n'est pas thread-safe: les threads de travail déposent les
+    résultats dans une file, que le thread Tk vide par sondage avec after()
+    tant que des requêtes sont en cours."""
+    
+    POLL_INTERVAL = 20  # millisecondes
+    
+    def __init__(self, root, db_manager):
+        self.root = root
+        self.db_manager = db_manager
+        self.results = queue.Queue()
+        self.pending = 0
+        self.polling = False
+        self.latest = {}  # clé -> numéro de la dernière demande (les réponses périmées sont ignorées)
+        self.counter = 0
+        
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="db-async-loop", daemon=True)
+        self.thread.start()
+    
+    @classmethod
+    def for_widget(cls, widget, db_manager):
+        """Retourner le pont associé à la fenêtre racine du widget (un seul par application)"""
+        root = widget.winfo_toplevel()
+        while getattr(root, 'master', None) is not None:
+            root = root.master
+        bridge = getattr(root, '_db_async_bridge', None)
+        if bridge is None or bridge.db_manager is not db_manager:
+            bridge = cls(root, db_manager)
+            root._db_async_bridge = bridge
+        return bridge
+    
+    def submit(self, coro, callback=None, errback=None, key=None):
+        """Planifier une coroutine; callback(résultat) ou errback(exception) est appelé
+        sur le thread Tk. Avec une clé, seule la réponse à la demande la plus récente
+        portant cette clé est livrée."""
+        self.counter += 1
+        ticket = self.counter
+        if key is not None:
+            self.latest[key] = ticket
+        
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(
+            lambda f: self.results.put((f, callback, errback, key, ticket))
+        )
+        
+        self.pending += 1
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.POLL_INTERVAL, self._poll)
+        return future
+    
+    def run_query(self, query, params=None, callback=None, errback=None, key=None, **kwargs):
+        """Raccourci: exécuter db_manager.aquery(...) et livrer le résultat à callback"""
+        return self.submit(self.db_manager.aquery(query, params, **kwargs), callback, errback, key)
+    
+    def _poll(self):
+        """Livrer les résultats disponibles sur le thread Tk"""
+        try:
+            while True:
+                try:
+                    future, callback, errback, key, ticket = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                
+                self.pending -= 1
+                if key is not None and self.latest.get(key) != ticket:
+                    continue  # Une demande plus récente a remplacé celle-ci
+                if future.cancelled():
+                    continue
+                
+                error = future.exception()
+                if error is not None:
+                    if errback:
+                        errback(error)
+                elif callback:
+                    callback(future.result())
+        finally:
+            # Continuer à sonder même si un callback a levé une exception
+            if self.pending > 0:
+                self.root.after(self.POLL_INTERVAL, self._poll)
+            else:
+                self.polling = False
+    
+    def close(self):
+        """Arrêter la boucle asyncio"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
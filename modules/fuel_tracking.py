@@ -8,10 +8,15 @@ from tkinter import ttk, messagebox
 from datetime import datetime, date
 import re
 
+from .db_async import TkAsyncBridge
+from .money import from_centimes, to_centimes
+
 class FuelTracking:
     def __init__(self, parent, db_manager):
         self.parent = parent
         self.db_manager = db_manager
+        # Chargement de la liste hors du thread Tk pour ne pas figer l'écran de la pompe
+        self.bridge = TkAsyncBridge.for_widget(parent, db_manager)
         
         self.setup_interface()
         self.load_fuel_prices()
@@ -296,28 +301,17 @@ class FuelTracking:
     
     def on_client_search(self, event):
         """Filtrer les clients en temps réel"""
-        search_term = self.client_combo.get().lower()
-        if len(search_term) < 2:
+        search_term = self.client_combo.get()
+        if len(search_term.strip()) < 2:
             return
         
         try:
-            query = """
-                SELECT c.id, c.nom, c.prenom, c.solde_actuel
-                FROM clients c 
-                WHERE (
-                    LOWER(c.nom) LIKE ? OR 
-                    LOWER(c.prenom) LIKE ?
-                )
-                ORDER BY c.nom, c.prenom
-                LIMIT 10
-            """
-            search_pattern = f"%{search_term}%"
-            # Ne pas utiliser le cache pour les recherches en temps réel
-            clients = self.db_manager.execute_query(query, (search_pattern, search_pattern), use_cache=False)
+            # Index plein texte: nom, prénom, entreprise, téléphone ou plaque
+            clients = self.db_manager.search_clients(search_term, limit=10)
             
             client_list = []
             for client in clients:
-                client_id, nom, prenom, solde = client
+                client_id, nom, prenom, _, _, solde = client
                 
                 display_name = f"{client_id} - {nom} {prenom or ''} [Solde: {solde:.2f} DH]"
                 client_list.append(display_name.strip())
@@ -480,7 +474,9 @@ class FuelTracking:
             # Validation numérique
             quantite = float(self.transaction_vars['quantite'].get())
             prix_unitaire = float(self.transaction_vars['prix_unitaire'].get())
-            montant_total = quantite * prix_unitaire
+            # Montant arrondi au centime: celui affiché, facturé et débité
+            montant_centimes = to_centimes(quantite * prix_unitaire)
+            montant_total = from_centimes(montant_centimes)
             
             pompe = None
             if self.transaction_vars['pompe'].get().strip():
@@ -505,17 +501,15 @@ class FuelTracking:
                 pompe, notes
             )
             
-            # Utiliser le paramètre table pour invalider automatiquement le cache
-            transaction_id = self.db_manager.execute_insert(query, params, table='transactions')
-            
-            # Mise à jour du solde client (si paiement à crédit)
-            if self.transaction_vars['type_paiement'].get() == 'credit':
-                update_query = """
-                    UPDATE clients 
-                    SET solde_actuel = solde_actuel - ? 
-                    WHERE id = ?
-                """
-                self.db_manager.execute_update(update_query, (montant_total, client_id), table='clients')
+            # Vente et mise à jour du solde dans un seul commit atomique
+            with self.db_manager.transaction():
+                # Utiliser le paramètre table pour invalider automatiquement le cache
+                transaction_id = self.db_manager.execute_insert(query, params, table='transactions')
+                
+                # Mise à jour du solde client (si paiement à crédit)
+                if self.transaction_vars['type_paiement'].get() == 'credit':
+                    self.db_manager.adjust_client_balance(client_id, -montant_centimes, "vente",
+                                                          "transactions", transaction_id)
             
             messagebox.showinfo("Succès", f"Transaction enregistrée avec succès (ID: {transaction_id})")
             
@@ -542,22 +536,19 @@ class FuelTracking:
         self.vehicule_combo['values'] = []
     
     def load_transactions(self):
-        """Charger la liste des transactions selon les filtres"""
+        """Charger la liste des transactions selon les filtres (affichage asynchrone)"""
         try:
-            # Vider la liste actuelle
-            for item in self.transactions_tree.get_children():
-                self.transactions_tree.delete(item)
-            
             # Construire la requête selon la période
             period = self.filter_period.get()
             where_clause = ""
             
+            # Bornes constantes sur la clé de jour indexée (pas de fonction sur la colonne)
             if period == "aujourd_hui":
-                where_clause = "DATE(t.date_transaction) = DATE('now')"
+                where_clause = "t.jour = CAST(strftime('%Y%m%d', 'now') AS INTEGER)"
             elif period == "cette_semaine":
-                where_clause = "DATE(t.date_transaction) >= DATE('now', '-7 days')"
+                where_clause = "t.jour >= CAST(strftime('%Y%m%d', 'now', '-7 days') AS INTEGER)"
             elif period == "ce_mois":
-                where_clause = "DATE(t.date_transaction) >= DATE('now', 'start of month')"
+                where_clause = "t.jour >= CAST(strftime('%Y%m%d', 'now', 'start of month') AS INTEGER)"
             
             # Filtre par station
             station_filter = self.filter_station.get()
@@ -584,7 +575,23 @@ class FuelTracking:
             """
             
             # Utiliser le cache avec un timeout court pour les transactions récentes
-            transactions = self.db_manager.execute_query(query, use_cache=True, cache_timeout=30)
+            self.bridge.run_query(
+                query,
+                callback=self.display_transactions,
+                errback=lambda e: messagebox.showerror("Erreur", f"Erreur lors du chargement des transactions: {str(e)}"),
+                key='fuel_transactions',
+                use_cache=True, cache_timeout=30
+            )
+                
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Erreur lors du chargement des transactions: {str(e)}")
+    
+    def display_transactions(self, transactions):
+        """Afficher les transactions chargées (appelé sur le thread Tk)"""
+        try:
+            # Vider la liste actuelle
+            for item in self.transactions_tree.get_children():
+                self.transactions_tree.delete(item)
             
             for transaction in transactions:
                 # Formatage de la date
@@ -633,33 +640,31 @@ class FuelTracking:
                 item = selection[0]
                 transaction_id = self.transactions_tree.item(item)['values'][0]
                 
-                # Récupérer les détails de la transaction pour ajuster le solde
-                query = """
-                    SELECT client_id, montant_total, type_paiement 
-                    FROM transactions 
-                    WHERE id = ?
-                """
-                # Ne pas utiliser le cache pour cette vérification critique
-                result = self.db_manager.execute_query(query, (transaction_id,), use_cache=False)
-                
-                if result:
-                    client_id, montant, type_paiement = result[0]
-                    
-                    # Supprimer la transaction
-                delete_query = "DELETE FROM transactions WHERE id = ?"
-                # Utiliser le paramètre table pour invalider automatiquement le cache
-                self.db_manager.execute_update(delete_query, (transaction_id,), table='transactions')
-                
-                # Ajuster le solde client si c'était à crédit
-                if type_paiement == 'credit':
-                    update_query = """
-                        UPDATE clients 
-                        SET solde_actuel = solde_actuel + ? 
+                # Lecture, suppression et ajustement du solde dans une seule transaction
+                with self.db_manager.transaction():
+                    # Récupérer les détails de la transaction pour ajuster le solde
+                    query = """
+                        SELECT client_id, montant_centimes, type_paiement 
+                        FROM transactions 
                         WHERE id = ?
                     """
-                    # Utiliser le paramètre table pour invalider automatiquement le cache
-                    self.db_manager.execute_update(update_query, (montant, client_id), table='clients')
+                    result = self.db_manager.execute_query(query, (transaction_id,))
                     
+                    if result:
+                        client_id, montant_centimes, type_paiement = result[0]
+                        
+                        # Supprimer la transaction
+                        delete_query = "DELETE FROM transactions WHERE id = ?"
+                        # Utiliser le paramètre table pour invalider automatiquement le cache
+                        self.db_manager.execute_update(delete_query, (transaction_id,), table='transactions')
+                        
+                        # Ajuster le solde client si c'était à crédit
+                        if type_paiement == 'credit':
+                            self.db_manager.adjust_client_balance(client_id, montant_centimes, "annulation",
+                                                                  "transactions", transaction_id,
+                                                                  "Suppression de la vente")
+                
+                if result:
                     messagebox.showinfo("Succès", "Transaction supprimée avec succès")
                     self.load_transactions()
                     self.load_clients()  # Recharger pour mettre à jour les soldes
@@ -1050,24 +1055,25 @@ class EditTransactionDialog:
     def load_transaction_data(self):
         """Charger les données de la transaction"""
         try:
-            query = "SELECT * FROM transactions WHERE id = ?"
+            # Colonnes explicites: leur position dépend de l'historique des migrations
+            query = """
+                SELECT quantite, prix_unitaire, montant_total, type_paiement,
+                       numero_pompe, kilometrage, notes
+                FROM transactions WHERE id = ?
+            """
             result = self.db_manager.execute_query(query, (self.transaction_id,))
             
             if result:
-                data = result[0]
-                # Mapping des champs selon la structure de la table
-                fields = ['id', 'station_id', 'client_id', 'vehicule_id', 'carburant_id',
-                         'quantite', 'prix_unitaire', 'montant_total', 'type_paiement',
-                         'date_transaction', 'numero_pompe', 'kilometrage', 'notes']
+                quantite, prix, montant, type_paiement, pompe, kilometrage, notes = result[0]
                 
                 # Remplir les champs modifiables
-                self.edit_vars['quantite'].set(str(data[5]) if data[5] else '')
-                self.edit_vars['prix_unitaire'].set(str(data[6]) if data[6] else '')
-                self.edit_vars['montant_total'].set(f"{data[7]:.2f}" if data[7] else '0.00')
-                self.edit_vars['type_paiement'].set(str(data[8]) if data[8] else 'credit')
-                self.edit_vars['numero_pompe'].set(str(data[10]) if data[10] else '')
-                self.edit_vars['kilometrage'].set(str(data[11]) if data[11] else '')
-                self.edit_vars['notes'].set(str(data[12]) if data[12] else '')
+                self.edit_vars['quantite'].set(str(quantite) if quantite else '')
+                self.edit_vars['prix_unitaire'].set(str(prix) if prix else '')
+                self.edit_vars['montant_total'].set(f"{montant:.2f}" if montant else '0.00')
+                self.edit_vars['type_paiement'].set(str(type_paiement) if type_paiement else 'credit')
+                self.edit_vars['numero_pompe'].set(str(pompe) if pompe else '')
+                self.edit_vars['kilometrage'].set(str(kilometrage) if kilometrage else '')
+                self.edit_vars['notes'].set(str(notes) if notes else '')
                 
         except Exception as e:
             messagebox.showerror("Erreur", f"Erreur lors du chargement: {str(e)}")
@@ -1093,14 +1099,9 @@ class EditTransactionDialog:
                 messagebox.showerror("Erreur", "La quantité et le prix doivent être supérieurs à 0")
                 return
             
-            montant = quantite * prix
+            montant_centimes = to_centimes(quantite * prix)
+            montant = from_centimes(montant_centimes)
             
-            # Récupérer l'ancien montant pour ajuster le solde
-            old_query = "SELECT client_id, montant_total, type_paiement FROM transactions WHERE id = ?"
-            old_data = self.db_manager.execute_query(old_query, (self.transaction_id,))[0]
-            old_client_id, old_montant, old_type_paiement = old_data
-            
-            # Mise à jour de la transaction
             update_query = """
                 UPDATE transactions SET
                     quantite = ?, prix_unitaire = ?, montant_total = ?,
@@ -1117,21 +1118,31 @@ class EditTransactionDialog:
                 self.transaction_id
             )
             
-            self.db_manager.execute_update(update_query, params)
-            
-            # Ajuster le solde client si nécessaire
             new_type_paiement = self.edit_vars['type_paiement'].get()
             
-            if old_type_paiement == 'credit' or new_type_paiement == 'credit':
-                # Remettre l'ancien solde
-                if old_type_paiement == 'credit':
-                    adjust_query = "UPDATE clients SET solde_actuel = solde_actuel + ? WHERE id = ?"
-                    self.db_manager.execute_update(adjust_query, (old_montant, old_client_id))
+            # Modification et ajustements de solde dans un seul commit atomique
+            with self.db_manager.transaction():
+                # Récupérer l'ancien montant pour ajuster le solde
+                old_query = "SELECT client_id, montant_centimes, type_paiement FROM transactions WHERE id = ?"
+                old_data = self.db_manager.execute_query(old_query, (self.transaction_id,))[0]
+                old_client_id, old_montant_centimes, old_type_paiement = old_data
                 
-                # Appliquer le nouveau solde
-                if new_type_paiement == 'credit':
-                    adjust_query = "UPDATE clients SET solde_actuel = solde_actuel - ? WHERE id = ?"
-                    self.db_manager.execute_update(adjust_query, (montant, old_client_id))
+                # Mise à jour de la transaction
+                self.db_manager.execute_update(update_query, params, table='transactions')
+                
+                # Ajuster le solde client si nécessaire
+                if old_type_paiement == 'credit' or new_type_paiement == 'credit':
+                    # Remettre l'ancien solde
+                    if old_type_paiement == 'credit':
+                        self.db_manager.adjust_client_balance(old_client_id, old_montant_centimes, "correction",
+                                                              "transactions", self.transaction_id,
+                                                              "Modification de la vente (ancien montant)")
+                    
+                    # Appliquer le nouveau solde
+                    if new_type_paiement == 'credit':
+                        self.db_manager.adjust_client_balance(old_client_id, -montant_centimes, "correction",
+                                                              "transactions", self.transaction_id,
+                                                              "Modification de la vente (nouveau montant)")
             
             messagebox.showinfo("Succès", "Transaction modifiée avec succès")
             self.callback()
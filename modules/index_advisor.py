@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+Conseiller d'index fondé sur la charge réellement enregistrée
+Les empreintes de requêtes relevées par le profileur sont rejouées avec
+EXPLAIN QUERY PLAN sur une copie du schéma en mémoire (avec les statistiques
+sqlite_stat1 de la vraie base): les index candidats y sont créés et évalués
+sans toucher aux données
+"""
+
+import re
+import sqlite3
+
+from .sharding import SHARDED_TABLES
+
+# Opérateurs relevés dans les clauses WHERE/ON pour choisir les colonnes clés
+_EQUALITY = r"(?:==|=|\bIN\b|\bIS\b)"
+_RANGE = r"(?:<=|>=|<|>|\bBETWEEN\b)"
+_FROM_RE = re.compile(
+    r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|JOIN|LEFT|INNER|CROSS|NATURAL|GROUP|ORDER|LIMIT|USING)\b)(\w+))?",
+    re.I
+)
+_PLAN_RE = re.compile(r"^(SCAN|SEARCH) (?:TABLE )?(\w+)(?: USING (COVERING INDEX|INDEX|INTEGER PRIMARY KEY) ?(\w+)?)?(?: \((.*)\))?")
+
+
+class IndexAdvisor:
+    """Proposer (et éventuellement créer) des index couvrants pour les requêtes
+    enregistrées qui parcourent entièrement une table volumineuse.
+    
+    Le coût est estimé en lignes lues à partir de sqlite_stat1: N pour un
+    parcours complet, le nombre moyen de lignes par clé pour une recherche
+    indexée (divisé par 4 par borne d'intervalle), doublé quand chaque ligne
+    d'index oblige à relire la table."""
+    
+    MAX_INDEX_COLUMNS = 6  # Au-delà, l'index couvrant coûte plus qu'il ne rapporte
+    SAMPLE_ROWS = 100000  # Lignes échantillonnées pour estimer la sélectivité
+    CANDIDATE_NAME = "conseiller_candidat"
+    
+    def __init__(self, db_manager, min_rows=1000):
+        self.db_manager = db_manager
+        self.min_rows = min_rows
+    
+    def advise(self):
+        """Analyser la charge enregistrée et retourner les propositions, les plus
+        rentables (gain estimé × nombre d'appels) en premier"""
+        workload = self.db_manager.profiler.samples()
+        proposals = {}
+        
+        with self.db_manager.get_connection(read_only=True) as conn:
+            shadow, row_counts, stats = self._shadow_database(conn)
+            existing = self._existing_indexes(conn)
+            try:
+                for fingerprint, query, params, count in workload:
+                    if not query.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE")):
+                        continue
+                    plan_before, columns = self._explain(shadow, query, params)
+                    if not plan_before:
+                        continue
+                    aliases = self._aliases(query)
+                    cost_before = self._estimate_cost(plan_before, aliases, row_counts, stats)
+                    
+                    for alias in self._scanned(plan_before):
+                        table = aliases.get(alias.lower(), alias.lower())
+                        if row_counts.get(table, 0) < self.min_rows:
+                            continue
+                        key_columns = self._key_columns(query, table, aliases, columns)
+                        if not key_columns or self._already_indexed(existing.get(table, []), key_columns):
+                            continue
+                        index_columns = self._covering_columns(key_columns, columns.get(table, set()))
+                        
+                        stat = self._candidate_stat(conn, table, index_columns, row_counts[table])
+                        plan_after = self._explain_with_candidate(shadow, table, index_columns, stat,
+                                                                  query, params)
+                        if not any(self.CANDIDATE_NAME in line for _, line in plan_after):
+                            continue
+                        stats[self.CANDIDATE_NAME] = [int(value) for value in stat.split()]
+                        cost_after = self._estimate_cost(plan_after, aliases, row_counts, stats)
+                        del stats[self.CANDIDATE_NAME]
+                        if cost_after >= cost_before * 0.5:
+                            continue
+                        
+                        name = self._index_name(table, index_columns)
+                        proposal = proposals.setdefault(name, {
+                            "name": name,
+                            "table": table,
+                            "columns": index_columns,
+                            "sql": f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(index_columns)})",
+                            "rows": row_counts[table],
+                            "queries": [],
+                            "calls": 0,
+                            "cost_before": 0,
+                            "cost_after": 0,
+                            "applied": False
+                        })
+                        proposal["queries"].append({
+                            "fingerprint": fingerprint,
+                            "calls": count,
+                            "cost_before": cost_before,
+                            "cost_after": cost_after,
+                            "plan_before": [line for _, line in plan_before],
+                            "plan_after": [line.replace(self.CANDIDATE_NAME, name) for _, line in plan_after]
+                        })
+                        proposal["calls"] += count
+                        proposal["cost_before"] += cost_before * count
+                        proposal["cost_after"] += cost_after * count
+            finally:
+                shadow.close()
+        
+        return sorted(proposals.values(), key=lambda p: p["cost_before"] - p["cost_after"], reverse=True)
+    
+    def apply(self, proposals):
+        """Créer les index proposés dans la vraie base et calculer leurs statistiques.
+        
+        Pour une table répartie, l'index est créé dans le fichier de chaque
+        station; la table vide de la base de référence le reçoit aussi, comme
+        modèle recopié dans les fichiers des nouvelles stations."""
+        shards = self.db_manager.shards
+        created = []
+        for proposal in proposals:
+            name, table = proposal["name"], proposal["table"]
+            # Index qualifié par son schéma: la table est cherchée dans le même
+            # fichier, et non dans la vue temporaire de fédération
+            targets = [("main", table)]
+            if shards is not None and table in SHARDED_TABLES:
+                targets.extend((shards.schema_name(station_id), shards.shard_table(table, station_id))
+                               for station_id in shards.station_ids)
+            with self.db_manager.transaction() as conn:
+                conn.execute("PRAGMA analysis_limit = 1000")
+                for schema, local in targets:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.{name} "
+                                 f"ON {local} ({', '.join(proposal['columns'])})")
+                    conn.execute(f"ANALYZE {schema}.{name}")
+            proposal["applied"] = True
+            created.append(proposal["name"])
+        return created
+    
+    # ------------------------------------------------------------------
+    # Copie du schéma et statistiques
+    # ------------------------------------------------------------------
+    def _shadow_database(self, conn):
+        """Copie vide du schéma en mémoire, chargée avec les statistiques réelles"""
+        shadow = sqlite3.connect(":memory:")
+        objects = conn.execute("""
+            SELECT type, sql FROM sqlite_master
+            WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' AND type IN ('table', 'index', 'view')
+            ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END
+        """).fetchall()
+        for _, sql in objects:
+            try:
+                shadow.execute(sql)
+            except sqlite3.Error:
+                pass  # Tables internes d'une table virtuelle, déjà créées par celle-ci
+        
+        stat_rows = []
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            stat_rows = conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1").fetchall()
+        
+        # Tables réparties: la table de la base de référence est vide, les
+        # statistiques viennent des fichiers des stations
+        sharded = self._sharded_stats(conn)
+        stat_rows = [row for row in stat_rows if row[0].lower() not in sharded]
+        for table, table_stats in sharded.items():
+            stat_rows.extend((table, idx, stat) for idx, stat in table_stats)
+        
+        row_counts = {}
+        stats = {}
+        for tbl, idx, stat in stat_rows:
+            values = [int(value) for value in stat.split() if value.isdigit()]
+            if not values:
+                continue
+            row_counts[tbl.lower()] = values[0]
+            if idx:
+                stats[idx] = values
+        
+        # Tables jamais analysées: compter les lignes
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        for table in tables:
+            if table.lower() not in row_counts:
+                try:
+                    row_counts[table.lower()] = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                except sqlite3.Error:
+                    continue
+                stat_rows.append((table, None, str(row_counts[table.lower()])))
+        
+        shadow.execute("ANALYZE")  # Crée sqlite_stat1 dans la copie
+        shadow.execute("DELETE FROM sqlite_stat1")
+        shadow.executemany("INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)", stat_rows)
+        shadow.execute("ANALYZE sqlite_master")  # Recharger les statistiques
+        return shadow, row_counts, stats
+    
+    def _sharded_stats(self, conn):
+        """Lignes sqlite_stat1 des tables réparties, par table: nombre total de
+        lignes des stations et, pour chaque index, la sélectivité relevée dans
+        le fichier de la station la plus volumineuse"""
+        shards = self.db_manager.shards
+        if shards is None:
+            return {}
+        sharded = {}
+        for table in SHARDED_TABLES:
+            total, largest, index_stats = 0, -1, {}
+            for station_id in shards.station_ids:
+                schema = shards.schema_name(station_id)
+                local = shards.shard_table(table, station_id)
+                rows, station_stats = None, {}
+                if conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+                    for idx, stat in conn.execute(f"SELECT idx, stat FROM {schema}.sqlite_stat1 WHERE tbl = ?",
+                                                  (local,)).fetchall():
+                        values = stat.split()
+                        if not values or not values[0].isdigit():
+                            continue
+                        rows = int(values[0])
+                        if idx:
+                            station_stats[idx] = values[1:]
+                if rows is None:
+                    rows = conn.execute(f"SELECT COUNT(*) FROM {schema}.{local}").fetchone()[0]
+                total += rows
+                if rows > largest and (station_stats or not index_stats):
+                    largest, index_stats = rows, station_stats
+            
+            table_stats = [(None, str(total))]
+            table_stats.extend((idx, " ".join([str(total)] + values)) for idx, values in index_stats.items())
+            sharded[table] = table_stats
+        return sharded
+    
+    @staticmethod
+    def _existing_indexes(conn):
+        """Colonnes des index existants, par table"""
+        indexes = {}
+        for table, name in conn.execute(
+            "SELECT tbl_name, name FROM sqlite_master WHERE type = 'index'"
+        ).fetchall():
+            columns = [row[2] for row in conn.execute(f"PRAGMA index_info({name})").fetchall()]
+            indexes.setdefault(table.lower(), []).append(columns)
+        return indexes
+    
+    def _candidate_stat(self, conn, table, columns, total_rows):
+        """Ligne sqlite_stat1 estimée pour un index candidat (échantillon de la table)"""
+        prefixes = []
+        for i in range(1, len(columns) + 1):
+            key = " || ',' || ".join(f"quote({column})" for column in columns[:i])
+            prefixes.append(f"COUNT(DISTINCT {key})")
+        row = conn.execute(
+            f"SELECT COUNT(*), {', '.join(prefixes)} "
+            f"FROM (SELECT {', '.join(columns)} FROM {table} LIMIT {self.SAMPLE_ROWS})"
+        ).fetchone()
+        sampled = max(row[0], 1)
+        averages = [max(1, round(sampled / max(distinct, 1))) for distinct in row[1:]]
+        return " ".join(str(value) for value in [total_rows] + averages)
+    
+    # ------------------------------------------------------------------
+    # Plans d'exécution
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _explain(shadow, query, params):
+        """Plan (parent, détail) d'une requête et colonnes lues par table (autorisateur)"""
+        columns = {}
+        
+        def collect(action, arg1, arg2, db_name, trigger):
+            if action == sqlite3.SQLITE_READ and arg1 and arg2 and not trigger:
+                columns.setdefault(arg1.lower(), set()).add(arg2)
+            return sqlite3.SQLITE_OK
+        
+        shadow.set_authorizer(collect)
+        try:
+            rows = shadow.execute(f"EXPLAIN QUERY PLAN {query}", params or ()).fetchall()
+        except sqlite3.Error:
+            return [], {}
+        finally:
+            shadow.set_authorizer(None)
+        return [(row[1], row[3]) for row in rows], columns
+    
+    def _explain_with_candidate(self, shadow, table, columns, stat, query, params):
+        """Plan de la requête avec l'index candidat créé dans la copie"""
+        shadow.execute(f"CREATE INDEX {self.CANDIDATE_NAME} ON {table} ({', '.join(columns)})")
+        shadow.execute("INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)",
+                       (table, self.CANDIDATE_NAME, stat))
+        shadow.execute("ANALYZE sqlite_master")
+        try:
+            plan, _ = self._explain(shadow, query, params)
+        finally:
+            shadow.execute(f"DROP INDEX {self.CANDIDATE_NAME}")
+            shadow.execute("DELETE FROM sqlite_stat1 WHERE idx = ?", (self.CANDIDATE_NAME,))
+            shadow.execute("ANALYZE sqlite_master")
+        return plan
+    
+    @staticmethod
+    def _scanned(plan):
+        """Tables (alias) parcourues entièrement dans un plan"""
+        scanned = []
+        for _, detail in plan:
+            match = _PLAN_RE.match(detail)
+            if match and match.group(1) == "SCAN" and match.group(3) != "COVERING INDEX":
+                if match.group(2) != "CONSTANT":
+                    scanned.append(match.group(2))
+        return scanned
+    
+    @staticmethod
+    def _estimate_cost(plan, aliases, row_counts, stats):
+        """Lignes lues estimées: boucles imbriquées au niveau principal, une
+        exécution par sous-requête"""
+        cost = 0.0
+        outer_rows = 1.0
+        for parent, detail in plan:
+            match = _PLAN_RE.match(detail)
+            if not match:
+                continue
+            kind, alias, using, index, terms = match.groups()
+            terms = terms or ""
+            total = row_counts.get(aliases.get(alias.lower(), alias.lower()), 1)
+            
+            if kind == "SCAN":
+                rows = total
+                factor = 1
+            elif using == "INTEGER PRIMARY KEY":
+                rows = 1 if "=" in terms and ">" not in terms and "<" not in terms else total / 4
+                factor = 1
+            else:
+                equalities = len(re.findall(r"\w+=\?", terms))
+                bounds = len(re.findall(r"[<>]", terms))
+                values = stats.get(index, [total])
+                rows = values[min(equalities, len(values) - 1)] if equalities else total
+                rows = max(rows / (4 ** bounds), 1)
+                factor = 1 if using == "COVERING INDEX" else 2
+            
+            if parent == 0:
+                cost += outer_rows * rows * factor
+                outer_rows *= max(rows, 1)
+            else:
+                cost += rows * factor
+        return cost
+    
+    # ------------------------------------------------------------------
+    # Choix des colonnes
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _aliases(query):
+        """Correspondance alias -> table des clauses FROM/JOIN"""
+        aliases = {}
+        for table, alias in _FROM_RE.findall(query):
+            aliases[table.lower()] = table.lower()
+            if alias:
+                aliases[alias.lower()] = table.lower()
+        return aliases
+    
+    def _key_columns(self, query, table, aliases, columns):
+        """Colonnes clés: égalités, puis une borne d'intervalle ou le tri"""
+        text = query
+        # Ignorer la liste de sélection (CASE WHEN ... = ... n'est pas un filtre)
+        upper = text.upper()
+        if upper.lstrip().startswith("SELECT") and " FROM " in upper:
+            text = text[upper.index(" FROM "):]
+        elif upper.lstrip().startswith("UPDATE") and " WHERE " in upper:
+            text = text[upper.index(" WHERE "):]
+        
+        table_aliases = [alias for alias, name in aliases.items() if name == table]
+        other_tables = {name for name in aliases.values() if name != table}
+        
+        equalities, ranges, ordering = [], [], []
+        order_text = text[text.upper().rfind("ORDER BY"):] if "ORDER BY" in text.upper() else ""
+        for column in sorted(columns.get(table, ()), key=lambda c: text.find(c)):
+            if not column or column.lower() == "id":
+                continue
+            qualifier = "|".join(re.escape(alias) for alias in table_aliases)
+            # Une colonne non qualifiée n'est attribuée à la table que sans ambiguïté
+            ambiguous = any(column in columns.get(other, ()) for other in other_tables)
+            prefix = rf"\b(?:{qualifier})\." if ambiguous else rf"(?:\b(?:{qualifier})\.)?"
+            reference = rf"{prefix}\b{re.escape(column)}\b"
+            
+            if re.search(rf"{reference}\s*{_EQUALITY}|(?:==|=)\s*{reference}", text, re.I):
+                equalities.append(column)
+            elif re.search(rf"{reference}\s*{_RANGE}|(?:<=|>=|<|>)\s*{reference}", text, re.I):
+                ranges.append(column)
+            elif order_text and re.search(reference, order_text, re.I):
+                ordering.append(column)
+        
+        if not equalities and not ranges and not ordering:
+            return []
+        return equalities + (ranges[:1] if ranges else ordering[:1])
+    
+    def _covering_columns(self, key_columns, table_columns):
+        """Compléter la clé par les autres colonnes lues si l'index reste étroit"""
+        others = sorted(column for column in table_columns
+                        if column and column.lower() != "id" and column not in key_columns)
+        if len(key_columns) + len(others) <= self.MAX_INDEX_COLUMNS:
+            return key_columns + others
+        return key_columns
+    
+    @staticmethod
+    def _already_indexed(indexes, key_columns):
+        """Un index existant commence-t-il déjà par ces colonnes clés?"""
+        return any(columns[:len(key_columns)] == key_columns for columns in indexes)
+    
+    @staticmethod
+    def _index_name(table, columns):
+        """Nom stable d'un index proposé"""
+        return f"idx_auto_{table}_{'_'.join(columns)}"[:60]
@@ -13,10 +13,16 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 import os
 
+from .database import day_key
+from .db_async import TkAsyncBridge
+from .money import TVA_TAUX, format_centimes, from_centimes, tva_centimes
+
 class InvoiceManagement:
     def __init__(self, parent, db_manager):
         self.parent = parent
         self.db_manager = db_manager
+        # Requêtes de préparation de facture hors du thread Tk
+        self.bridge = TkAsyncBridge.for_widget(parent, db_manager)
         self.setup_interface()
         self.load_invoices()
     
@@ -257,28 +263,17 @@ class InvoiceManagement:
     
     def on_invoice_client_search(self, event):
         """Recherche client en temps réel"""
-        search_term = self.invoice_client_combo.get().lower()
-        if len(search_term) < 2:
+        search_term = self.invoice_client_combo.get()
+        if len(search_term.strip()) < 2:
             return
         
         try:
-            query = """
-                SELECT c.id, c.nom, c.prenom, c.entreprise, c.type_client
-                FROM clients c 
-                WHERE c.statut = 'actif' AND (
-                    LOWER(c.nom) LIKE ? OR 
-                    LOWER(c.prenom) LIKE ? OR 
-                    LOWER(c.entreprise) LIKE ?
-                )
-                ORDER BY c.nom, c.prenom
-                LIMIT 10
-            """
-            search_pattern = f"%{search_term}%"
-            clients = self.db_manager.execute_query(query, (search_pattern, search_pattern, search_pattern), use_cache=False, table="clients")
+            # Index plein texte: nom, prénom, entreprise, téléphone ou plaque
+            clients = self.db_manager.search_clients(search_term, limit=10, active_only=True)
             
             client_list = []
             for client in clients:
-                client_id, nom, prenom, entreprise, type_client = client
+                client_id, nom, prenom, entreprise, type_client, _ = client
                 
                 if entreprise and type_client == 'entreprise':
                     display_name = f"{client_id} - {entreprise}"
@@ -315,7 +310,9 @@ class InvoiceManagement:
             where_conditions = [
                 "t.client_id = ?",
                 "t.type_paiement = 'credit'",  # Seulement les transactions à crédit
-                "t.id NOT IN (SELECT DISTINCT lf.transaction_id FROM lignes_facture lf WHERE lf.transaction_id IS NOT NULL)"
+                # Anti-jointure corrélée: une recherche dans idx_lignes_facture_transaction
+                # par transaction au lieu de matérialiser toutes les lignes de facture
+                "NOT EXISTS (SELECT 1 FROM lignes_facture lf WHERE lf.transaction_id = t.id)"
             ]
             
             params = [client_id]
@@ -324,13 +321,14 @@ class InvoiceManagement:
             date_from = self.date_from_var.get()
             date_to = self.date_to_var.get()
             
+            # Période semi-ouverte sur la clé de jour indexée
             if date_from:
-                where_conditions.append("DATE(t.date_transaction) >= DATE(?)")
-                params.append(date_from)
+                where_conditions.append("t.jour >= ?")
+                params.append(day_key(date_from))
             
             if date_to:
-                where_conditions.append("DATE(t.date_transaction) <= DATE(?)")
-                params.append(date_to)
+                where_conditions.append("t.jour < ?")
+                params.append(day_key(date_to, 1))
             
             # Filtre station
             station_text = self.invoice_station_var.get()
@@ -346,7 +344,7 @@ class InvoiceManagement:
                     t.id, t.date_transaction,
                     COALESCE(v.immatriculation, '-') as vehicule,
                     car.nom as carburant,
-                    t.quantite, t.prix_unitaire, t.montant_total
+                    t.quantite, t.prix_unitaire, t.montant_total, t.montant_centimes
                 FROM transactions t
                 LEFT JOIN vehicules v ON t.vehicule_id = v.id
                 JOIN carburants car ON t.carburant_id = car.id
@@ -354,9 +352,24 @@ class InvoiceManagement:
                 ORDER BY t.date_transaction DESC
             """
             
-            transactions = self.db_manager.execute_query(query, params)
+            self.bridge.run_query(
+                query, params,
+                callback=self.display_unbilled_transactions,
+                errback=lambda e: messagebox.showerror("Erreur", f"Erreur lors du chargement des transactions: {str(e)}"),
+                key='unbilled_transactions'
+            )
+            
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Erreur lors du chargement des transactions: {str(e)}")
+    
+    def display_unbilled_transactions(self, transactions):
+        """Afficher les transactions non facturées (appelé sur le thread Tk)"""
+        try:
+            for item in self.unbilled_tree.get_children():
+                self.unbilled_tree.delete(item)
             
             self.selected_transactions = set()  # Pour stocker les IDs sélectionnés
+            self.unbilled_amounts = {}  # ID -> montant en centimes (totaux sans relire l'affichage)
             
             for transaction in transactions:
                 date_str = transaction[1][:10] if transaction[1] else ''
@@ -374,6 +387,7 @@ class InvoiceManagement:
                 item_id = self.unbilled_tree.insert('', 'end', values=values)
                 # Stocker l'ID de la transaction dans les tags
                 self.unbilled_tree.set(item_id, '#0', transaction[0])
+                self.unbilled_amounts[transaction[0]] = transaction[7]
             
             self.update_invoice_summary()
             
@@ -437,24 +451,20 @@ class InvoiceManagement:
             return
         
         nb_selected = len(self.selected_transactions)
-        total_ht = 0
-        
-        # Calculer le total des transactions sélectionnées
-        for item in self.unbilled_tree.get_children():
-            transaction_id = int(self.unbilled_tree.set(item, '#0'))
-            if transaction_id in self.selected_transactions:
-                values = self.unbilled_tree.item(item)['values']
-                montant_str = values[6].replace(' DH', '')
-                total_ht += float(montant_str)
-        
-        tva = total_ht * 0.20  # TVA 20%
-        total_ttc = total_ht + tva
+        total_ht, tva, total_ttc = self.selected_totals()
         
         # Mettre à jour les labels
         self.summary_labels['nb_transactions'].config(text=f"Transactions: {nb_selected}")
-        self.summary_labels['total_ht'].config(text=f"Total HT: {total_ht:.2f} DH")
-        self.summary_labels['tva'].config(text=f"TVA (20%): {tva:.2f} DH")
-        self.summary_labels['total_ttc'].config(text=f"Total TTC: {total_ttc:.2f} DH")
+        self.summary_labels['total_ht'].config(text=f"Total HT: {format_centimes(total_ht)}")
+        self.summary_labels['tva'].config(text=f"TVA ({TVA_TAUX}%): {format_centimes(tva)}")
+        self.summary_labels['total_ttc'].config(text=f"Total TTC: {format_centimes(total_ttc)}")
+    
+    def selected_totals(self):
+        """(HT, TVA, TTC) en centimes des transactions sélectionnées"""
+        total_ht = sum(self.unbilled_amounts.get(transaction_id, 0)
+                       for transaction_id in self.selected_transactions)
+        tva = tva_centimes(total_ht)
+        return total_ht, tva, total_ht + tva
     
     def preview_invoice(self):
         """Aperçu de la facture"""
@@ -484,17 +494,8 @@ class InvoiceManagement:
             station_result = self.db_manager.execute_query(station_query, (first_transaction,))
             station_id = station_result[0][0] if station_result else 1
             
-            # Calculer les montants
-            total_ht = 0
-            for item in self.unbilled_tree.get_children():
-                transaction_id = int(self.unbilled_tree.set(item, '#0'))
-                if transaction_id in self.selected_transactions:
-                    values = self.unbilled_tree.item(item)['values']
-                    montant_str = values[6].replace(' DH', '')
-                    total_ht += float(montant_str)
-            
-            tva = total_ht * 0.20
-            total_ttc = total_ht + tva
+            # Calculer les montants (en centimes entiers)
+            total_ht, tva, total_ttc = self.selected_totals()
             
             # Générer le numéro de facture
             today = datetime.now()
@@ -510,40 +511,47 @@ class InvoiceManagement:
             
             invoice_params = (
                 invoice_number, client_id, station_id, today.strftime('%Y-%m-%d'),
-                total_ht, tva, total_ttc
+                from_centimes(total_ht), from_centimes(tva), from_centimes(total_ttc)
             )
             
-            invoice_id = self.db_manager.execute_insert(invoice_query, invoice_params, table="factures")
+            # Lignes de facture: véhicule affiché dans la liste, pour chaque transaction sélectionnée
+            selected_vehicles = {}
+            for item in self.unbilled_tree.get_children():
+                transaction_id = int(self.unbilled_tree.set(item, '#0'))
+                if transaction_id in self.selected_transactions:
+                    selected_vehicles[transaction_id] = self.unbilled_tree.item(item)['values'][2]
             
-            # Insérer les lignes de facture
             line_query = """
                 INSERT INTO lignes_facture (
                     facture_id, transaction_id, description, quantite, prix_unitaire, montant
                 ) VALUES (?, ?, ?, ?, ?, ?)
             """
             
-            for item in self.unbilled_tree.get_children():
-                transaction_id = int(self.unbilled_tree.set(item, '#0'))
-                if transaction_id in self.selected_transactions:
-                    values = self.unbilled_tree.item(item)['values']
-                    
-                    # Récupérer les détails de la transaction
-                    trans_query = """
-                        SELECT car.nom, t.quantite, t.prix_unitaire, t.montant_total
+            # Facture et lignes dans une seule transaction
+            with self.db_manager.transaction():
+                invoice_id = self.db_manager.execute_insert(invoice_query, invoice_params, table="factures")
+                
+                # Récupérer les détails des transactions par lots (limite de paramètres SQLite)
+                ids = list(selected_vehicles)
+                trans_results = []
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    placeholders = ", ".join("?" for _ in batch)
+                    trans_query = f"""
+                        SELECT t.id, car.nom, t.quantite, t.prix_unitaire, t.montant_total
                         FROM transactions t
                         JOIN carburants car ON t.carburant_id = car.id
-                        WHERE t.id = ?
+                        WHERE t.id IN ({placeholders})
                     """
-                    trans_result = self.db_manager.execute_query(trans_query, (transaction_id,), use_cache=False, table="transactions")
-                    
-                    if trans_result:
-                        carburant, quantite, prix_unit, montant = trans_result[0]
-                        description = f"{carburant} - {values[2]}"  # Carburant + véhicule
-                        
-                        self.db_manager.execute_insert(line_query, (
-                            invoice_id, transaction_id, description,
-                            quantite, prix_unit, montant
-                        ), table="lignes_facture")
+                    trans_results.extend(self.db_manager.execute_query(trans_query, batch, table="transactions"))
+                
+                # Insérer les lignes de facture par paquets
+                lines = (
+                    (invoice_id, transaction_id, f"{carburant} - {selected_vehicles[transaction_id]}",  # Carburant + véhicule
+                     quantite, prix_unit, montant)
+                    for transaction_id, carburant, quantite, prix_unit, montant in trans_results
+                )
+                self.db_manager.execute_many(line_query, lines, table="lignes_facture")
             
             messagebox.showinfo("Succès", f"Facture créée avec succès!\nNuméro: {invoice_number}")
             
@@ -573,11 +581,11 @@ class InvoiceManagement:
             
             # Filtre période
             if period == "cette_semaine":
-                where_conditions.append("DATE(f.date_facture) >= DATE('now', '-7 days')")
+                where_conditions.append("f.jour >= CAST(strftime('%Y%m%d', 'now', '-7 days') AS INTEGER)")
             elif period == "ce_mois":
-                where_conditions.append("DATE(f.date_facture) >= DATE('now', 'start of month')")
+                where_conditions.append("f.jour >= CAST(strftime('%Y%m%d', 'now', 'start of month') AS INTEGER)")
             elif period == "trimestre":
-                where_conditions.append("DATE(f.date_facture) >= DATE('now', '-3 months')")
+                where_conditions.append("f.jour >= CAST(strftime('%Y%m%d', 'now', '-3 months') AS INTEGER)")
             
             # Filtre statut
             if status != "toutes":
@@ -666,10 +674,10 @@ class InvoiceManagement:
             
             invoice = invoice_data[0]
             
-            # Récupérer les lignes de facture
-            lines_query = """
+            # Récupérer les lignes de facture (archivées avec leur transaction le cas échéant)
+            lines_query = f"""
                 SELECT lf.description, lf.quantite, lf.prix_unitaire, lf.montant
-                FROM lignes_facture lf
+                FROM {self.db_manager.history_table("lignes_facture")} lf
                 WHERE lf.facture_id = ?
                 ORDER BY lf.id
             """
@@ -6,7 +6,7 @@ Responsive + Scroll
 
 import tkinter as tk
 from tkinter import ttk, messagebox
-from datetime import datetime
+from datetime import date, datetime
 
 # Import des modules de l'application
 from .client_management_simple import ClientManagement
@@ -15,6 +15,18 @@ from .invoice_management import InvoiceManagement
 from .payment_management import PaymentManagement
 from .reports import Reports
 from .auth import AdminPanel
+from .money import format_centimes
+
+
+def station_kpi_cards(kpis):
+    """Cartes (titre, valeur) du tableau de bord à partir de station_kpis()"""
+    return [
+        ("Ventes", str(kpis["ventes"])),
+        ("Litres", f"{kpis['litres']:.2f} L"),
+        ("Chiffre d'affaires", format_centimes(kpis["chiffre_affaires"])),
+        ("Panier moyen", format_centimes(kpis["panier_moyen"])),
+        ("Clients", str(kpis["clients"]))
+    ]
 
 
 class ScrollableFrame(ttk.Frame):
@@ -400,6 +412,7 @@ class MainWindow:
             width=50
         )
         self.station_combo.pack(side='left', fill="x", expand=True)
+        self.station_combo.bind("<<ComboboxSelected>>", lambda event: self.load_dashboard_data())
         
         # Bouton de rafraîchissement
         refresh_btn = ttk.Button(
@@ -514,7 +527,7 @@ class MainWindow:
             # Actualiser les données si nécessaire
             if "Tableau de Bord" in tab_name:
                 # Actualiser les statistiques du tableau de bord
-                pass
+                self.load_dashboard_data()
             elif "Clients" in tab_name:
                 # Actualiser la liste des clients
                 pass
@@ -547,6 +560,7 @@ class MainWindow:
         # === Statistiques ===
         stats_frame = ttk.LabelFrame(parent, text="Statistiques du Jour", padding=20)
         stats_frame.grid(row=0, column=0, sticky="ew", pady=(0, 20))
+        self.stats_frame = stats_frame
 
         # === Actions Rapides ===
         actions_frame = ttk.LabelFrame(parent, text="Actions Rapides", padding=20)
@@ -601,8 +615,17 @@ class MainWindow:
     def load_dashboard_data(self):
         """Charger les données du tableau de bord"""
         try:
-            # Placeholder pour stats réelles
-            pass
+            station_id = self.get_selected_station_id()
+            if station_id is None or not hasattr(self, 'stats_frame'):
+                return
+            
+            # Indicateurs du jour mémoïsés: recalculés seulement après une vente
+            today = date.today()
+            kpis = self.db_manager.station_kpis(station_id, today, today)
+            for widget in self.stats_frame.winfo_children():
+                widget.destroy()
+            for col, (title, value) in enumerate(station_kpi_cards(kpis)):
+                self.create_stat_card(self.stats_frame, title, value, 0, col)
         except Exception as e:
             messagebox.showerror("Erreur", f"Erreur lors du chargement des données: {str(e)}")
 
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Mémoïsation des valeurs dérivées coûteuses
+Le décorateur memoized garde les résultats d'une fonction (ou méthode) dans un
+cache LRU borné, avec durée de vie et invalidation par table: toute écriture
+passant par DatabaseManager (execute_insert, execute_update, transactions,
+changements détectés depuis un autre processus) vide les entrées des fonctions
+qui dépendent des tables modifiées, pour le seul gestionnaire qui les a vues.
+"""
+
+import functools
+import inspect
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import date, datetime
+
+# Caches de toutes les fonctions mémoïsées (pour l'invalidation et les statistiques)
+_registry = weakref.WeakSet()
+
+
+def freeze(value):
+    """Convertir une valeur d'argument en clé hashable stable
+    (listes et tuples -> tuple, dictionnaires -> tuple trié, ensembles -> frozenset).
+    
+    Lève TypeError pour une valeur qui n'a pas d'équivalent hashable."""
+    if value is None or isinstance(value, (str, int, float, bytes, date, datetime)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((freeze(k), freeze(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+    hash(value)
+    return value
+
+
+class Memoized:
+    """Cache d'une fonction: clés normalisées, LRU borné, durée de vie et
+    invalidation par table.
+    
+    Avec scope="instance" (méthodes), chaque objet a son propre cache, libéré
+    avec l'objet; avec scope="shared", les résultats sont partagés entre
+    instances (self ne fait pas partie de la clé). before(*args) est appelé
+    avant chaque recherche dans le cache, avec l'instance pour une méthode."""
+    
+    def __init__(self, func, maxsize=128, ttl=60, tables=None, scope="instance", before=None):
+        if scope not in ("instance", "shared"):
+            raise ValueError(f"Portée de mémoïsation inconnue: {scope}")
+        self.func = func
+        self.maxsize = maxsize
+        self.ttl = ttl  # Secondes (None: pas d'expiration)
+        if isinstance(tables, str):
+            tables = [tables]
+        self.tables = frozenset(t.lower() for t in tables) if tables else frozenset(["*"])
+        self.signature = inspect.signature(func)
+        self.is_method = next(iter(self.signature.parameters), None) == "self"
+        self.scope = scope if self.is_method else "shared"
+        self.before = before
+        self.lock = threading.RLock()
+        self.shared = OrderedDict()
+        self.instances = weakref.WeakKeyDictionary()  # objet -> OrderedDict
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0,
+            "invalidations": 0,
+            "uncacheable": 0
+        }
+        _registry.add(self)
+    
+    def _key(self, args, kwargs):
+        """Clé normalisée: f(1, b=2) et f(a=1, b=2) partagent la même entrée"""
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = list(bound.arguments.items())
+        if self.is_method:
+            arguments = arguments[1:]
+        return freeze(arguments)
+    
+    def _entries(self, args):
+        """Cache concerné par l'appel (celui de l'instance ou le cache partagé)"""
+        if self.scope == "shared":
+            return self.shared
+        owner = args[0]
+        entries = self.instances.get(owner)
+        if entries is None:
+            entries = self.instances[owner] = OrderedDict()  # TypeError si l'objet n'a pas de weakref
+        return entries
+    
+    def __call__(self, *args, **kwargs):
+        if self.before is not None:
+            # Ex. cohérence avec les autres processus: peut invalider ce cache
+            if self.is_method:
+                self.before(args[0])
+            else:
+                self.before()
+        
+        with self.lock:
+            try:
+                key = self._key(args, kwargs)
+                entries = self._entries(args)
+            except TypeError:
+                # Argument non hashable (objet modifiable...): appel direct sans cache
+                self.stats["uncacheable"] += 1
+                entries = None
+        if entries is None:
+            return self.func(*args, **kwargs)
+        
+        with self.lock:
+            entry = entries.get(key)
+            if entry is not None:
+                result, timestamp = entry
+                if self.ttl is None or time.time() - timestamp < self.ttl:
+                    entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return result
+                del entries[key]
+                self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            generation = self.stats["invalidations"]
+        
+        result = self.func(*args, **kwargs)
+        
+        with self.lock:
+            # Une invalidation pendant le calcul rend le résultat douteux: ne pas le garder
+            if generation == self.stats["invalidations"]:
+                entries[key] = (result, time.time())
+                entries.move_to_end(key)
+                while len(entries) > self.maxsize:
+                    entries.popitem(last=False)
+                    self.stats["evictions"] += 1
+        return result
+    
+    def __get__(self, instance, owner=None):
+        """Lier le cache à l'instance quand il décore une méthode"""
+        if instance is None:
+            return self
+        bound = functools.partial(self.__call__, instance)
+        bound.cache_clear = functools.partial(self.cache_clear, instance)
+        bound.clear_cache = bound.cache_clear
+        bound.cache_info = self.cache_info
+        return bound
+    
+    def depends_on(self, tables):
+        """Indiquer si le cache dépend d'une des tables (None ou "*": toutes)"""
+        return tables is None or "*" in tables or "*" in self.tables or not self.tables.isdisjoint(tables)
+    
+    def cache_clear(self, instance=None):
+        """Vider le cache (seulement celui de instance si elle est donnée)"""
+        with self.lock:
+            self.stats["invalidations"] += 1
+            if instance is not None and self.scope == "instance":
+                self.instances.pop(instance, None)
+                return
+            self.shared.clear()
+            self.instances.clear()
+    
+    clear_cache = cache_clear
+    
+    def invalidate(self, owner=None):
+        """Vider les entrées calculées pour le gestionnaire owner (None: toutes).
+        
+        Une entrée par instance lui appartient si l'instance est owner ou a
+        owner pour db_manager; le cache partagé ne peut pas être attribué à
+        un gestionnaire et est toujours vidé."""
+        with self.lock:
+            self.stats["invalidations"] += 1
+            self.shared.clear()
+            if owner is None:
+                self.instances.clear()
+                return
+            for instance in list(self.instances.keys()):
+                if instance is owner or getattr(instance, "db_manager", None) is owner:
+                    del self.instances[instance]
+    
+    def cache_info(self):
+        """Compteurs du cache et nombre d'entrées"""
+        with self.lock:
+            info = dict(self.stats)
+            info["size"] = len(self.shared) + sum(len(entries) for entries in self.instances.values())
+            info["maxsize"] = self.maxsize
+            info["ttl"] = self.ttl
+            info["tables"] = sorted(self.tables)
+            info["hit_ratio"] = info["hits"] / max(1, info["hits"] + info["misses"])
+            return info
+
+
+def memoized(maxsize=128, ttl=60, tables=None, scope="instance", before=None):
+    """Décorateur de mémoïsation.
+    
+    tables: tables dont dépend le résultat (nom ou liste). Les écritures dans
+    ces tables vident le cache; sans tables, toute écriture le vide.
+    before: appelé avant chaque recherche dans le cache (voir Memoized)."""
+    def decorator(func):
+        memo = Memoized(func, maxsize=maxsize, ttl=ttl, tables=tables, scope=scope, before=before)
+        functools.update_wrapper(memo, func)
+        return memo
+    
+    return decorator
+
+
+def invalidate_tables(tables=None, owner=None):
+    """Vider les caches qui dépendent des tables (ensemble de noms en
+    minuscules, ou None pour tous les caches), pour les entrées du seul
+    gestionnaire owner s'il est donné: une écriture dans une base ne
+    concerne pas les valeurs calculées sur une autre"""
+    for memo in list(_registry):
+        if memo.depends_on(tables):
+            memo.invalidate(owner)
+
+
+def memo_stats():
+    """Statistiques de chaque fonction mémoïsée, par nom qualifié"""
+    stats = {}
+    for memo in list(_registry):
+        name = f"{memo.func.__module__}.{memo.func.__qualname__}"
+        stats[name] = memo.cache_info()
+    return stats
@@ -0,0 +1,868 @@
+# -*- coding: utf-8 -*-
+"""
+Migrations versionnées du schéma de la base de données
+Chaque migration est appliquée une seule fois, dans sa propre transaction;
+la version atteinte est enregistrée dans la table schema_version
+"""
+
+import hashlib
+import sqlite3
+
+MIGRATIONS = []  # (version, description, fonction(cursor)) dans l'ordre d'application
+
+# Reprises à exécuter une fois les fichiers des stations et des archives attachés:
+# version -> fonction(cursor, history_table), seulement au démarrage qui applique la migration
+AFTER_ATTACH = {}
+
+
+def migration(version, description, after_attach=None):
+    """Décorateur: enregistrer une migration (les versions doivent être croissantes).
+    
+    after_attach(cursor, history_table) complète la migration sur les données
+    qu'elle ne voit pas encore (ventes réparties par station, exercices archivés)."""
+    def decorator(func):
+        assert not MIGRATIONS or MIGRATIONS[-1][0] < version, "Versions de migration non ordonnées"
+        MIGRATIONS.append((version, description, func))
+        if after_attach is not None:
+            AFTER_ATTACH[version] = after_attach
+        return func
+    return decorator
+
+
+def latest_version():
+    """Version du schéma attendue par le code"""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn):
+    """Version actuelle du schéma (0 si la base n'a jamais été migrée)"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if not exists:
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def pending_migrations(version):
+    """Migrations restant à appliquer après la version donnée"""
+    return [item for item in MIGRATIONS if item[0] > version]
+
+
+def record_version(cursor, version, description):
+    """Inscrire une migration appliquée"""
+    cursor.execute(
+        "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+        (version, description)
+    )
+
+
+def column_exists(cursor, table, column):
+    """Vérifier si une colonne existe dans une table"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in cursor.fetchall())
+
+
+def add_column(cursor, table, column, definition):
+    """Ajouter une colonne si elle est absente (les anciennes bases l'ont parfois déjà)"""
+    if not column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def add_computed_column(cursor, table, name, expression, source):
+    """Ajouter la colonne name calculée par expression depuis la colonne source.
+    
+    Colonne générée virtuelle (aucun stockage, calculée à la lecture et dans
+    l'index) si SQLite >= 3.31; sinon colonne ordinaire remplie puis tenue à
+    jour par des triggers."""
+    if column_exists(cursor, table, name):
+        return
+    if sqlite3.sqlite_version_info >= (3, 31, 0):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} INTEGER GENERATED ALWAYS AS ({expression}) VIRTUAL")
+        return
+    
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} INTEGER")
+    cursor.execute(f"UPDATE {table} SET {name} = {expression}")
+    new_expression = expression.replace(source, f"NEW.{source}")
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{name}_insert AFTER INSERT ON {table}
+        BEGIN
+            UPDATE {table} SET {name} = {new_expression} WHERE id = NEW.id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{name}_update AFTER UPDATE OF {source} ON {table}
+        BEGIN
+            UPDATE {table} SET {name} = {new_expression} WHERE id = NEW.id;
+        END
+    """)
+
+
+def add_day_key(cursor, table, column):
+    """Ajouter la clé de jour entière aaaammjj 'jour' calculée depuis column"""
+    add_computed_column(cursor, table, "jour", f"CAST(strftime('%Y%m%d', {column}) AS INTEGER)", column)
+
+
+def centimes_expression(column):
+    """Montant REAL converti en centimes entiers (arrondi au centime le plus proche)"""
+    return f"CAST(ROUND({column} * 100) AS INTEGER)"
+
+
+def add_centimes(cursor, table, column, name):
+    """Ajouter la colonne name: le montant column en centimes entiers"""
+    add_computed_column(cursor, table, name, centimes_expression(column), column)
+
+
+def create_base_schema(cursor):
+    """Créer les tables de base"""
+    # Table des stations
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom TEXT NOT NULL,
+            adresse TEXT,
+            telephone TEXT,
+            responsable TEXT,
+            date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Table des clients (simplifiée)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom TEXT NOT NULL,
+            prenom TEXT,
+            telephone TEXT,
+            solde_actuel REAL DEFAULT 0,
+            date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Table des véhicules clients avec matricule marocain
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vehicules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            matricule TEXT NOT NULL,
+            marque TEXT,
+            modele TEXT,
+            type_carburant TEXT,
+            FOREIGN KEY (client_id) REFERENCES clients (id)
+        )
+    """)
+    
+    # Table des types de carburant
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS carburants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom TEXT NOT NULL,
+            prix_unitaire REAL NOT NULL,
+            unite TEXT DEFAULT 'litre',
+            couleur TEXT DEFAULT '#FF0000'
+        )
+    """)
+    
+    # Table des transactions de carburant
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            station_id INTEGER NOT NULL,
+            client_id INTEGER NOT NULL,
+            vehicule_id INTEGER,
+            carburant_id INTEGER NOT NULL,
+            quantite REAL NOT NULL,
+            prix_unitaire REAL NOT NULL,
+            montant_total REAL NOT NULL,
+            type_paiement TEXT DEFAULT 'credit',
+            date_transaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            numero_pompe INTEGER,
+            notes TEXT,
+            FOREIGN KEY (station_id) REFERENCES stations (id),
+            FOREIGN KEY (client_id) REFERENCES clients (id),
+            FOREIGN KEY (vehicule_id) REFERENCES vehicules (id),
+            FOREIGN KEY (carburant_id) REFERENCES carburants (id)
+        )
+    """)
+    
+    # Table des paiements d'avance
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS paiements_avance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            montant REAL NOT NULL,
+            mode_paiement TEXT NOT NULL,
+            date_paiement TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            reference_paiement TEXT,
+            notes TEXT,
+            statut TEXT DEFAULT 'actif',
+            FOREIGN KEY (client_id) REFERENCES clients (id)
+        )
+    """)
+    
+    # Table des factures
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS factures (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            numero_facture TEXT UNIQUE NOT NULL,
+            client_id INTEGER NOT NULL,
+            station_id INTEGER NOT NULL,
+            date_facture DATE NOT NULL,
+            montant_ht REAL NOT NULL,
+            tva REAL NOT NULL,
+            montant_ttc REAL NOT NULL,
+            statut TEXT DEFAULT 'impayee',
+            date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            notes TEXT,
+            FOREIGN KEY (client_id) REFERENCES clients (id),
+            FOREIGN KEY (station_id) REFERENCES stations (id)
+        )
+    """)
+    
+    # Table des lignes de facture
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lignes_facture (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            facture_id INTEGER NOT NULL,
+            transaction_id INTEGER,
+            description TEXT NOT NULL,
+            quantite REAL NOT NULL,
+            prix_unitaire REAL NOT NULL,
+            montant REAL NOT NULL,
+            FOREIGN KEY (facture_id) REFERENCES factures (id),
+            FOREIGN KEY (transaction_id) REFERENCES transactions (id)
+        )
+    """)
+    
+    # Table des utilisateurs pour le système de login
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS utilisateurs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom_utilisateur TEXT UNIQUE NOT NULL,
+            mot_de_passe TEXT NOT NULL,
+            role TEXT NOT NULL CHECK (role IN ('administrateur', 'employe')),
+            nom_complet TEXT,
+            actif BOOLEAN DEFAULT 1,
+            date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def create_base_indexes(cursor):
+    """Créer des index pour optimiser les requêtes fréquentes"""
+    # Index pour les recherches de clients
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clients_nom ON clients (nom)")
+    
+    # Index pour les recherches de véhicules par client
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_vehicules_client ON vehicules (client_id)")
+    
+    # Index pour les recherches de transactions par client
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_client ON transactions (client_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date_transaction)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_station ON transactions (station_id)")
+    
+    # Index pour les recherches de paiements par client
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_paiements_client ON paiements_avance (client_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_paiements_date ON paiements_avance (date_paiement)")
+    
+    # Index pour les recherches de factures par client
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_factures_client ON factures (client_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_factures_date ON factures (date_facture)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_factures_numero ON factures (numero_facture)")
+    
+    # Index pour les lignes de facture
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lignes_facture ON lignes_facture (facture_id)")
+
+
+def insert_initial_data(cursor):
+    """Insérer les données initiales"""
+    # Vérifier si des stations existent déjà
+    cursor.execute("SELECT COUNT(*) FROM stations")
+    if cursor.fetchone()[0] == 0:
+        # Insérer les 6 stations
+        stations = [
+            ("Station Timizar", "route Sidi Kacem", "05********", "Yassin Tyal"),
+            ("Station 2", "Local 2", "05********", "Géront 2"),
+            ("Station 3", "Local 3", "05********", "Géront 3"),
+            ("Station 4", "Local 4", "05********", "Géront 4"),
+            ("Station 5", "Local 5", "05********", "Géront 5"),
+            ("Station 6", "Local 6", "05********", "Géront 6")
+        ]
+    
+        for station in stations:
+            cursor.execute(
+                "INSERT INTO stations (nom, adresse, telephone, responsable) VALUES (?, ?, ?, ?)",
+                station
+            )
+    
+    # Vérifier si des carburants existent déjà
+    cursor.execute("SELECT COUNT(*) FROM carburants")
+    if cursor.fetchone()[0] == 0:
+        # Insérer les types de carburant
+        carburants = [
+            ("Essence", 14.50, "litre", "#FF4444"),
+            ("Diesel", 11.80, "litre", "#44FF44"),
+            ("Électrique", 0.00, "kWh", "#00FFFF"),
+            ("Hybride", 13.20, "litre", "#FF8800")
+        ]
+    
+        for carburant in carburants:
+            cursor.execute(
+                "INSERT INTO carburants (nom, prix_unitaire, unite, couleur) VALUES (?, ?, ?, ?)",
+                carburant
+            )
+    
+    # Vérifier si des utilisateurs existent déjà
+    cursor.execute("SELECT COUNT(*) FROM utilisateurs")
+    if cursor.fetchone()[0] == 0:
+        # Créer l'utilisateur administrateur par défaut
+        admin_password = hashlib.sha256("admin123".encode()).hexdigest()
+        employe_password = hashlib.sha256("employe123".encode()).hexdigest()
+    
+        utilisateurs = [
+            ("admin", admin_password, "administrateur", "Administrateur"),
+            ("employe", employe_password, "employe", "Employé")
+        ]
+    
+        for utilisateur in utilisateurs:
+            cursor.execute(
+                "INSERT INTO utilisateurs (nom_utilisateur, mot_de_passe, role, nom_complet) VALUES (?, ?, ?, ?)",
+                utilisateur
+            )
+
+
+@migration(1, "Schéma initial et données de départ")
+def schema_initial(cursor):
+    # Les bases créées avant le suivi des versions ont déjà ces tables:
+    # toutes les créations sont conditionnelles
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            date_application TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    create_base_schema(cursor)
+    create_base_indexes(cursor)
+    insert_initial_data(cursor)
+
+
+@migration(2, "Colonnes utilisées par l'application absentes du schéma de base")
+def colonnes_manquantes(cursor):
+    # Fiche client complète (gestion des clients, facturation)
+    add_column(cursor, "clients", "entreprise", "TEXT")
+    add_column(cursor, "clients", "email", "TEXT")
+    add_column(cursor, "clients", "adresse", "TEXT")
+    add_column(cursor, "clients", "ice", "TEXT")
+    add_column(cursor, "clients", "type_client", "TEXT DEFAULT 'particulier'")
+    add_column(cursor, "clients", "credit_limite", "REAL DEFAULT 0")
+    add_column(cursor, "clients", "statut", "TEXT DEFAULT 'actif'")
+    
+    # Véhicules: immatriculation (factures) et capacité du réservoir
+    add_column(cursor, "vehicules", "immatriculation", "TEXT")
+    add_column(cursor, "vehicules", "capacite_reservoir", "REAL")
+    add_column(cursor, "vehicules", "matricule", "TEXT")
+    
+    # Kilométrage relevé à chaque plein
+    add_column(cursor, "transactions", "kilometrage", "INTEGER")
+    
+    # Préférences utilisateur (jusqu'ici créées à la volée par l'interface)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS preferences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            preference_key TEXT NOT NULL,
+            preference_value TEXT,
+            UNIQUE(user_id, preference_key)
+        )
+    """)
+
+
+@migration(3, "Clé de jour indexée sur transactions, paiements_avance et factures")
+def cle_de_jour(cursor):
+    # Les filtres de période comparent jour (entier aaaammjj) à des bornes
+    # constantes: parcours d'intervalle d'index au lieu de DATE(colonne) = ...
+    add_day_key(cursor, "transactions", "date_transaction")
+    add_day_key(cursor, "paiements_avance", "date_paiement")
+    add_day_key(cursor, "factures", "date_facture")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_jour ON transactions (jour)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_paiements_jour ON paiements_avance (jour)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_factures_jour ON factures (jour)")
+
+
+@migration(4, "Index composites et partiels des requêtes les plus fréquentes")
+def index_requetes_frequentes(cursor):
+    # Transactions d'un client par type de paiement et période (facturation,
+    # bilan des créances); remplace l'index simple sur client_id, son préfixe
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_client_paiement
+        ON transactions (client_id, type_paiement, jour)
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_transactions_client")
+    
+    # Ventes à crédit d'une période, tous clients confondus (encours, relances):
+    # index partiel limité aux lignes à crédit
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_credit
+        ON transactions (jour) WHERE type_paiement = 'credit'
+    """)
+    
+    # Anti-jointure « transaction déjà facturée »
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lignes_facture_transaction ON lignes_facture (transaction_id)")
+    
+    # Liste des paiements filtrée par statut, triée par date (pas de tri temporaire)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_paiements_statut ON paiements_avance (statut, date_paiement)")
+
+
+# Tables dont les modifications sont capturées pour la réplication vers le siège
+CAPTURED_TABLES = ("transactions", "paiements_avance", "factures", "clients")
+
+
+def captured_columns(cursor, table):
+    """Colonnes copiées dans le journal (les colonnes générées sont recalculées)"""
+    cursor.execute(f"PRAGMA table_xinfo({table})")
+    return [row[1] for row in cursor.fetchall() if row[6] not in (2, 3)]
+
+
+def capture_payload(columns, row):
+    """Expression json_object(...) des colonnes d'une ligne (NEW, OLD ou alias)"""
+    return "json_object(" + ", ".join(f"'{column}', {row}.{column}" for column in columns) + ")"
+
+
+def create_capture_triggers(cursor):
+    """(Re)créer les triggers de capture des tables répliquées.
+    
+    Les colonnes sont figées dans le corps des triggers: à rappeler après
+    toute migration qui ajoute une colonne à une table répliquée. Une ligne
+    dans capture_suspendue (voir suspend_capture) désactive la capture."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'journal_modifications'")
+    if cursor.fetchone() is None:
+        return
+    for table in CAPTURED_TABLES:
+        payload = capture_payload(captured_columns(cursor, table), "NEW")
+        for operation in ("insert", "update", "delete"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_capture_{operation}")
+        cursor.execute(f"""
+            CREATE TRIGGER trg_{table}_capture_insert AFTER INSERT ON {table}
+            WHEN NOT EXISTS (SELECT 1 FROM capture_suspendue)
+            BEGIN
+                INSERT INTO journal_modifications (nom_table, operation, ligne_id, donnees)
+                VALUES ('{table}', 'INSERT', NEW.id, {payload});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER trg_{table}_capture_update AFTER UPDATE ON {table}
+            WHEN NOT EXISTS (SELECT 1 FROM capture_suspendue)
+            BEGIN
+                INSERT INTO journal_modifications (nom_table, operation, ligne_id, donnees)
+                VALUES ('{table}', 'UPDATE', NEW.id, {payload});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER trg_{table}_capture_delete AFTER DELETE ON {table}
+            WHEN NOT EXISTS (SELECT 1 FROM capture_suspendue)
+            BEGIN
+                INSERT INTO journal_modifications (nom_table, operation, ligne_id, donnees)
+                VALUES ('{table}', 'DELETE', OLD.id, NULL);
+            END
+        """)
+
+
+def suspend_capture(cursor, suspended=True):
+    """Suspendre (ou rétablir) la capture, dans la transaction en cours, pour les
+    déplacements internes qui ne sont pas des modifications métier. La ligne
+    insérée n'est jamais visible des autres connexions si elle est retirée
+    avant la validation."""
+    if suspended:
+        cursor.execute("INSERT OR IGNORE INTO capture_suspendue (id) VALUES (1)")
+    else:
+        cursor.execute("DELETE FROM capture_suspendue")
+
+
+@migration(5, "Journal des modifications pour la réplication vers le siège")
+def journal_modifications(cursor):
+    # Journal en ajout seul: AUTOINCREMENT garantit des numéros de séquence
+    # strictement croissants, jamais réutilisés même après une purge
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS journal_modifications (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            nom_table TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            ligne_id INTEGER NOT NULL,
+            donnees TEXT,
+            date_modification TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Drapeau de suspension de la capture (voir suspend_capture)
+    cursor.execute("CREATE TABLE IF NOT EXISTS capture_suspendue (id INTEGER PRIMARY KEY)")
+    
+    # Dernière séquence expédiée vers chaque destination
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS replication_position (
+            cible TEXT PRIMARY KEY,
+            dernier_seq INTEGER NOT NULL DEFAULT 0,
+            date_envoi TIMESTAMP
+        )
+    """)
+    create_capture_triggers(cursor)
+
+
+# Tables internes sans compteur de modifications (jamais mises en cache)
+UNCOUNTED_TABLES = ("schema_version", "compteurs_modifications", "journal_modifications",
+                    "capture_suspendue", "replication_position")
+
+
+def create_change_counters(cursor):
+    """(Re)créer les triggers qui incrémentent le compteur de chaque table modifiée.
+    
+    Les autres processus (autre caisse, panneau d'administration) comparent ces
+    compteurs à ceux qu'ils ont vus pour invalider leur cache table par table.
+    À rappeler après toute migration qui crée une table."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'compteurs_modifications'")
+    if cursor.fetchone() is None:
+        return
+    cursor.execute("""
+        SELECT name, sql LIKE 'CREATE VIRTUAL TABLE%' FROM sqlite_master
+        WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+    """)
+    rows = cursor.fetchall()
+    # Pas de trigger sur une table virtuelle (FTS5) ni sur ses tables internes
+    virtual = [name for name, is_virtual in rows if is_virtual]
+    tables = [name for name, is_virtual in rows
+              if not is_virtual and name not in UNCOUNTED_TABLES
+              and not any(name.startswith(f"{parent}_") for parent in virtual)]
+    for table in tables:
+        cursor.execute("INSERT OR IGNORE INTO compteurs_modifications (nom_table) VALUES (?)", (table,))
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS trg_{table}_compteur_{operation.lower()}")
+            cursor.execute(f"""
+                CREATE TRIGGER trg_{table}_compteur_{operation.lower()} AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE compteurs_modifications SET version = version + 1 WHERE nom_table = '{table}';
+                END
+            """)
+
+
+@migration(6, "Compteurs de modifications par table (cohérence des caches entre postes)")
+def compteurs_modifications(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS compteurs_modifications (
+            nom_table TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    create_change_counters(cursor)
+
+
+@migration(7, "Montants en centimes entiers (sommes exactes) et solde client en centimes")
+def montants_centimes(cursor):
+    # Montants écrits une fois: colonnes calculées, stockées dans les index qui
+    # les contiennent; les sommes portent sur des entiers (exactes)
+    add_centimes(cursor, "transactions", "montant_total", "montant_centimes")
+    add_centimes(cursor, "paiements_avance", "montant", "montant_centimes")
+    add_centimes(cursor, "factures", "montant_ht", "montant_ht_centimes")
+    add_centimes(cursor, "factures", "tva", "tva_centimes")
+    add_centimes(cursor, "factures", "montant_ttc", "montant_ttc_centimes")
+    
+    # CA et litres d'une période lus dans l'index seul (tableau de bord, graphique);
+    # remplace l'index simple sur jour, son préfixe
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_jour_montant
+        ON transactions (jour, montant_centimes, quantite)
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_transactions_jour")
+    
+    # Solde client: cumul de débits et crédits, stocké en centimes entiers (plus
+    # d'erreur d'arrondi accumulée); solde_actuel en reste le reflet en DH.
+    # Une écriture de solde_actuel seul (ancien code, import) est répercutée.
+    add_column(cursor, "clients", "solde_centimes", "INTEGER NOT NULL DEFAULT 0")
+    cursor.execute(f"UPDATE clients SET solde_centimes = {centimes_expression('COALESCE(solde_actuel, 0)')}")
+    cursor.execute("UPDATE clients SET solde_actuel = solde_centimes / 100.0")
+    synced = centimes_expression("COALESCE(NEW.solde_actuel, 0)")
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_solde_insert AFTER INSERT ON clients
+        WHEN NEW.solde_centimes IS NOT {synced}
+        BEGIN
+            UPDATE clients SET solde_centimes = {synced}, solde_actuel = {synced} / 100.0 WHERE id = NEW.id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_solde_update AFTER UPDATE OF solde_actuel ON clients
+        WHEN NEW.solde_centimes IS NOT {synced}
+        BEGIN
+            UPDATE clients SET solde_centimes = {synced}, solde_actuel = {synced} / 100.0 WHERE id = NEW.id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_centimes_update AFTER UPDATE OF solde_centimes ON clients
+        WHEN NEW.solde_actuel IS NOT NEW.solde_centimes / 100.0
+        BEGIN
+            UPDATE clients SET solde_actuel = NEW.solde_centimes / 100.0 WHERE id = NEW.id;
+        END
+    """)
+
+
+def daily_sales_sql(row, sign="+", date=None):
+    """Instructions de trigger qui ajoutent (sign '+') ou retirent ('-') la vente
+    row (NEW ou OLD) du cumul de son jour dans ventes_journalieres.
+    
+    Jour et montant sont recalculés depuis les colonnes de base: les colonnes
+    générées peuvent ne pas être encore remplies (triggers de repli)."""
+    date = date or f"{row}.date_transaction"
+    jour = f"CAST(strftime('%Y%m%d', {date}) AS INTEGER)"
+    montant = centimes_expression(f"{row}.montant_total")
+    sql = (f"INSERT INTO ventes_journalieres (station_id, carburant_id, jour, nb, litres, montant_centimes) "
+           f"SELECT {row}.station_id, {row}.carburant_id, {jour}, {sign}1, {sign}{row}.quantite, {sign}{montant} "
+           f"WHERE {jour} IS NOT NULL "
+           f"ON CONFLICT (jour, station_id, carburant_id) DO UPDATE SET nb = nb + excluded.nb, "
+           f"litres = litres + excluded.litres, montant_centimes = montant_centimes + excluded.montant_centimes;")
+    if sign == "-":
+        # Un jour sans vente restante disparaît du cumul
+        sql += (f" DELETE FROM ventes_journalieres WHERE jour = {jour} AND station_id = {row}.station_id "
+                f"AND carburant_id = {row}.carburant_id AND nb <= 0;")
+    return sql
+
+
+def rebuild_daily_sales(cursor, first=None, last=None, source="transactions"):
+    """Recalculer ventes_journalieres depuis source (transactions, ou la vue
+    historique_transactions pour inclure les exercices archivés), pour les
+    jours [first, last[ (clés aaaammjj) ou pour toute la table"""
+    condition, params = "jour IS NOT NULL", []
+    if first is not None:
+        condition += " AND jour >= ?"
+        params.append(first)
+    if last is not None:
+        condition += " AND jour < ?"
+        params.append(last)
+    cursor.execute(f"DELETE FROM ventes_journalieres WHERE {condition}", params)
+    cursor.execute(f"""
+        INSERT INTO ventes_journalieres (station_id, carburant_id, jour, nb, litres, montant_centimes)
+        SELECT station_id, carburant_id, jour, COUNT(*), SUM(quantite), SUM(montant_centimes)
+        FROM {source}
+        WHERE {condition}
+        GROUP BY jour, station_id, carburant_id
+    """, params)
+
+
+def rebuild_all_daily_sales(cursor, history_table):
+    """Reprise de la migration 8: cumuls de toutes les ventes, réparties et archivées"""
+    rebuild_daily_sales(cursor, source=history_table("transactions"))
+
+
+@migration(8, "Cumuls journaliers des ventes tenus à jour par triggers", after_attach=rebuild_all_daily_sales)
+def ventes_journalieres(cursor):
+    # Tableau de bord, graphiques et rapport de CA lisent quelques centaines de
+    # cumuls (jour, station, carburant) au lieu de toutes les transactions
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ventes_journalieres (
+            station_id INTEGER NOT NULL,
+            carburant_id INTEGER NOT NULL,
+            jour INTEGER NOT NULL,
+            nb INTEGER NOT NULL DEFAULT 0,
+            litres REAL NOT NULL DEFAULT 0,
+            montant_centimes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (jour, station_id, carburant_id)
+        ) WITHOUT ROWID
+    """)
+    
+    # Les déplacements internes (répartition par station, archivage) suspendent
+    # la capture: ce ne sont pas des ventes, le cumul n'est pas modifié
+    suspended = "WHEN NOT EXISTS (SELECT 1 FROM capture_suspendue)"
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_ventes_insert AFTER INSERT ON transactions
+        {suspended}
+        BEGIN
+            {daily_sales_sql("NEW")}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_ventes_update
+        AFTER UPDATE OF station_id, carburant_id, date_transaction, quantite, montant_total ON transactions
+        {suspended}
+        BEGIN
+            {daily_sales_sql("OLD", "-")}
+            {daily_sales_sql("NEW")}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_ventes_delete AFTER DELETE ON transactions
+        {suspended}
+        BEGIN
+            {daily_sales_sql("OLD", "-")}
+        END
+    """)
+    rebuild_daily_sales(cursor)
+
+
+@migration(9, "Journal des mouvements de compte client et soldes de référence")
+def mouvements_compte(cursor):
+    # Chaque variation du solde d'un client (vente à crédit, paiement, annulation,
+    # correction) est une ligne datée: montant positif au crédit, négatif au débit
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mouvements_compte (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            date_mouvement TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            montant_centimes INTEGER NOT NULL,
+            type_mouvement TEXT NOT NULL,
+            source_table TEXT,
+            source_id INTEGER,
+            libelle TEXT,
+            FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE
+        )
+    """)
+    # Somme d'une période d'un client lue dans l'index seul
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_mouvements_client_date
+        ON mouvements_compte (client_id, date_mouvement, montant_centimes)
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_mouvements_source ON mouvements_compte (source_table, source_id)")
+    
+    # Solde de chaque client au début d'un jour (mouvements antérieurs à date_point):
+    # un solde à date part du point précédent au lieu de tout l'historique
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS soldes_clients_points (
+            client_id INTEGER NOT NULL,
+            date_point TEXT NOT NULL,
+            solde_centimes INTEGER NOT NULL,
+            PRIMARY KEY (client_id, date_point),
+            FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+    
+    # Un mouvement antidaté (ou retiré) rend faux les points postérieurs
+    for operation, row in (("INSERT", "NEW"), ("DELETE", "OLD")):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_mouvements_compte_points_{operation.lower()}
+            AFTER {operation} ON mouvements_compte
+            BEGIN
+                DELETE FROM soldes_clients_points
+                WHERE client_id = {row}.client_id AND date_point > {row}.date_mouvement;
+            END
+        """)
+    # Un mouvement modifié peut changer de date ou de client: les points des deux
+    # clients sont faux à partir de la plus ancienne des deux dates
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_mouvements_compte_points_update
+        AFTER UPDATE ON mouvements_compte
+        BEGIN
+            DELETE FROM soldes_clients_points
+            WHERE client_id IN (OLD.client_id, NEW.client_id)
+              AND date_point > MIN(OLD.date_mouvement, NEW.date_mouvement);
+        END
+    """)
+    
+    # Solde initial d'un nouveau client et écritures directes de solde_actuel
+    # (ancien code, import): le mouvement est déduit de la valeur synchronisée
+    synced = centimes_expression("COALESCE(NEW.solde_actuel, 0)")
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_mouvement_ouverture AFTER INSERT ON clients
+        WHEN {synced} != 0
+        BEGIN
+            INSERT INTO mouvements_compte (client_id, date_mouvement, montant_centimes, type_mouvement, libelle)
+            VALUES (NEW.id, COALESCE(NEW.date_creation, CURRENT_TIMESTAMP), {synced}, 'ouverture', 'Solde initial');
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_mouvement_ajustement AFTER UPDATE OF solde_actuel ON clients
+        WHEN NEW.solde_centimes IS NOT {synced}
+        BEGIN
+            INSERT INTO mouvements_compte (client_id, montant_centimes, type_mouvement, libelle)
+            VALUES (NEW.id, {synced} - OLD.solde_centimes, 'ajustement', 'Modification directe du solde');
+        END
+    """)
+    
+    # Historique reconstitué: ventes à crédit et paiements actifs connus, puis
+    # un mouvement d'ouverture (à la création du client) pour l'écart avec le
+    # solde actuel (ventes archivées ou réparties par station, saisies manuelles)
+    cursor.execute("""
+        INSERT INTO mouvements_compte (client_id, date_mouvement, montant_centimes, type_mouvement, source_table, source_id)
+        SELECT client_id, COALESCE(date_transaction, CURRENT_TIMESTAMP), -montant_centimes, 'vente', 'transactions', id
+        FROM transactions
+        WHERE type_paiement = 'credit'
+    """)
+    cursor.execute("""
+        INSERT INTO mouvements_compte (client_id, date_mouvement, montant_centimes, type_mouvement, source_table, source_id)
+        SELECT client_id, COALESCE(date_paiement, CURRENT_TIMESTAMP), montant_centimes, 'paiement', 'paiements_avance', id
+        FROM paiements_avance
+        WHERE statut = 'actif'
+    """)
+    cursor.execute("""
+        INSERT INTO mouvements_compte (client_id, date_mouvement, montant_centimes, type_mouvement, libelle)
+        SELECT c.id, COALESCE(c.date_creation, CURRENT_TIMESTAMP),
+               c.solde_centimes - COALESCE((SELECT SUM(m.montant_centimes) FROM mouvements_compte m
+                                            WHERE m.client_id = c.id), 0),
+               'ouverture', 'Solde à la mise en place du journal'
+        FROM clients c
+        WHERE c.solde_centimes != COALESCE((SELECT SUM(m.montant_centimes) FROM mouvements_compte m
+                                            WHERE m.client_id = c.id), 0)
+    """)
+
+
+def client_search_sql(client_id=None):
+    """Instruction qui (ré)indexe le client client_id (expression: NEW.id,
+    OLD.client_id...), ou tous les clients, dans recherche_clients: noms,
+    entreprise, téléphone et plaques de ses véhicules, aussi sans espaces ni tirets"""
+    def compact(column):
+        return f"replace(replace({column}, ' ', ''), '-', '')"
+    plates = (f"SELECT group_concat(v.matricule || ' ' || {compact('v.matricule')} || ' ' "
+              f"|| COALESCE(v.immatriculation, ''), ' ') FROM vehicules v WHERE v.client_id = c.id")
+    return (f"INSERT OR REPLACE INTO recherche_clients (rowid, nom, prenom, entreprise, telephone, plaques) "
+            f"SELECT c.id, c.nom, c.prenom, c.entreprise, {compact('c.telephone')}, ({plates}) "
+            f"FROM clients c{f' WHERE c.id = {client_id}' if client_id else ''};")
+
+
+@migration(10, "Index plein texte (trigrammes) des clients pour l'autocomplétion")
+def recherche_clients(cursor):
+    # Recherche de sous-chaîne '%terme%' par trigrammes: l'index FTS5 trouve
+    # les clients sans parcourir la table. Sans FTS5 ou sans le tokenizer
+    # trigram (SQLite < 3.34), search_clients revient à LIKE.
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS recherche_clients
+            USING fts5(nom, prenom, entreprise, telephone, plaques, tokenize = 'trigram')
+        """)
+    except sqlite3.OperationalError:
+        return
+    
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_recherche_insert AFTER INSERT ON clients
+        BEGIN
+            {client_search_sql("NEW.id")}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_recherche_update
+        AFTER UPDATE OF nom, prenom, entreprise, telephone ON clients
+        BEGIN
+            {client_search_sql("NEW.id")}
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_clients_recherche_delete AFTER DELETE ON clients
+        BEGIN
+            DELETE FROM recherche_clients WHERE rowid = OLD.id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_vehicules_recherche_insert AFTER INSERT ON vehicules
+        BEGIN
+            {client_search_sql("NEW.client_id")}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_vehicules_recherche_update
+        AFTER UPDATE OF client_id, matricule, immatriculation ON vehicules
+        BEGIN
+            {client_search_sql("OLD.client_id")}
+            {client_search_sql("NEW.client_id")}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_vehicules_recherche_delete AFTER DELETE ON vehicules
+        BEGIN
+            {client_search_sql("OLD.client_id")}
+        END
+    """)
+    cursor.execute(client_search_sql())
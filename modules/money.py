@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Montants en centimes entiers
+Les montants sont additionnés en centimes (int) et convertis en DH seulement
+pour l'affichage ou l'écriture dans les colonnes REAL: une somme de centaines
+de milliers de ventes reste exacte, sans erreur d'arrondi des flottants ni
+relecture de montants déjà formatés.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+TVA_TAUX = 20  # Pourcentage de TVA des factures
+
+
+def to_centimes(amount):
+    """Montant en DH (float, Decimal, texte '1 234,56 DH' ou None) -> centimes
+    (arrondi au centime le plus proche, demi vers le haut)"""
+    if amount is None or amount == "":
+        return 0
+    if isinstance(amount, int):
+        return amount * 100
+    if isinstance(amount, str):
+        amount = amount.replace("DH", "").replace(" ", "").replace("\xa0", "").replace(",", ".")
+    # str() d'un float donne sa représentation la plus courte (0.29 et non 0.28999...)
+    value = Decimal(str(amount)) * 100
+    return int(value.quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def from_centimes(centimes):
+    """Centimes -> DH (float), pour les colonnes REAL et les calculs d'affichage"""
+    return (centimes or 0) / 100
+
+
+def format_centimes(centimes, suffix=" DH"):
+    """Centimes -> texte '1234.56 DH' sans passer par un flottant"""
+    centimes = centimes or 0
+    sign = "-" if centimes < 0 else ""
+    whole, cents = divmod(abs(centimes), 100)
+    return f"{sign}{whole}.{cents:02d}{suffix}"
+
+
+def tva_centimes(montant_ht_centimes, taux=TVA_TAUX):
+    """TVA en centimes d'un montant HT en centimes (arrondi demi vers le haut)"""
+    return (montant_ht_centimes * taux + 50) // 100
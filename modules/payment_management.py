@@ -7,6 +7,8 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime, date
 
+from .money import format_centimes, from_centimes, to_centimes
+
 class PaymentManagement:
     def __init__(self, parent, db_manager):
         self.parent = parent
@@ -215,24 +217,13 @@ class PaymentManagement:
     
     def on_client_search(self, event):
         """Filtrer les clients en temps réel"""
-        search_term = self.client_combo.get().lower()
-        if len(search_term) < 2:
+        search_term = self.client_combo.get()
+        if len(search_term.strip()) < 2:
             return
         
         try:
-            query = """
-                SELECT c.id, c.nom, c.prenom, c.entreprise, c.type_client, c.solde_actuel
-                FROM clients c 
-                WHERE c.statut = 'actif' AND (
-                    LOWER(c.nom) LIKE ? OR 
-                    LOWER(c.prenom) LIKE ? OR 
-                    LOWER(c.entreprise) LIKE ?
-                )
-                ORDER BY c.nom, c.prenom
-                LIMIT 10
-            """
-            search_pattern = f"%{search_term}%"
-            clients = self.db_manager.execute_query(query, (search_pattern, search_pattern, search_pattern), use_cache=True, cache_timeout=30, table="clients")
+            # Index plein texte: nom, prénom, entreprise, téléphone ou plaque
+            clients = self.db_manager.search_clients(search_term, limit=10, active_only=True)
             
             client_list = []
             for client in clients:
@@ -279,6 +270,8 @@ class PaymentManagement:
             except ValueError:
                 messagebox.showerror("Erreur", "Montant invalide")
                 return
+            montant_centimes = to_centimes(montant)
+            montant = from_centimes(montant_centimes)
             
             # Insertion du paiement
             query = """
@@ -295,17 +288,14 @@ class PaymentManagement:
                 self.payment_vars['notes'].get().strip() or None
             )
             
-            # Utiliser le paramètre table pour invalider automatiquement le cache
-            payment_id = self.db_manager.execute_insert(query, params, table='paiements_avance')
-            
-            # Mise à jour du solde client (ajouter le montant)
-            update_query = """
-                UPDATE clients 
-                SET solde_actuel = solde_actuel + ? 
-                WHERE id = ?
-            """
-            # Utiliser le paramètre table pour invalider automatiquement le cache
-            self.db_manager.execute_update(update_query, (montant, client_id), table='clients')
+            # Paiement et mise à jour du solde dans un seul commit atomique
+            with self.db_manager.transaction():
+                # Utiliser le paramètre table pour invalider automatiquement le cache
+                payment_id = self.db_manager.execute_insert(query, params, table='paiements_avance')
+                
+                # Mise à jour du solde client (ajouter le montant)
+                self.db_manager.adjust_client_balance(client_id, montant_centimes, "paiement",
+                                                      "paiements_avance", payment_id)
             
             messagebox.showinfo("Succès", f"Paiement d'avance enregistré avec succès (ID: {payment_id})")
             
@@ -340,11 +330,11 @@ class PaymentManagement:
             
             # Filtre période
             if period == "aujourd_hui":
-                where_conditions.append("DATE(p.date_paiement) = DATE('now')")
+                where_conditions.append("p.jour = CAST(strftime('%Y%m%d', 'now') AS INTEGER)")
             elif period == "cette_semaine":
-                where_conditions.append("DATE(p.date_paiement) >= DATE('now', '-7 days')")
+                where_conditions.append("p.jour >= CAST(strftime('%Y%m%d', 'now', '-7 days') AS INTEGER)")
             elif period == "ce_mois":
-                where_conditions.append("DATE(p.date_paiement) >= DATE('now', 'start of month')")
+                where_conditions.append("p.jour >= CAST(strftime('%Y%m%d', 'now', 'start of month') AS INTEGER)")
             
             # Filtre statut
             if status != "tous":
@@ -362,7 +352,8 @@ class PaymentManagement:
                         THEN c.entreprise 
                         ELSE c.nom || ' ' || COALESCE(c.prenom, '')
                     END as client,
-                    p.montant, p.mode_paiement, p.reference_paiement, p.statut, p.notes
+                    p.montant, p.mode_paiement, p.reference_paiement, p.statut, p.notes,
+                    p.montant_centimes
                 FROM paiements_avance p
                 JOIN clients c ON p.client_id = c.id
                 {where_clause}
@@ -384,7 +375,7 @@ class PaymentManagement:
                     payment[0],  # ID
                     date_str,    # Date
                     payment[2],  # Client
-                    f"{payment[3]:.2f} DH",  # Montant
+                    format_centimes(payment[8]),  # Montant
                     payment[4],  # Mode
                     payment[5] or '-',  # Référence
                     payment[6],  # Statut
@@ -393,17 +384,17 @@ class PaymentManagement:
                 
                 self.payments_tree.insert('', 'end', values=values)
                 
-                # Calculs pour le résumé
-                total_montant += payment[3]
+                # Calculs pour le résumé, en centimes entiers (exacts)
+                total_montant += payment[8]
                 if payment[6] == 'actif':
-                    actif_montant += payment[3]
+                    actif_montant += payment[8]
             
             # Mise à jour du résumé
             self.summary_labels['total_paiements'].config(
-                text=f"Total Paiements: {total_montant:.2f} DH"
+                text=f"Total Paiements: {format_centimes(total_montant)}"
             )
             self.summary_labels['paiements_actifs'].config(
-                text=f"Paiements Actifs: {actif_montant:.2f} DH"
+                text=f"Paiements Actifs: {format_centimes(actif_montant)}"
             )
             self.summary_labels['nombre_paiements'].config(
                 text=f"Nombre: {nombre_paiements}"
@@ -436,33 +427,31 @@ class PaymentManagement:
                 item = selection[0]
                 payment_id = self.payments_tree.item(item)['values'][0]
                 
-                # Récupérer les détails du paiement pour ajuster le solde
-                query = """
-                    SELECT client_id, montant, statut
-                    FROM paiements_avance 
-                    WHERE id = ?
-                """
-                # Ne pas utiliser le cache pour cette vérification critique
-                result = self.db_manager.execute_query(query, (payment_id,), use_cache=False)
-                
-                if result:
-                    client_id, montant, statut = result[0]
-                    
-                    # Supprimer le paiement
-                    delete_query = "DELETE FROM paiements_avance WHERE id = ?"
-                    # Utiliser le paramètre table pour invalider automatiquement le cache
-                    self.db_manager.execute_update(delete_query, (payment_id,), table='paiements_avance')
+                # Lecture, suppression et ajustement du solde dans une seule transaction
+                with self.db_manager.transaction():
+                    # Récupérer les détails du paiement pour ajuster le solde
+                    query = """
+                        SELECT client_id, montant_centimes, statut
+                        FROM paiements_avance 
+                        WHERE id = ?
+                    """
+                    result = self.db_manager.execute_query(query, (payment_id,))
                     
-                    # Ajuster le solde client si le paiement était actif
-                    if statut == 'actif':
-                        update_query = """
-                            UPDATE clients 
-                            SET solde_actuel = solde_actuel - ? 
-                            WHERE id = ?
-                        """
+                    if result:
+                        client_id, montant_centimes, statut = result[0]
+                        
+                        # Supprimer le paiement
+                        delete_query = "DELETE FROM paiements_avance WHERE id = ?"
                         # Utiliser le paramètre table pour invalider automatiquement le cache
-                        self.db_manager.execute_update(update_query, (montant, client_id), table='clients')
-                    
+                        self.db_manager.execute_update(delete_query, (payment_id,), table='paiements_avance')
+                        
+                        # Ajuster le solde client si le paiement était actif
+                        if statut == 'actif':
+                            self.db_manager.adjust_client_balance(client_id, -montant_centimes, "annulation",
+                                                                  "paiements_avance", payment_id,
+                                                                  "Suppression du paiement")
+                
+                if result:
                     messagebox.showinfo("Succès", "Paiement supprimé avec succès")
                     self.load_payments()
                     self.load_clients()  # Recharger pour mettre à jour les soldes
@@ -536,18 +525,20 @@ class EditPaymentDialog:
     def load_payment_data(self):
         """Charger les données du paiement"""
         try:
-            query = "SELECT * FROM paiements_avance WHERE id = ?"
+            query = """
+                SELECT montant, mode_paiement, reference_paiement, statut, notes
+                FROM paiements_avance WHERE id = ?
+            """
             # Utiliser le cache pour les données qui ne changent pas fréquemment
             result = self.db_manager.execute_query(query, (self.payment_id,), use_cache=True, cache_timeout=60)
             
             if result:
-                data = result[0]
-                # Mapping des champs
-                self.edit_vars['montant'].set(str(data[2]) if data[2] else '')
-                self.edit_vars['mode_paiement'].set(str(data[3]) if data[3] else 'especes')
-                self.edit_vars['reference_paiement'].set(str(data[5]) if data[5] else '')
-                self.edit_vars['statut'].set(str(data[7]) if data[7] else 'actif')
-                self.edit_vars['notes'].set(str(data[6]) if data[6] else '')
+                montant, mode_paiement, reference, statut, notes = result[0]
+                self.edit_vars['montant'].set(str(montant) if montant else '')
+                self.edit_vars['mode_paiement'].set(str(mode_paiement) if mode_paiement else 'especes')
+                self.edit_vars['reference_paiement'].set(str(reference) if reference else '')
+                self.edit_vars['statut'].set(str(statut) if statut else 'actif')
+                self.edit_vars['notes'].set(str(notes) if notes else '')
                 
         except Exception as e:
             messagebox.showerror("Erreur", f"Erreur lors du chargement: {str(e)}")
@@ -564,16 +555,8 @@ class EditPaymentDialog:
             except ValueError:
                 messagebox.showerror("Erreur", "Montant invalide")
                 return
-            
-            # Récupérer l'ancien montant et statut pour ajuster le solde
-            old_query = """
-                SELECT client_id, montant, statut 
-                FROM paiements_avance 
-                WHERE id = ?
-            """
-            # Ne pas utiliser le cache pour cette vérification critique
-            old_data = self.db_manager.execute_query(old_query, (self.payment_id,), use_cache=False)[0]
-            client_id, old_montant, old_statut = old_data
+            montant_centimes = to_centimes(montant)
+            montant = from_centimes(montant_centimes)
             
             # Mise à jour du paiement
             update_query = """
@@ -592,24 +575,35 @@ class EditPaymentDialog:
                 self.payment_id
             )
             
-            # Utiliser le paramètre table pour invalider automatiquement le cache
-            self.db_manager.execute_update(update_query, params, table='paiements_avance')
-            
-            # Ajuster le solde client si nécessaire
             new_statut = self.edit_vars['statut'].get()
             
-            if old_statut != new_statut or (old_statut == 'actif' and montant != old_montant):
-                # Remettre l'ancien solde si c'était actif
-                if old_statut == 'actif':
-                    adjust_query = "UPDATE clients SET solde_actuel = solde_actuel - ? WHERE id = ?"
-                    # Utiliser le paramètre table pour invalider automatiquement le cache
-                    self.db_manager.execute_update(adjust_query, (old_montant, client_id), table='clients')
+            # Modification et ajustements de solde dans un seul commit atomique
+            with self.db_manager.transaction():
+                # Récupérer l'ancien montant et statut pour ajuster le solde
+                old_query = """
+                    SELECT client_id, montant_centimes, statut 
+                    FROM paiements_avance 
+                    WHERE id = ?
+                """
+                old_data = self.db_manager.execute_query(old_query, (self.payment_id,))[0]
+                client_id, old_montant_centimes, old_statut = old_data
                 
-                # Appliquer le nouveau solde si c'est maintenant actif
-                if new_statut == 'actif':
-                    adjust_query = "UPDATE clients SET solde_actuel = solde_actuel + ? WHERE id = ?"
-                    # Utiliser le paramètre table pour invalider automatiquement le cache
-                    self.db_manager.execute_update(adjust_query, (montant, client_id), table='clients')
+                # Utiliser le paramètre table pour invalider automatiquement le cache
+                self.db_manager.execute_update(update_query, params, table='paiements_avance')
+                
+                # Ajuster le solde client si nécessaire
+                if old_statut != new_statut or (old_statut == 'actif' and montant_centimes != old_montant_centimes):
+                    # Remettre l'ancien solde si c'était actif
+                    if old_statut == 'actif':
+                        self.db_manager.adjust_client_balance(client_id, -old_montant_centimes, "correction",
+                                                              "paiements_avance", self.payment_id,
+                                                              "Modification du paiement (ancien montant)")
+                    
+                    # Appliquer le nouveau solde si c'est maintenant actif
+                    if new_statut == 'actif':
+                        self.db_manager.adjust_client_balance(client_id, montant_centimes, "correction",
+                                                              "paiements_avance", self.payment_id,
+                                                              "Modification du paiement (nouveau montant)")
             
             messagebox.showinfo("Succès", "Paiement modifié avec succès")
             self.callback()
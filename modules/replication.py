@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Réplication incrémentale des stations vers le siège
+Les triggers de capture (migration 5) inscrivent chaque modification des
+tables répliquées dans journal_modifications, avec un numéro de séquence
+croissant. Le réplicateur de la station en expédie des lots vers la base
+centrale, soit directement (fichier SQLite), soit par dépôt de fichiers JSON
+dans un répertoire; la base centrale les applique de façon idempotente grâce
+à la dernière séquence appliquée pour chaque source.
+
+Au siège, un répertoire de dépôt s'applique avec:
+    python -m modules.replication base_centrale.db repertoire_depot
+"""
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+from .migrations import CAPTURED_TABLES
+
+_NAME_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class ReplicationGapError(Exception):
+    """Lot reçu alors que des modifications précédentes manquent"""
+
+
+class CentralStore:
+    """Base centrale du siège: une table par table répliquée, clé (source, id)"""
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=20, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS replication_sources (
+                source TEXT PRIMARY KEY,
+                dernier_seq INTEGER NOT NULL DEFAULT 0,
+                date_reception TIMESTAMP
+            )
+        """)
+        return conn
+    
+    def last_seq(self, source):
+        """Dernière séquence appliquée pour une source (0 si inconnue)"""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT dernier_seq FROM replication_sources WHERE source = ?",
+                               (source,)).fetchone()
+            return row[0] if row else 0
+        finally:
+            conn.close()
+    
+    def apply_batch(self, batch):
+        """Appliquer un lot dans une seule transaction; retourne le nombre de
+        modifications appliquées (celles déjà reçues sont ignorées)"""
+        source = batch["source"]
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT dernier_seq FROM replication_sources WHERE source = ?",
+                                   (source,)).fetchone()
+                last = row[0] if row else 0
+                if batch["depuis"] > last:
+                    raise ReplicationGapError(
+                        f"Modifications manquantes pour {source}: reçu depuis {batch['depuis']}, appliqué jusqu'à {last}")
+                
+                applied = 0
+                known_columns = {}
+                for change in batch["changes"]:
+                    if change["seq"] <= last:
+                        continue
+                    self._apply_change(conn, source, change, known_columns)
+                    last = change["seq"]
+                    applied += 1
+                
+                conn.execute("""
+                    INSERT INTO replication_sources (source, dernier_seq, date_reception)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (source) DO UPDATE SET
+                        dernier_seq = excluded.dernier_seq, date_reception = excluded.date_reception
+                """, (source, last))
+                conn.execute("COMMIT")
+                return applied
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+    
+    def _apply_change(self, conn, source, change, known_columns):
+        """Insérer, remplacer ou supprimer la ligne (source, id) d'une modification"""
+        table = change["table"]
+        if table not in CAPTURED_TABLES:
+            raise ValueError(f"Table non répliquée: {table}")
+        
+        if change["operation"] == "DELETE":
+            self._ensure_table(conn, table, (), known_columns)
+            conn.execute(f"DELETE FROM {table} WHERE source = ? AND id = ?", (source, change["id"]))
+            return
+        
+        data = dict(change["data"])
+        data.pop("id", None)
+        columns = [column for column in data if _NAME_RE.match(column)]
+        self._ensure_table(conn, table, columns, known_columns)
+        
+        names = ", ".join(["source", "id"] + columns)
+        placeholders = ", ".join("?" for _ in range(len(columns) + 2))
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in columns) or "id = excluded.id"
+        conn.execute(f"""
+            INSERT INTO {table} ({names}) VALUES ({placeholders})
+            ON CONFLICT (source, id) DO UPDATE SET {assignments}
+        """, [source, change["id"]] + [data[column] for column in columns])
+    
+    @staticmethod
+    def _ensure_table(conn, table, columns, known_columns):
+        """Créer la table consolidée et ajouter les colonnes encore inconnues"""
+        existing = known_columns.get(table)
+        if existing is None:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    source TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    PRIMARY KEY (source, id)
+                )
+            """)
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            known_columns[table] = existing
+        for column in columns:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+                existing.add(column)
+    
+    def apply_directory(self, directory):
+        """Appliquer les lots déposés dans un répertoire, dans l'ordre des séquences.
+        
+        Les fichiers appliqués sont rangés dans le sous-répertoire 'appliques';
+        un lot dont les prédécesseurs manquent reste en attente."""
+        done_dir = os.path.join(directory, "appliques")
+        os.makedirs(done_dir, exist_ok=True)
+        applied = 0
+        blocked = set()
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, encoding="utf-8") as f:
+                batch = json.load(f)
+            if batch["source"] in blocked:
+                continue
+            try:
+                applied += self.apply_batch(batch)
+            except ReplicationGapError:
+                blocked.add(batch["source"])
+                continue
+            os.replace(path, os.path.join(done_dir, name))
+        return applied
+
+
+class Replicator:
+    """Expédition du journal des modifications d'une station vers le siège.
+    
+    target est soit le fichier de la base centrale (application directe), soit
+    un répertoire de dépôt où chaque lot est écrit dans un fichier JSON."""
+    
+    def __init__(self, db_manager, source, target, batch_size=500, interval=5.0):
+        self.db_manager = db_manager
+        self.source = source  # Identifiant de la station dans la base centrale
+        self.target = target
+        self.batch_size = batch_size
+        self.interval = interval
+        self.central = None if os.path.isdir(target) else CentralStore(target)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.metrics = {"changes": 0, "batches": 0, "errors": 0, "last_error": None, "last_ship": None}
+        
+        # Inscrire la destination: la purge du journal attend qu'elle ait tout reçu
+        self.db_manager.execute_update(
+            "INSERT OR IGNORE INTO replication_position (cible, dernier_seq) VALUES (?, 0)",
+            (self.target,), table="replication_position")
+    
+    def position(self):
+        """Dernière séquence expédiée vers la destination"""
+        result = self.db_manager.execute_query(
+            "SELECT dernier_seq FROM replication_position WHERE cible = ?", (self.target,), use_cache=False)
+        return result[0][0] if result else 0
+    
+    def pending(self):
+        """Nombre de modifications pas encore expédiées"""
+        return self.db_manager.execute_query(
+            "SELECT COUNT(*) FROM journal_modifications WHERE seq > ?", (self.position(),), use_cache=False)[0][0]
+    
+    def ship(self):
+        """Expédier toutes les modifications en attente, lot par lot; retourne leur nombre"""
+        shipped = 0
+        with self.lock:
+            position = self.position()
+            if self.central is not None:
+                # Reprendre où le siège en est (envoi interrompu après application)
+                position = max(position, self.central.last_seq(self.source))
+            while True:
+                rows = self.db_manager.execute_query("""
+                    SELECT seq, nom_table, operation, ligne_id, donnees
+                    FROM journal_modifications
+                    WHERE seq > ?
+                    ORDER BY seq
+                    LIMIT ?
+                """, (position, self.batch_size), use_cache=False)
+                if not rows:
+                    break
+                
+                batch = {
+                    "source": self.source,
+                    "depuis": position,
+                    "changes": [{"seq": seq, "table": table, "operation": operation, "id": row_id,
+                                 "data": json.loads(data) if data else None}
+                                for seq, table, operation, row_id, data in rows]
+                }
+                self._send(batch)
+                position = rows[-1][0]
+                self.db_manager.execute_update("""
+                    INSERT INTO replication_position (cible, dernier_seq, date_envoi)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (cible) DO UPDATE SET
+                        dernier_seq = excluded.dernier_seq, date_envoi = excluded.date_envoi
+                """, (self.target, position), table="replication_position")
+                shipped += len(rows)
+                self.metrics["batches"] += 1
+        
+        self.metrics["changes"] += shipped
+        self.metrics["last_ship"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return shipped
+    
+    def _send(self, batch):
+        """Appliquer le lot dans la base centrale, ou le déposer (écriture atomique)"""
+        if self.central is not None:
+            self.central.apply_batch(batch)
+            return
+        first, last = batch["changes"][0]["seq"], batch["changes"][-1]["seq"]
+        name = f"{self.source}_{first:012d}_{last:012d}.json"
+        temp_path = os.path.join(self.target, name + ".tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(batch, f, ensure_ascii=False)
+        os.replace(temp_path, os.path.join(self.target, name))
+    
+    def purge(self):
+        """Supprimer du journal les modifications expédiées vers toutes les destinations"""
+        return self.db_manager.execute_update("""
+            DELETE FROM journal_modifications
+            WHERE seq <= (SELECT COALESCE(MIN(dernier_seq), 0) FROM replication_position)
+        """, (), table="journal_modifications")
+    
+    # ------------------------------------------------------------------
+    # Expédition en continu sur un thread de fond
+    # ------------------------------------------------------------------
+    def start(self):
+        """Expédier en continu toutes les interval secondes"""
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="replication", daemon=True)
+            self.thread.start()
+    
+    def stop(self):
+        """Arrêter l'expédition continue (le lot en cours est terminé)"""
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+    
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                if self.ship():
+                    self.purge()
+            except Exception as e:
+                # Siège injoignable: les modifications restent dans le journal
+                self.metrics["errors"] += 1
+                self.metrics["last_error"] = str(e)
+                self.db_manager._log_error(f"Erreur de réplication vers {self.target}: {str(e)}")
+            self.stop_event.wait(self.interval)
+    
+    def get_metrics(self):
+        """Métriques d'expédition et retard (modifications en attente)"""
+        metrics = dict(self.metrics)
+        metrics["pending"] = self.pending()
+        return metrics
+
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: python -m modules.replication base_centrale.db repertoire_depot")
+        return 1
+    applied = CentralStore(sys.argv[1]).apply_directory(sys.argv[2])
+    print(f"{applied} modification(s) appliquée(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
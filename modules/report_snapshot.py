@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Instantané en lecture seule de la base pour les rapports lourds
+La base est copiée avec l'API de sauvegarde SQLite (par paquets de pages)
+dans une base en mémoire, ou dans un fichier temporaire si elle est trop
+volumineuse; les rapports y lisent une copie cohérente sans concurrencer
+les ventes en cours pour les entrées/sorties et les verrous.
+Avec la répartition par station, chaque fichier de station est copié de même
+puis attaché à la copie de la base de référence; les archives des exercices
+clos, qui ne changent plus, sont attachées sans copie.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+
+class ReportSnapshot:
+    """Copie cohérente de la base, rafraîchie à la demande ou quand
+    PRAGMA data_version signale une écriture d'une autre connexion"""
+    
+    def __init__(self, db_manager, pages=1024, sleep=0.005, min_interval=300,
+                 max_memory_bytes=512 * 1024 * 1024):
+        self.db_manager = db_manager
+        self.pages = pages  # Pages copiées par étape de sauvegarde
+        self.sleep = sleep  # Pause entre deux étapes (laisse passer les ventes)
+        self.min_interval = min_interval  # Délai minimal entre deux rafraîchissements automatiques
+        self.max_memory_bytes = max_memory_bytes
+        self.lock = threading.RLock()
+        self.source = None  # Connexion dédiée: data_version est propre à chaque connexion
+        self.shard_sources = {}  # station_id -> connexion dédiée au fichier de la station
+        self.conn = None
+        self.temp_path = None
+        self.shard_copies = []  # (connexion, fichier temporaire) des copies des stations
+        self.data_version = None
+        self.refreshed_at = None
+        self.metrics = {"refreshes": 0, "last_refresh_time": 0.0, "queries": 0}
+    
+    def _open_source(self):
+        """Ouvrir la connexion source en lecture seule"""
+        if self.source is None:
+            self.source = sqlite3.connect(self.db_manager.db_path, timeout=20, isolation_level=None,
+                                          check_same_thread=False)
+            self.source.execute("PRAGMA query_only = ON")
+        return self.source
+    
+    def _open_shard_source(self, station_id):
+        """Ouvrir en lecture seule le fichier d'une station"""
+        source = self.shard_sources.get(station_id)
+        if source is None:
+            source = sqlite3.connect(self.db_manager.shards.shard_path(station_id), timeout=20,
+                                     isolation_level=None, check_same_thread=False)
+            source.execute("PRAGMA query_only = ON")
+            self.shard_sources[station_id] = source
+        return source
+    
+    def _station_ids(self):
+        """Stations dont les ventes sont dans des fichiers séparés"""
+        shards = self.db_manager.shards
+        return list(shards.station_ids) if shards is not None else []
+    
+    def _current_version(self):
+        """Valeurs de PRAGMA data_version vues par les connexions sources"""
+        versions = [self._open_source().execute("PRAGMA data_version").fetchone()[0]]
+        for station_id in self._station_ids():
+            versions.append(self._open_shard_source(station_id).execute("PRAGMA data_version").fetchone()[0])
+        return tuple(versions)
+    
+    def is_stale(self):
+        """L'instantané manque-t-il des écritures validées depuis sa copie?"""
+        with self.lock:
+            return self.conn is None or self._current_version() != self.data_version
+    
+    def refresh(self, force=True):
+        """Recopier la base; sans force, seulement si elle a changé et que
+        l'instantané a plus de min_interval secondes"""
+        with self.lock:
+            if not force and self.conn is not None:
+                if time.time() - self.refreshed_at < self.min_interval or not self.is_stale():
+                    return False
+            
+            start = time.time()
+            version = self._current_version()
+            target, path, _ = self._open_target(self.db_manager.db_path, "rapport")
+            shard_copies = []
+            try:
+                self._copy(self._open_source(), target)
+                
+                copies = {}
+                for station_id in self._station_ids():
+                    copy, copy_path, name = self._open_target(self.db_manager.shards.shard_path(station_id),
+                                                              f"rapport_station_{station_id}")
+                    shard_copies.append((copy, copy_path))
+                    self._copy(self._open_shard_source(station_id), copy)
+                    copies[station_id] = name
+                if copies:
+                    self.db_manager.shards.attach(target, paths=copies)
+                if self.db_manager.archives is not None:
+                    # Archives figées: attachées telles quelles, sans copie
+                    self.db_manager.archives.attach(target)
+            except sqlite3.Error as e:
+                for conn, conn_path in [(target, path)] + shard_copies:
+                    conn.close()
+                    self._remove_file(conn_path)
+                self.db_manager._log_error(f"Erreur lors de la copie de l'instantané des rapports: {str(e)}")
+                raise
+            
+            target.execute("PRAGMA query_only = ON")
+            self._close_target()
+            self.conn, self.temp_path = target, path
+            self.shard_copies = shard_copies
+            self.data_version = version
+            self.refreshed_at = time.time()
+            self.metrics["refreshes"] += 1
+            self.metrics["last_refresh_time"] = self.refreshed_at - start
+            return True
+    
+    def _copy(self, source, target):
+        """Copier une base par étapes de pages.
+        
+        Une transaction de lecture ouverte sur la source fige la version copiée:
+        la sauvegarde ne redémarre pas quand une vente est validée entre deux étapes"""
+        source.execute("BEGIN")
+        try:
+            source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            source.backup(target, pages=self.pages, sleep=self.sleep)
+        finally:
+            source.execute("COMMIT")
+    
+    def _open_target(self, source_path, prefix):
+        """Base de destination (connexion, fichier temporaire, nom pour ATTACH):
+        en mémoire, ou fichier temporaire pour une grosse base.
+        
+        La base en mémoire est nommée et partagée pour pouvoir être attachée
+        à la copie de la base de référence. Pas de transaction implicite: elle
+        garderait un verrou partagé sur les archives attachées."""
+        try:
+            size = os.path.getsize(source_path)
+        except OSError:
+            size = 0
+        if size <= self.max_memory_bytes:
+            uri = f"file:{prefix}_{id(self)}_{time.time_ns()}?mode=memory&cache=shared"
+            return sqlite3.connect(uri, uri=True, isolation_level=None, check_same_thread=False), None, uri
+        
+        handle, path = tempfile.mkstemp(prefix=f"{prefix}_", suffix=".db")
+        os.close(handle)
+        # Ouverte en URI pour pouvoir attacher les copies en mémoire des stations
+        return sqlite3.connect(f"file:{path}", uri=True, isolation_level=None, check_same_thread=False), path, path
+    
+    def _close_target(self):
+        """Fermer l'instantané courant (et supprimer ses fichiers temporaires)"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self._remove_file(self.temp_path)
+        self.temp_path = None
+        for conn, path in self.shard_copies:
+            conn.close()
+            self._remove_file(path)
+        self.shard_copies = []
+    
+    @staticmethod
+    def _remove_file(path):
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def query(self, query, params=None):
+        """Exécuter une lecture sur l'instantané (rafraîchi au besoin)"""
+        with self.lock:
+            if self.conn is None:
+                self.refresh()
+            else:
+                self.refresh(force=False)
+            self.metrics["queries"] += 1
+            cursor = self.conn.execute(query, params or ())
+            return cursor.fetchall()
+    
+    def snapshot_time(self):
+        """Heure de la dernière copie (texte), ou None"""
+        if self.refreshed_at is None:
+            return None
+        return datetime.fromtimestamp(self.refreshed_at).strftime("%d/%m/%Y %H:%M:%S")
+    
+    def close(self):
+        """Libérer l'instantané et la connexion source"""
+        with self.lock:
+            self._close_target()
+            if self.source is not None:
+                self.source.close()
+                self.source = None
+            for source in self.shard_sources.values():
+                source.close()
+            self.shard_sources.clear()
@@ -13,15 +13,35 @@ from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
 import os
 
+from .database import day_key
+from .db_async import TkAsyncBridge
+from .money import format_centimes
+
 class Reports:
     def __init__(self, parent, db_manager):
         self.parent = parent
         self.db_manager = db_manager
+        # Les rapports lourds s'exécutent hors du thread Tk
+        self.bridge = TkAsyncBridge.for_widget(parent, db_manager)
         self.setup_interface()
         self.load_dashboard_stats()
     
     def setup_interface(self):
         """Configuration de l'interface des rapports"""
+        # Mode instantané: les rapports lourds lisent une copie cohérente de la base
+        snapshot_frame = ttk.Frame(self.parent)
+        snapshot_frame.pack(fill='x', padx=10, pady=(10, 0))
+        
+        self.use_snapshot = tk.BooleanVar(value=True)
+        ttk.Checkbutton(snapshot_frame, text="Rapports sur instantané (ne ralentit pas les ventes)",
+                       variable=self.use_snapshot).pack(side='left')
+        
+        ttk.Button(snapshot_frame, text="Actualiser l'instantané",
+                  command=self.refresh_snapshot).pack(side='left', padx=10)
+        
+        self.snapshot_status = tk.StringVar(value="Instantané: pas encore copié")
+        ttk.Label(snapshot_frame, textvariable=self.snapshot_status).pack(side='left')
+        
         # Notebook pour les différents rapports
         self.notebook = ttk.Notebook(self.parent)
         self.notebook.pack(fill='both', expand=True, padx=10, pady=10)
@@ -344,44 +364,53 @@ class Reports:
         self.financial_text.pack(side='left', fill='both', expand=True)
         financial_scrollbar.pack(side='right', fill='y')
     
+    def refresh_snapshot(self):
+        """Recopier la base dans l'instantané des rapports (hors du thread Tk)"""
+        self.snapshot_status.set("Instantané: copie en cours...")
+        snapshot = self.db_manager.get_report_snapshot()
+        
+        async def refresh():
+            return await self.db_manager.arun(snapshot.refresh)
+        
+        self.bridge.submit(
+            refresh(),
+            callback=lambda _: self.update_snapshot_status(),
+            errback=lambda e: messagebox.showerror("Erreur", f"Erreur lors de la copie de l'instantané: {str(e)}"),
+            key='report_snapshot'
+        )
+    
+    def update_snapshot_status(self, _=None):
+        """Afficher l'heure de l'instantané utilisé par les rapports"""
+        snapshot = self.db_manager.report_snapshot
+        if snapshot is not None and snapshot.snapshot_time():
+            self.snapshot_status.set(f"Instantané du {snapshot.snapshot_time()}")
+    
     def load_dashboard_stats(self):
         """Charger les statistiques du tableau de bord"""
         try:
-            today = datetime.now().strftime('%Y-%m-%d')
-            first_day_month = datetime.now().strftime('%Y-%m-01')
-            
-            # Transactions aujourd'hui
-            query = "SELECT COUNT(*) FROM transactions WHERE DATE(date_transaction) = DATE(?)"
-            result = self.db_manager.execute_query(query, (today,), use_cache=True, cache_timeout=300, table="transactions")
-            self.stats_vars['transactions_jour'].set(str(result[0][0] if result else 0))
-            
-            # CA aujourd'hui
-            query = "SELECT COALESCE(SUM(montant_total), 0) FROM transactions WHERE DATE(date_transaction) = DATE(?)"
-            result = self.db_manager.execute_query(query, (today,), use_cache=True, cache_timeout=300, table="transactions")
-            ca_jour = result[0][0] if result else 0
-            self.stats_vars['ca_jour'].set(f"{ca_jour:.2f}")
+            today = date.today()
             
-            # Litres vendus aujourd'hui
-            query = "SELECT COALESCE(SUM(quantite), 0) FROM transactions WHERE DATE(date_transaction) = DATE(?)"
-            result = self.db_manager.execute_query(query, (today,), use_cache=True, cache_timeout=300, table="transactions")
-            litres_jour = result[0][0] if result else 0
-            self.stats_vars['litres_jour'].set(f"{litres_jour:.1f}")
+            # Nombre, CA et litres: une requête par période sur les cumuls
+            # journaliers (quelques lignes par jour); CA sommé en centimes entiers
+            query = """
+                SELECT COALESCE(SUM(nb), 0), COALESCE(SUM(montant_centimes), 0) / 100.0, COALESCE(SUM(litres), 0)
+                FROM ventes_journalieres WHERE jour >= ? AND jour < ?
+            """
             
-            # Transactions ce mois
-            query = "SELECT COUNT(*) FROM transactions WHERE DATE(date_transaction) >= DATE(?)"
-            result = self.db_manager.execute_query(query, (first_day_month,), use_cache=True, cache_timeout=300, table="transactions")
-            self.stats_vars['transactions_mois'].set(str(result[0][0] if result else 0))
+            # Aujourd'hui
+            result = self.db_manager.execute_query(query, (day_key(today), day_key(today, 1)),
+                                                   use_cache=True, cache_timeout=300, table="ventes_journalieres")
+            transactions_jour, ca_jour, litres_jour = result[0] if result else (0, 0, 0)
+            self.stats_vars['transactions_jour'].set(str(transactions_jour))
+            self.stats_vars['ca_jour'].set(f"{ca_jour:.2f}")
+            self.stats_vars['litres_jour'].set(f"{litres_jour:.1f}")
             
-            # CA ce mois
-            query = "SELECT COALESCE(SUM(montant_total), 0) FROM transactions WHERE DATE(date_transaction) >= DATE(?)"
-            result = self.db_manager.execute_query(query, (first_day_month,), use_cache=True, cache_timeout=300, table="transactions")
-            ca_mois = result[0][0] if result else 0
+            # Ce mois
+            result = self.db_manager.execute_query(query, (day_key(today.replace(day=1)), day_key(today, 1)),
+                                                   use_cache=True, cache_timeout=300, table="ventes_journalieres")
+            transactions_mois, ca_mois, litres_mois = result[0] if result else (0, 0, 0)
+            self.stats_vars['transactions_mois'].set(str(transactions_mois))
             self.stats_vars['ca_mois'].set(f"{ca_mois:.2f}")
-            
-            # Litres vendus ce mois
-            query = "SELECT COALESCE(SUM(quantite), 0) FROM transactions WHERE DATE(date_transaction) >= DATE(?)"
-            result = self.db_manager.execute_query(query, (first_day_month,), use_cache=True, cache_timeout=300, table="transactions")
-            litres_mois = result[0][0] if result else 0
             self.stats_vars['litres_mois'].set(f"{litres_mois:.1f}")
             
             # Clients actifs
@@ -395,7 +424,7 @@ class Reports:
             self.stats_vars['factures_impayees'].set(str(result[0][0] if result else 0))
             
             # Soldes positifs totaux
-            query = "SELECT COALESCE(SUM(solde_actuel), 0) FROM clients WHERE solde_actuel > 0"
+            query = "SELECT COALESCE(SUM(solde_centimes), 0) / 100.0 FROM clients WHERE solde_centimes > 0"
             result = self.db_manager.execute_query(query, use_cache=True, cache_timeout=600, table="clients")
             soldes_positifs = result[0][0] if result else 0
             self.stats_vars['soldes_positifs'].set(f"{soldes_positifs:.2f}")
@@ -406,18 +435,20 @@ class Reports:
     def create_sales_chart(self, parent):
         """Créer le graphique d'évolution des ventes"""
         try:
-            # Récupérer les données des 7 derniers jours
-            dates = []
-            amounts = []
-            
-            for i in range(7):
-                date_obj = datetime.now() - timedelta(days=6-i)
-                date_str = date_obj.strftime('%Y-%m-%d')
-                dates.append(date_obj)
-                
-                query = "SELECT COALESCE(SUM(montant_total), 0) FROM transactions WHERE DATE(date_transaction) = DATE(?)"
-                result = self.db_manager.execute_query(query, (date_str,), use_cache=True, cache_timeout=300, table="transactions")
-                amounts.append(result[0][0] if result else 0)
+            # Récupérer les données des 7 derniers jours en une seule requête groupée
+            today = datetime.now()
+            dates = [today - timedelta(days=6-i) for i in range(7)]
+            
+            query = """
+                SELECT jour, COALESCE(SUM(montant_centimes), 0) / 100.0
+                FROM ventes_journalieres
+                WHERE jour >= ? AND jour < ?
+                GROUP BY jour
+            """
+            result = self.db_manager.execute_query(query, (day_key(dates[0]), day_key(today, 1)),
+                                                   use_cache=True, cache_timeout=300, table="ventes_journalieres")
+            totals = dict(result)
+            amounts = [totals.get(day_key(date_obj), 0) for date_obj in dates]
             
             # Créer le graphique (très agrandi pour écran tactile)
             fig, ax = plt.subplots(figsize=(16, 10))
@@ -448,16 +479,16 @@ class Reports:
         try:
             # Récupérer les données
             query = """
-                SELECT c.nom, COALESCE(SUM(t.montant_total), 0) as total
+                SELECT c.nom, COALESCE(SUM(v.montant_centimes), 0) / 100.0 as total
                 FROM carburants c
-                LEFT JOIN transactions t ON c.id = t.carburant_id 
-                    AND DATE(t.date_transaction) >= DATE('now', '-30 days')
+                LEFT JOIN ventes_journalieres v ON c.id = v.carburant_id 
+                    AND v.jour >= CAST(strftime('%Y%m%d', 'now', '-30 days') AS INTEGER)
                 GROUP BY c.id, c.nom
                 HAVING total > 0
                 ORDER BY total DESC
             """
             
-            results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, table=["carburants", "transactions"])
+            results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, table=["carburants", "ventes_journalieres"])
             
             if results:
                 labels = [row[0] for row in results]
@@ -573,13 +604,14 @@ class Reports:
             date_from = self.sales_date_from.get()
             date_to = self.sales_date_to.get()
             
+            # Période semi-ouverte sur la clé de jour indexée
             if date_from:
-                where_conditions.append("DATE(t.date_transaction) >= DATE(?)")
-                params.append(date_from)
+                where_conditions.append("t.jour >= ?")
+                params.append(day_key(date_from))
             
             if date_to:
-                where_conditions.append("DATE(t.date_transaction) <= DATE(?)")
-                params.append(date_to)
+                where_conditions.append("t.jour < ?")
+                params.append(day_key(date_to, 1))
             
             # Filtre station
             station_filter = self.sales_station_var.get()
@@ -599,6 +631,9 @@ class Reports:
             if where_clause:
                 where_clause = "WHERE " + where_clause
             
+            # Exercices archivés inclus seulement si la période les touche
+            sales_table = self.db_manager.history_table("transactions", day_key(date_from) if date_from else None)
+            
             query = f"""
                 SELECT 
                     DATE(t.date_transaction) as date,
@@ -611,8 +646,9 @@ class Reports:
                     car.nom as carburant,
                     t.quantite,
                     t.prix_unitaire,
-                    t.montant_total
-                FROM transactions t
+                    t.montant_total,
+                    t.montant_centimes
+                FROM {sales_table} t
                 JOIN stations s ON t.station_id = s.id
                 JOIN clients c ON t.client_id = c.id
                 JOIN carburants car ON t.carburant_id = car.id
@@ -620,8 +656,22 @@ class Reports:
                 ORDER BY t.date_transaction DESC, t.id DESC
             """
             
-            results = self.db_manager.execute_query(query, params, use_cache=True, cache_timeout=300, table=["transactions", "stations", "clients", "carburants"])
+            self.sales_summary_vars['total_transactions'].set("Chargement...")
+            self.bridge.run_query(
+                query, params,
+                callback=lambda results: (self.update_snapshot_status(), self.display_sales_report(results)),
+                errback=lambda e: messagebox.showerror("Erreur", f"Erreur lors de la génération du rapport: {str(e)}"),
+                key='sales_report',
+                use_cache=True, cache_timeout=300, use_snapshot=self.use_snapshot.get(),
+                table=["transactions", "stations", "clients", "carburants"]
+            )
             
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Erreur lors de la génération du rapport: {str(e)}")
+    
+    def display_sales_report(self, results):
+        """Afficher les résultats du rapport de ventes (appelé sur le thread Tk)"""
+        try:
             total_transactions = len(results)
             total_litres = 0
             total_montant = 0
@@ -635,18 +685,18 @@ class Reports:
                     row[3],  # Carburant
                     f"{row[4]:.1f}L",  # Quantité
                     f"{row[5]:.2f}",   # Prix/L
-                    f"{row[6]:.2f} DH" # Montant
+                    format_centimes(row[7])  # Montant
                 )
                 self.sales_tree.insert('', 'end', values=values)
                 
-                # Calculs pour le résumé
+                # Calculs pour le résumé (montants en centimes entiers)
                 total_litres += row[4]
-                total_montant += row[6]
+                total_montant += row[7]
             
             # Mettre à jour le résumé
             self.sales_summary_vars['total_transactions'].set(f"Total Transactions: {total_transactions}")
             self.sales_summary_vars['total_litres'].set(f"Total Litres: {total_litres:.1f}")
-            self.sales_summary_vars['total_montant'].set(f"Total Montant: {total_montant:.2f} DH")
+            self.sales_summary_vars['total_montant'].set(f"Total Montant: {format_centimes(total_montant)}")
             
         except Exception as e:
             messagebox.showerror("Erreur", f"Erreur lors de la génération du rapport: {str(e)}")
@@ -767,7 +817,7 @@ class Reports:
             ORDER BY c.solde_actuel DESC
         """
         
-        results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, table="clients")
+        results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, use_snapshot=self.use_snapshot.get(), table="clients")
         
         for row in results:
             values = (
@@ -788,7 +838,8 @@ class Reports:
         self.clients_tree.heading('Valeur2', text='Montant Total (DH)')
         self.clients_tree.heading('Valeur3', text='Dernière Transaction')
         
-        query = """
+        # Cumul depuis l'origine: exercices archivés compris
+        query = f"""
             SELECT 
                 CASE 
                     WHEN c.type_client = 'entreprise' AND c.entreprise IS NOT NULL 
@@ -797,16 +848,16 @@ class Reports:
                 END as client,
                 COUNT(t.id) as nb_transactions,
                 COALESCE(SUM(t.quantite), 0) as total_litres,
-                COALESCE(SUM(t.montant_total), 0) as total_montant,
+                COALESCE(SUM(t.montant_centimes), 0) / 100.0 as total_montant,
                 MAX(DATE(t.date_transaction)) as derniere_transaction
             FROM clients c
-            LEFT JOIN transactions t ON c.id = t.client_id
+            LEFT JOIN {self.db_manager.history_table("transactions")} t ON c.id = t.client_id
             WHERE c.statut = 'actif'
             GROUP BY c.id, client
             ORDER BY total_montant DESC
         """
         
-        results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, table=["clients", "transactions"])
+        results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, use_snapshot=self.use_snapshot.get(), table=["clients", "transactions"])
         
         for row in results:
             values = (
@@ -827,7 +878,8 @@ class Reports:
         self.clients_tree.heading('Valeur2', text='Paiements Actifs (DH)')
         self.clients_tree.heading('Valeur3', text='Dernier Paiement')
         
-        query = """
+        # Cumul depuis l'origine: exercices archivés compris
+        query = f"""
             SELECT 
                 CASE 
                     WHEN c.type_client = 'entreprise' AND c.entreprise IS NOT NULL 
@@ -835,18 +887,18 @@ class Reports:
                     ELSE c.nom || ' ' || COALESCE(c.prenom, '')
                 END as client,
                 COUNT(p.id) as nb_paiements,
-                COALESCE(SUM(p.montant), 0) as total_paiements,
-                COALESCE(SUM(CASE WHEN p.statut = 'actif' THEN p.montant ELSE 0 END), 0) as paiements_actifs,
+                COALESCE(SUM(p.montant_centimes), 0) / 100.0 as total_paiements,
+                COALESCE(SUM(CASE WHEN p.statut = 'actif' THEN p.montant_centimes ELSE 0 END), 0) / 100.0 as paiements_actifs,
                 MAX(DATE(p.date_paiement)) as dernier_paiement
             FROM clients c
-            LEFT JOIN paiements_avance p ON c.id = p.client_id
+            LEFT JOIN {self.db_manager.history_table("paiements_avance")} p ON c.id = p.client_id
             WHERE c.statut = 'actif'
             GROUP BY c.id, client
             HAVING nb_paiements > 0
             ORDER BY total_paiements DESC
         """
         
-        results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, table=["clients", "paiements_avance"])
+        results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, use_snapshot=self.use_snapshot.get(), table=["clients", "paiements_avance"])
         
         for row in results:
             values = (
@@ -875,8 +927,8 @@ class Reports:
                     ELSE c.nom || ' ' || COALESCE(c.prenom, '')
                 END as client,
                 COUNT(f.id) as nb_factures,
-                COALESCE(SUM(f.montant_ht), 0) as total_ht,
-                COALESCE(SUM(f.montant_ttc), 0) as total_ttc,
+                COALESCE(SUM(f.montant_ht_centimes), 0) / 100.0 as total_ht,
+                COALESCE(SUM(f.montant_ttc_centimes), 0) / 100.0 as total_ttc,
                 COUNT(CASE WHEN f.statut = 'impayee' THEN 1 END) as factures_impayees
             FROM clients c
             LEFT JOIN factures f ON c.id = f.client_id
@@ -886,7 +938,7 @@ class Reports:
             ORDER BY total_ttc DESC
         """
         
-        results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, table=["clients", "factures"])
+        results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, use_snapshot=self.use_snapshot.get(), table=["clients", "factures"])
         
         for row in results:
             values = (
@@ -905,34 +957,47 @@ class Reports:
             
             # Déterminer la période
             if period == "cette_semaine":
-                date_condition = "DATE(t.date_transaction) >= DATE('now', '-7 days')"
+                date_condition = "v.jour >= CAST(strftime('%Y%m%d', 'now', '-7 days') AS INTEGER)"
                 period_label = "cette semaine"
             elif period == "ce_mois":
-                date_condition = "DATE(t.date_transaction) >= DATE('now', 'start of month')"
+                date_condition = "v.jour >= CAST(strftime('%Y%m%d', 'now', 'start of month') AS INTEGER)"
                 period_label = "ce mois"
             elif period == "trimestre":
-                date_condition = "DATE(t.date_transaction) >= DATE('now', '-3 months')"
+                date_condition = "v.jour >= CAST(strftime('%Y%m%d', 'now', '-3 months') AS INTEGER)"
                 period_label = "ce trimestre"
             else:  # année
-                date_condition = "DATE(t.date_transaction) >= DATE('now', 'start of year')"
+                date_condition = "v.jour >= CAST(strftime('%Y%m%d', 'now', 'start of year') AS INTEGER)"
                 period_label = "cette année"
             
-            # Requête principale
+            # Requête principale, sur les cumuls journaliers par station et carburant
             query = f"""
                 SELECT 
                     s.nom as station,
-                    COUNT(t.id) as nb_transactions,
-                    COALESCE(SUM(t.quantite), 0) as total_litres,
-                    COALESCE(SUM(t.montant_total), 0) as total_ca,
-                    COALESCE(AVG(t.montant_total), 0) as ca_moyen
+                    COALESCE(SUM(v.nb), 0) as nb_transactions,
+                    COALESCE(SUM(v.litres), 0) as total_litres,
+                    COALESCE(SUM(v.montant_centimes), 0) / 100.0 as total_ca,
+                    COALESCE(SUM(v.montant_centimes) * 1.0 / SUM(v.nb), 0) / 100.0 as ca_moyen
                 FROM stations s
-                LEFT JOIN transactions t ON s.id = t.station_id AND {date_condition}
+                LEFT JOIN ventes_journalieres v ON s.id = v.station_id AND {date_condition}
                 GROUP BY s.id, s.nom
                 ORDER BY total_ca DESC
             """
             
-            results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, table=["stations", "transactions"])
+            self.bridge.run_query(
+                query,
+                callback=lambda results: (self.update_snapshot_status(), self.display_ca_report(results, period_label)),
+                errback=lambda e: messagebox.showerror("Erreur", f"Erreur lors de la génération du rapport CA: {str(e)}"),
+                key='financial_report',
+                use_cache=True, cache_timeout=300, use_snapshot=self.use_snapshot.get(),
+                table=["stations", "ventes_journalieres"]
+            )
             
+        except Exception as e:
+            messagebox.showerror("Erreur", f"Erreur lors de la génération du rapport CA: {str(e)}")
+    
+    def display_ca_report(self, results, period_label):
+        """Afficher le rapport de chiffre d'affaires (appelé sur le thread Tk)"""
+        try:
             # Construire le rapport
             report = f"RAPPORT DE CHIFFRE D'AFFAIRES - {period_label.upper()}\n"
             report += "=" * 60 + "\n\n"
@@ -984,7 +1049,7 @@ class Reports:
                     c.solde_actuel,
                     c.credit_limite,
                     COUNT(t.id) as nb_transactions_credit,
-                    COALESCE(SUM(CASE WHEN t.type_paiement = 'credit' THEN t.montant_total ELSE 0 END), 0) as total_credit,
+                    COALESCE(SUM(CASE WHEN t.type_paiement = 'credit' THEN t.montant_centimes ELSE 0 END), 0) / 100.0 as total_credit,
                     MAX(DATE(t.date_transaction)) as derniere_transaction
                 FROM clients c
                 LEFT JOIN transactions t ON c.id = t.client_id AND t.type_paiement = 'credit'
@@ -993,7 +1058,7 @@ class Reports:
                 ORDER BY c.solde_actuel DESC
             """
             
-            results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, table=["clients", "transactions"])
+            results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, use_snapshot=self.use_snapshot.get(), table=["clients", "transactions"])
             
             report = "BILAN DES CRÉANCES\n"
             report += "=" * 50 + "\n\n"
@@ -1046,8 +1111,8 @@ class Reports:
                 SELECT 
                     f.statut,
                     COUNT(f.id) as nb_factures,
-                    COALESCE(SUM(f.montant_ht), 0) as total_ht,
-                    COALESCE(SUM(f.montant_ttc), 0) as total_ttc
+                    COALESCE(SUM(f.montant_ht_centimes), 0) / 100.0 as total_ht,
+                    COALESCE(SUM(f.montant_ttc_centimes), 0) / 100.0 as total_ttc
                 FROM factures f
                 GROUP BY f.statut
                 ORDER BY 
@@ -1059,7 +1124,7 @@ class Reports:
                     END
             """
             
-            results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, table="factures")
+            results = self.db_manager.execute_query(query, use_cache=True, cache_timeout=300, use_snapshot=self.use_snapshot.get(), table="factures")
             
             report = "ÉTAT DES FACTURES\n"
             report += "=" * 40 + "\n\n"
@@ -1099,7 +1164,7 @@ class Reports:
                 LIMIT 10
             """
             
-            recent_results = self.db_manager.execute_query(recent_query, use_cache=True, cache_timeout=300, table=["factures", "clients"])
+            recent_results = self.db_manager.execute_query(recent_query, use_cache=True, cache_timeout=300, use_snapshot=self.use_snapshot.get(), table=["factures", "clients"])
             
             report += "FACTURES IMPAYÉES RÉCENTES (10 dernières):\n"
             report += "-" * 40 + "\n\n"
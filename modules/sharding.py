@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+Répartition des ventes par station: un fichier de base par station
+Le fichier de référence garde clients, carburants, stations, factures et
+paiements; les transactions de chaque station vivent dans station_<id>.db.
+Chaque connexion attache les fichiers des stations (ATTACH) et une vue
+temporaire UNION ALL du même nom que la table masque la table d'origine:
+les requêtes existantes interrogent ainsi toutes les stations sans être
+modifiées, et les écritures sont routées par des triggers INSTEAD OF.
+
+Dans un trigger, la table écrite ne peut pas être qualifiée par son schéma:
+la table d'une station porte donc un nom propre (transactions_3 dans
+station_3.db) pour être résolue sans ambiguïté.
+"""
+
+import os
+import re
+import sqlite3
+
+from . import migrations
+
+# Tables réparties par station (paiements_avance n'a pas de station_id:
+# un paiement crédite le compte du client, il reste dans la base de référence)
+SHARDED_TABLES = ("transactions",)
+
+# Plage d'identifiants réservée à chaque station: les ID restent uniques
+# entre fichiers (lignes_facture.transaction_id ne précise pas la station)
+ID_RANGE = 10 ** 9
+
+# Triggers de la table d'origine recopiés dans les fichiers des stations
+# (ceux qui ne touchent que la table elle-même)
+SHARD_TRIGGER_PREFIXES = ("trg_{table}_jour_", "trg_{table}_montant_centimes_")
+
+_REFERENCES_RE = re.compile(
+    r"\s+REFERENCES\s+[\"\w]+\s*(\([^)]*\))?"
+    r"(\s+ON\s+(DELETE|UPDATE)\s+(SET\s+NULL|SET\s+DEFAULT|CASCADE|RESTRICT|NO\s+ACTION))*",
+    re.IGNORECASE
+)
+_CREATE_INDEX_RE = re.compile(r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(IF\s+NOT\s+EXISTS\s+)?", re.IGNORECASE)
+_CREATE_TRIGGER_RE = re.compile(r"^\s*CREATE\s+TRIGGER\s+(IF\s+NOT\s+EXISTS\s+)?", re.IGNORECASE)
+
+
+def split_definitions(sql):
+    """Découper le corps d'un CREATE TABLE en définitions de premier niveau"""
+    body = sql[sql.index("(") + 1:sql.rindex(")")]
+    parts, current, depth, quote = [], [], 0, None
+    for char in body:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    if "".join(current).strip():
+        parts.append("".join(current).strip())
+    return parts
+
+
+def is_foreign_key(definition, parent=None):
+    """La définition est-elle une contrainte FOREIGN KEY (vers parent si précisé)?"""
+    match = re.match(r"(CONSTRAINT\s+\S+\s+)?FOREIGN\s+KEY\b.*?REFERENCES\s+[\"]?(\w+)",
+                     definition, re.IGNORECASE | re.DOTALL)
+    return match is not None and (parent is None or match.group(2).lower() == parent.lower())
+
+
+def column_name(definition):
+    """Nom de colonne d'une définition, ou None pour une contrainte de table"""
+    first = definition.split(None, 1)[0].strip('"`[]')
+    if first.upper() in ("CONSTRAINT", "PRIMARY", "UNIQUE", "CHECK", "FOREIGN"):
+        return None
+    return first
+
+
+def shard_definitions(sql):
+    """Définitions d'une table sans clés étrangères (impossibles entre fichiers)"""
+    return [_REFERENCES_RE.sub("", definition) for definition in split_definitions(sql)
+            if not is_foreign_key(definition)]
+
+
+class ShardRouter:
+    """Fichiers des stations: création, mise à niveau du schéma, attache et vues"""
+    
+    def __init__(self, db_manager, directory):
+        self.db_manager = db_manager
+        self.directory = directory
+        self.station_ids = []
+        self.columns = {}  # table -> [(nom, défaut)] des colonnes insérables
+        self.capture = False  # Journal des modifications présent (réplication)
+        self.counters = False  # Compteurs de modifications présents (cohérence des caches)
+        self.daily_sales = False  # Cumuls journaliers des ventes présents (tableau de bord)
+    
+    def shard_path(self, station_id):
+        """Chemin du fichier des ventes d'une station"""
+        return os.path.join(self.directory, f"station_{station_id}.db")
+    
+    @staticmethod
+    def schema_name(station_id):
+        """Nom d'attache du fichier d'une station"""
+        return f"station_{station_id}"
+    
+    @staticmethod
+    def shard_table(table, station_id):
+        """Nom de la table dans le fichier d'une station (unique entre fichiers)"""
+        return f"{table}_{station_id}"
+    
+    def table_name(self, table, station_id):
+        """Table d'une seule station (ex. station_3.transactions_3), pour les
+        requêtes limitées à une station qui n'ont pas besoin de la vue"""
+        return f"{self.schema_name(station_id)}.{self.shard_table(table, station_id)}"
+    
+    def routes(self, tables):
+        """Une des tables écrites est-elle (ou peut-elle être) répartie par station?"""
+        return any(table in SHARDED_TABLES or table == "*" for table in tables)
+    
+    # ------------------------------------------------------------------
+    # Préparation (connexion d'écriture du fichier de référence, hors transaction)
+    # ------------------------------------------------------------------
+    def prepare(self, conn):
+        """Créer les fichiers manquants, y reporter les colonnes et index ajoutés
+        par les migrations, puis déplacer les lignes encore présentes dans la
+        base de référence (opération rejouable: les ID sont conservés)"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.station_ids = [row[0] for row in conn.execute("SELECT id FROM stations ORDER BY id")]
+        
+        limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        if len(self.station_ids) > limit:
+            raise sqlite3.OperationalError(
+                f"Trop de stations pour la répartition ({len(self.station_ids)} > {limit} fichiers attachés)")
+        
+        self.capture = conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' "
+                                    "AND name = 'journal_modifications'").fetchone() is not None
+        self.counters = conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' "
+                                     "AND name = 'compteurs_modifications'").fetchone() is not None
+        self.daily_sales = conn.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table' "
+                                        "AND name = 'ventes_journalieres'").fetchone() is not None
+        
+        for table in SHARDED_TABLES:
+            self._drop_references_to(conn, table)
+            self.columns[table] = self._insertable_columns(conn, "main", table)
+        
+        for station_id in self.station_ids:
+            schema = self.schema_name(station_id)
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (self.shard_path(station_id),))
+            try:
+                conn.execute(f"PRAGMA {schema}.journal_mode = WAL")
+                for table in SHARDED_TABLES:
+                    self._sync_schema(conn, schema, station_id, table)
+                    self._move_rows(conn, schema, station_id, table)
+            finally:
+                conn.execute(f"DETACH DATABASE {schema}")
+    
+    def _sync_schema(self, conn, schema, station_id, table):
+        """Créer ou compléter la table, ses index et ses triggers dans un fichier"""
+        sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                           (table,)).fetchone()[0]
+        definitions = shard_definitions(sql)
+        local = self.shard_table(table, station_id)
+        existing = {row[1] for row in conn.execute(f"PRAGMA {schema}.table_xinfo({local})")}
+        
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not existing:
+                conn.execute(f"CREATE TABLE {schema}.{local} ({', '.join(definitions)})")
+                if "AUTOINCREMENT" in sql.upper():
+                    # Premier ID de la plage de la station
+                    conn.execute(f"INSERT INTO {schema}.sqlite_sequence (name, seq) VALUES (?, ?)",
+                                 (local, station_id * ID_RANGE))
+            else:
+                for definition in definitions:
+                    name = column_name(definition)
+                    if name is not None and name not in existing:
+                        conn.execute(f"ALTER TABLE {schema}.{local} ADD COLUMN {definition}")
+            
+            prefixes = tuple(prefix.format(table=table) for prefix in SHARD_TRIGGER_PREFIXES)
+            for kind, name, object_sql in conn.execute(
+                    "SELECT type, name, sql FROM main.sqlite_master "
+                    "WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+                    (table,)).fetchall():
+                object_sql = re.sub(rf"\b{table}\b", local, object_sql)
+                if kind == "index":
+                    conn.execute(_CREATE_INDEX_RE.sub(
+                        lambda m: f"CREATE {m.group(1) or ''}INDEX IF NOT EXISTS {schema}.", object_sql, count=1))
+                elif name.startswith(prefixes):
+                    conn.execute(_CREATE_TRIGGER_RE.sub(
+                        f"CREATE TRIGGER IF NOT EXISTS {schema}.", object_sql, count=1))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def _move_rows(self, conn, schema, station_id, table):
+        """Déplacer les lignes d'une station de la base de référence vers son fichier.
+        
+        En WAL, une transaction n'est pas atomique entre fichiers: la copie
+        (INSERT OR IGNORE, ID conservés) précède la suppression, une reprise
+        après interruption termine simplement le déplacement."""
+        names = ", ".join(name for name, _ in self.columns[table])
+        if not conn.execute(f"SELECT 1 FROM main.{table} WHERE station_id = ? LIMIT 1", (station_id,)).fetchone():
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"""
+                INSERT OR IGNORE INTO {self.table_name(table, station_id)} ({names})
+                SELECT {names} FROM main.{table} WHERE station_id = ?
+            """, (station_id,))
+            # Un déplacement n'est pas une suppression à répliquer vers le siège
+            if self.capture:
+                migrations.suspend_capture(conn)
+            conn.execute(f"DELETE FROM main.{table} WHERE station_id = ?", (station_id,))
+            if self.capture:
+                migrations.suspend_capture(conn, False)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    
+    @staticmethod
+    def _insertable_columns(conn, schema, table):
+        """Colonnes ordinaires (hors colonnes générées) et leur valeur par défaut"""
+        return [(row[1], row[4]) for row in conn.execute(f"PRAGMA {schema}.table_xinfo({table})")
+                if row[6] not in (2, 3)]
+    
+    @staticmethod
+    def _drop_references_to(conn, parent):
+        """Reconstruire les tables qui déclarent une clé étrangère vers parent:
+        SQLite ne vérifie pas une clé étrangère vers un autre fichier"""
+        children = []
+        for (name,) in conn.execute("SELECT name FROM main.sqlite_master WHERE type = 'table' "
+                                    "AND name NOT LIKE 'sqlite_%'").fetchall():
+            if any(row[2] == parent for row in conn.execute(f"PRAGMA main.foreign_key_list({name})")):
+                children.append(name)
+        
+        for name in children:
+            sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                               (name,)).fetchone()[0]
+            others = conn.execute("SELECT sql FROM main.sqlite_master WHERE tbl_name = ? "
+                                  "AND type IN ('index', 'trigger') AND sql IS NOT NULL", (name,)).fetchall()
+            definitions = [definition for definition in split_definitions(sql)
+                           if not is_foreign_key(definition, parent)]
+            definitions = [re.sub(rf"\s+REFERENCES\s+[\"]?{parent}\b[\"]?\s*(\([^)]*\))?", "", definition,
+                                  flags=re.IGNORECASE) for definition in definitions]
+            
+            # Procédure de reconstruction documentée par SQLite (clés étrangères désactivées)
+            conn.execute("PRAGMA foreign_keys = OFF")
+            conn.execute("PRAGMA legacy_alter_table = ON")
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(f"CREATE TABLE main.{name}_reconstruite ({', '.join(definitions)})")
+                    conn.execute(f"INSERT INTO main.{name}_reconstruite SELECT * FROM main.{name}")
+                    conn.execute(f"DROP TABLE main.{name}")
+                    conn.execute(f"ALTER TABLE main.{name}_reconstruite RENAME TO {name}")
+                    for (object_sql,) in others:
+                        conn.execute(object_sql)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            finally:
+                conn.execute("PRAGMA legacy_alter_table = OFF")
+                conn.execute("PRAGMA foreign_keys = ON")
+    
+    # ------------------------------------------------------------------
+    # Attache (chaque connexion du pool, avant query_only)
+    # ------------------------------------------------------------------
+    def attach(self, conn, paths=None):
+        """Attacher les fichiers des stations et créer les vues de fédération.
+        paths: {station_id: chemin} pour attacher des copies (instantané des rapports)"""
+        for station_id in self.station_ids:
+            path = paths[station_id] if paths else self.shard_path(station_id)
+            conn.execute(f"ATTACH DATABASE ? AS {self.schema_name(station_id)}", (path,))
+        for table in SHARDED_TABLES:
+            for statement in self.federation_sql(table):
+                conn.execute(statement)
+    
+    def federation_sql(self, table):
+        """Vue temporaire UNION ALL et triggers INSTEAD OF qui routent les écritures.
+        
+        La vue porte le nom de la table: le schéma temp est résolu avant main.
+        Une colonne omise (ou NULL) à l'insertion reçoit la valeur par défaut
+        de la table, la vue n'ayant pas de valeurs par défaut."""
+        stations = self.station_ids
+        columns = self.columns[table]
+        names = ", ".join(name for name, _ in columns)
+        values = ", ".join(f"COALESCE(NEW.{name}, {default})" if default is not None else f"NEW.{name}"
+                           for name, default in columns)
+        assignments = ", ".join(f"{name} = NEW.{name}" for name, _ in columns)
+        known = ", ".join(str(station_id) for station_id in stations) or "NULL"
+        unknown = (f"SELECT RAISE(ABORT, 'Station sans fichier de ventes') "
+                   f"WHERE NEW.station_id IS NULL OR NEW.station_id NOT IN ({known});")
+        
+        # Capture pour la réplication: les triggers de la table d'origine ne voient
+        # plus les écritures, la ligne écrite est relue à travers la vue
+        captured = self.capture and table in migrations.CAPTURED_TABLES
+        capture = {"INSERT": "", "UPDATE": "", "DELETE": ""}
+        if captured:
+            payload = migrations.capture_payload([name for name, _ in columns], "r")
+            for operation, key in (("INSERT", "(SELECT dernier_id FROM repartition WHERE cle = 1)"),
+                                   ("UPDATE", "NEW.id")):
+                capture[operation] = (f"INSERT INTO journal_modifications (nom_table, operation, ligne_id, donnees) "
+                                      f"SELECT '{table}', '{operation}', r.id, {payload} FROM {table} r "
+                                      f"WHERE r.id = {key};")
+            capture["DELETE"] = (f"INSERT INTO journal_modifications (nom_table, operation, ligne_id, donnees) "
+                                 f"VALUES ('{table}', 'DELETE', OLD.id, NULL);")
+        
+        # Cumuls journaliers des ventes (tenus dans la base de référence)
+        if self.daily_sales and table == "transactions":
+            capture["INSERT"] += migrations.daily_sales_sql(
+                "NEW", date="COALESCE(NEW.date_transaction, CURRENT_TIMESTAMP)")
+            capture["UPDATE"] += migrations.daily_sales_sql("OLD", "-") + migrations.daily_sales_sql("NEW")
+            capture["DELETE"] += migrations.daily_sales_sql("OLD", "-")
+        
+        # Compteur de modifications de la table (les fichiers des stations n'en ont pas)
+        if self.counters:
+            bump = f"UPDATE compteurs_modifications SET version = version + 1 WHERE nom_table = '{table}';"
+            for operation in capture:
+                capture[operation] += bump
+        
+        if stations:
+            union = " UNION ALL ".join(f"SELECT * FROM {self.table_name(table, station_id)}"
+                                       for station_id in stations)
+        else:
+            union = f"SELECT * FROM main.{table} WHERE 0"
+        
+        inserts, updates, deletes = [], [], []
+        for station_id in stations:
+            target = self.shard_table(table, station_id)  # Non qualifiée: trigger
+            inserts.append(f"INSERT INTO {target} ({names}) SELECT {values} WHERE NEW.station_id = {station_id};")
+            updates.append(f"UPDATE {target} SET {assignments} WHERE id = OLD.id "
+                           f"AND OLD.station_id = {station_id} AND NEW.station_id = {station_id};")
+            # Changement de station: la ligne change de fichier
+            updates.append(f"DELETE FROM {target} WHERE id = OLD.id "
+                           f"AND OLD.station_id = {station_id} AND NEW.station_id IS NOT {station_id};")
+            updates.append(f"INSERT INTO {target} ({names}) SELECT {values} "
+                           f"WHERE NEW.station_id = {station_id} AND OLD.station_id IS NOT {station_id};")
+            deletes.append(f"DELETE FROM {target} WHERE id = OLD.id AND OLD.station_id = {station_id};")
+        
+        return [
+            # Bilan des écritures routées: dernier ID inséré et lignes de la vue touchées
+            "CREATE TEMP TABLE IF NOT EXISTS repartition "
+            "(cle INTEGER PRIMARY KEY, dernier_id INTEGER, lignes INTEGER NOT NULL DEFAULT 0)",
+            "INSERT OR IGNORE INTO temp.repartition (cle) VALUES (1)",
+            f"DROP VIEW IF EXISTS temp.{table}",
+            f"CREATE TEMP VIEW {table} AS {union}",
+            f"""CREATE TEMP TRIGGER {table}_repartir_insert INSTEAD OF INSERT ON {table}
+                BEGIN
+                    {unknown}
+                    {' '.join(inserts)}
+                    UPDATE repartition SET dernier_id = last_insert_rowid(), lignes = lignes + 1 WHERE cle = 1;
+                    {capture["INSERT"]}
+                END""",
+            f"""CREATE TEMP TRIGGER {table}_repartir_update INSTEAD OF UPDATE ON {table}
+                BEGIN
+                    {unknown}
+                    {' '.join(updates)}
+                    UPDATE repartition SET lignes = lignes + 1 WHERE cle = 1;
+                    {capture["UPDATE"]}
+                END""",
+            f"""CREATE TEMP TRIGGER {table}_repartir_delete INSTEAD OF DELETE ON {table}
+                BEGIN
+                    {' '.join(deletes)}
+                    UPDATE repartition SET lignes = lignes + 1 WHERE cle = 1;
+                    {capture["DELETE"]}
+                END""",
+        ]
+    
+    @staticmethod
+    def last_write(conn):
+        """(dernier ID inséré, lignes touchées) de l'écriture routée qui vient
+        d'avoir lieu, puis remise à zéro du compteur: sqlite3 ne voit pas les
+        écritures faites par un trigger INSTEAD OF (lastrowid, rowcount)"""
+        last_id, rows = conn.execute("SELECT dernier_id, lignes FROM temp.repartition WHERE cle = 1").fetchone()
+        conn.execute("UPDATE temp.repartition SET lignes = 0 WHERE cle = 1")
+        return last_id, rows
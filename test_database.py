@@ -0,0 +1,1150 @@
+# -*- coding: utf-8 -*-
+"""
+Tests du gestionnaire de base de données (python -m pytest -q)
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date
+
+import pytest
+
+# Ajouter le répertoire du projet au chemin (modules est importé comme un paquet)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modules import backup, memoize, migrations, replication, sharding
+from modules.client_management_simple import client_credit_text
+from modules.database import DatabaseManager, QueryProfiler
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Base neuve dans un répertoire temporaire (journaux compris)"""
+    monkeypatch.chdir(tmp_path)
+    manager = DatabaseManager(str(tmp_path / "gaz_station.db"))
+    yield manager
+    manager.close_all_connections()
+
+
+def add_client(db, nom="Client"):
+    return db.execute_insert("INSERT INTO clients (nom) VALUES (?)", (nom,), table="clients")
+
+
+def count_clients(db):
+    return db.execute_query("SELECT COUNT(*) FROM clients", use_cache=False)[0][0]
+
+
+# ----------------------------------------------------------------------
+# Cache des requêtes: invalidation exacte par table
+# ----------------------------------------------------------------------
+CLIENTS_QUERY = "select c.nom from clients c left join vehicules v on v.client_id = c.id order by c.nom"
+FUELS_QUERY = "SELECT nom FROM carburants ORDER BY id"
+
+
+def test_cache_records_tables_read(db):
+    db.execute_query(CLIENTS_QUERY)
+    entry = db.query_cache[f"{CLIENTS_QUERY}_None"]
+    assert {"clients", "vehicules"} <= entry["tables"]
+
+
+def test_write_invalidates_only_dependent_queries(db):
+    db.execute_query(CLIENTS_QUERY)
+    fuels = db.execute_query(FUELS_QUERY)
+    add_client(db, "Nouveau")
+    
+    assert f"{CLIENTS_QUERY}_None" not in db.query_cache
+    assert f"{FUELS_QUERY}_None" in db.query_cache
+    assert ("Nouveau",) in db.execute_query(CLIENTS_QUERY)
+    assert db.execute_query(FUELS_QUERY) == fuels
+
+
+def test_write_through_alias_invalidates(db):
+    client_id = add_client(db, "Avant")
+    db.execute_query(CLIENTS_QUERY)
+    db.execute_update("update clients as c set nom = 'Après' where c.id = ?", (client_id,))
+    assert ("Après",) in db.execute_query(CLIENTS_QUERY)
+
+
+def test_statement_prepared_before_tracking_is_not_trusted(db):
+    # Requête déjà préparée hors relevé: l'autorisateur ne la revoit pas
+    query = "SELECT COUNT(*) FROM clients WHERE nom = ?"
+    with db.get_connection() as conn:
+        conn.execute(query, ("X",)).fetchall()
+        conn.execute("UPDATE clients SET nom = nom WHERE id = ?", (0,))
+    
+    assert db.execute_query(query, ("X",)) == [(0,)]
+    assert db.query_tables.get(query) != (frozenset(), frozenset())
+    
+    # Écriture dont les tables sont inconnues: tout le cache dépendant est vidé
+    db.execute_update("UPDATE clients SET nom = nom WHERE id = ?", (0,))
+    add_client(db, "X")
+    assert db.execute_query(query, ("X",)) == [(1,)]
+
+
+# ----------------------------------------------------------------------
+# Cache des requêtes: budget mémoire et éviction LRU
+# ----------------------------------------------------------------------
+def test_cache_evicts_least_recently_used_within_budget(db):
+    # Résultats de même taille: le budget tient exactement quatre entrées
+    queries = [f"SELECT {i}, 'valeur' FROM carburants LIMIT 1" for i in range(1, 6)]
+    db.execute_query(queries[0])
+    entry_size = db.cache_bytes
+    db.cache_max_bytes = entry_size * 4 + entry_size // 2
+    
+    for query in queries[1:4]:
+        db.execute_query(query)
+    db.execute_query(queries[0])  # Redevient la plus récente
+    db.execute_query(queries[4])
+    
+    assert [key[:-len("_None")] for key in db.query_cache] == [queries[2], queries[3], queries[0], queries[4]]
+    assert db.stats["cache_evictions"] == 1
+    assert db.cache_bytes <= db.cache_max_bytes
+
+
+def test_cache_skips_oversized_results(db):
+    db.cache_max_bytes = 4 * 1024
+    db.execute_query("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 500) "
+                     "SELECT i, 'ligne' FROM n")
+    assert not db.query_cache and db.cache_bytes == 0
+
+
+def test_invalidation_releases_cache_bytes(db):
+    db.execute_query(FUELS_QUERY)
+    assert db.cache_bytes > 0
+    db.invalidate_cache("carburants")
+    assert db.cache_bytes == 0 and not db.cache_index
+
+
+# ----------------------------------------------------------------------
+# Pool de connexions
+# ----------------------------------------------------------------------
+def test_pool_bounds_readers_and_times_out(db):
+    pool = db.connection_pool
+    pool.timeout = 0.1
+    with db.get_connection(read_only=True):
+        with db.get_connection(read_only=True):
+            with db.get_connection(read_only=True):
+                with db.get_connection(read_only=True):
+                    with pytest.raises(sqlite3.OperationalError):
+                        with db.get_connection(read_only=True):
+                            pass
+    metrics = pool.get_metrics()
+    assert metrics["peak_readers_in_use"] == pool.max_readers == 4
+    assert metrics["readers_in_use"] == 0
+    
+    # Les lecteurs rendus sont réutilisés, pas rouverts
+    with db.get_connection(read_only=True):
+        pass
+    assert pool.reader_count == 4
+
+
+def test_readers_are_query_only(db):
+    with db.get_connection(read_only=True) as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO clients (nom) VALUES ('Lecteur')")
+
+
+def test_writer_is_exclusive_across_threads(db):
+    db.connection_pool.timeout = 0.1
+    held, release = threading.Event(), threading.Event()
+    
+    def hold_writer():
+        with db.get_connection():
+            held.set()
+            release.wait(5)
+    
+    thread = threading.Thread(target=hold_writer)
+    thread.start()
+    try:
+        held.wait(5)
+        with pytest.raises(sqlite3.OperationalError):
+            with db.get_connection():
+                pass
+    finally:
+        release.set()
+        thread.join()
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT 1").fetchone() == (1,)
+
+
+def test_close_all_retires_borrowed_readers(db):
+    pool = db.connection_pool
+    with db.get_connection(read_only=True) as conn:
+        pool.close_all()
+    # Empruntée avant close_all: fermée à la restitution au lieu d'être remise
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+    assert pool.reader_count == 0 and pool.idle_readers.empty()
+    
+    with db.get_connection(read_only=True) as fresh:
+        assert fresh is not conn
+        assert fresh.execute("SELECT COUNT(*) FROM carburants").fetchone()[0] > 0
+
+
+# ----------------------------------------------------------------------
+# Unité de travail
+# ----------------------------------------------------------------------
+def test_transaction_commits_all_writes(db):
+    before = count_clients(db)
+    with db.transaction():
+        add_client(db, "A")
+        add_client(db, "B")
+    assert count_clients(db) == before + 2
+
+
+def test_transaction_rolls_back_on_error(db):
+    before = count_clients(db)
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            add_client(db, "A")
+            raise RuntimeError("échec")
+    assert count_clients(db) == before
+
+
+def test_nested_transaction_rolls_back_to_savepoint(db):
+    before = count_clients(db)
+    with db.transaction():
+        add_client(db, "Conservé")
+        with pytest.raises(RuntimeError):
+            with db.transaction():
+                add_client(db, "Annulé")
+                raise RuntimeError("échec")
+    names = [row[0] for row in db.execute_query("SELECT nom FROM clients", use_cache=False)]
+    assert count_clients(db) == before + 1
+    assert "Conservé" in names and "Annulé" not in names
+
+
+def test_transaction_reads_own_writes_without_caching_them(db):
+    query = "SELECT COUNT(*) FROM clients"
+    before = db.execute_query(query)[0][0]
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            add_client(db)
+            # Le thread de la transaction lit sa propre écriture non validée
+            assert db.execute_query(query)[0][0] == before + 1
+            raise RuntimeError("échec")
+    # Annulée: le résultat lu pendant la transaction n'a pas été gardé en cache
+    assert db.execute_query(query)[0][0] == before
+    
+    with db.transaction():
+        add_client(db)
+    assert db.execute_query(query)[0][0] == before + 1
+
+
+# ----------------------------------------------------------------------
+# Écritures groupées
+# ----------------------------------------------------------------------
+def client_rows(count, failing=None):
+    return ((None if i == failing else f"Lot {i}",) for i in range(count))
+
+
+def test_execute_many_writes_in_chunks(db):
+    before = count_clients(db)
+    cached = db.execute_query("SELECT COUNT(*) FROM clients")[0][0]
+    written = db.execute_many("INSERT INTO clients (nom) VALUES (?)", client_rows(1200), chunk_size=500)
+    assert written == 1200
+    assert count_clients(db) == before + 1200
+    assert db.execute_query("SELECT COUNT(*) FROM clients")[0][0] == cached + 1200
+
+
+def test_execute_many_keeps_committed_chunks(db):
+    before = count_clients(db)
+    with pytest.raises(sqlite3.Error):
+        db.execute_many("INSERT INTO clients (nom) VALUES (?)", client_rows(1200, failing=1100), chunk_size=500)
+    # Les deux premiers paquets sont validés, le paquet en échec est annulé en entier
+    assert count_clients(db) == before + 1000
+
+
+def test_execute_many_in_transaction_rolls_back_everything(db):
+    before = count_clients(db)
+    with pytest.raises(sqlite3.Error):
+        with db.transaction():
+            db.execute_many("INSERT INTO clients (nom) VALUES (?)", client_rows(1200, failing=1100),
+                            chunk_size=500)
+    assert count_clients(db) == before
+
+
+# ----------------------------------------------------------------------
+# API asynchrone
+# ----------------------------------------------------------------------
+def test_worker_pool_runs_blocking_calls(db):
+    future = db.run_in_executor(count_clients, db)
+    assert future.result(timeout=5) == count_clients(db)
+    
+    async def scenario():
+        client_id = await db.ainsert("INSERT INTO clients (nom) VALUES (?)", ("Async",), table="clients")
+        rows = await db.aquery("SELECT nom FROM clients WHERE id = ?", (client_id,))
+        total = await db.arun(count_clients, db)
+        return rows, total
+    
+    rows, total = asyncio.run(scenario())
+    assert rows == [("Async",)] and total == count_clients(db)
+
+
+# ----------------------------------------------------------------------
+# File d'écriture et validation groupée
+# ----------------------------------------------------------------------
+@pytest.fixture
+def queued_db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manager = DatabaseManager(str(tmp_path / "gaz_station.db"), group_commit=True)
+    yield manager
+    manager.close_all_connections()
+
+
+def test_group_commit_batches_queued_writes(queued_db):
+    db = queued_db
+    before = count_clients(db)
+    # Rédacteur occupé: les écritures s'accumulent dans la file
+    with db.get_connection():
+        futures = [db.submit_insert("INSERT INTO clients (nom) VALUES (?)", (f"File {i}",), table="clients")
+                   for i in range(20)]
+    ids = [future.result(timeout=5) for future in futures]
+    
+    assert len(set(ids)) == 20
+    assert count_clients(db) == before + 20
+    metrics = db.get_performance_stats()["write_queue"]
+    assert metrics["writes"] == 20 and metrics["batches"] <= 2
+
+
+def test_group_commit_delivers_errors_to_their_caller(queued_db):
+    db = queued_db
+    before = count_clients(db)
+    with db.get_connection():
+        futures = [db.submit_insert("INSERT INTO clients (nom) VALUES (?)", (nom,), table="clients")
+                   for nom in ("Avant", None, "Après")]
+    
+    assert isinstance(futures[1].exception(timeout=5), sqlite3.Error)
+    assert futures[0].result() and futures[2].result()
+    assert count_clients(db) == before + 2
+    
+    # Appel bloquant passé par la file: l'erreur remonte à l'appelant
+    with pytest.raises(sqlite3.Error):
+        db.execute_insert("INSERT INTO clients (nom) VALUES (?)", (None,), table="clients")
+    assert db.get_performance_stats()["write_queue"]["failures"] == 2
+
+
+# ----------------------------------------------------------------------
+# Profileur de requêtes
+# ----------------------------------------------------------------------
+def test_fingerprint_groups_query_variants():
+    profiler = QueryProfiler()
+    first = profiler.fingerprint("SELECT * FROM clients WHERE nom = 'Alami' AND id IN (?, ?, ?) LIMIT 10")
+    second = profiler.fingerprint("select * from clients  where nom = 'Ben' and id in (?) limit 50")
+    assert first == "SELECT * FROM clients WHERE nom = ? AND id IN (...) LIMIT ?"
+    assert second.lower() == first.lower()
+
+
+def test_latency_histogram_percentiles():
+    profiler = QueryProfiler(slow_threshold=10)
+    for _ in range(95):
+        profiler.record("SELECT 1", None, 0.001, 1)
+    for _ in range(5):
+        profiler.record("SELECT 1", None, 0.5, 1)
+    
+    entry = profiler.report()[0]
+    assert entry["count"] == 100 and entry["max_time"] == 0.5
+    assert 0.001 <= entry["p50"] < 0.0015
+    assert 0.001 <= entry["p95"] < 0.0015
+    assert 0.5 <= entry["p99"] < 0.75
+
+
+def test_slow_query_captures_plan_once():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE ventes (id INTEGER PRIMARY KEY, station INTEGER)")
+    profiler = QueryProfiler(slow_threshold=0.1)
+    profiler.record("SELECT * FROM ventes WHERE station = 3", None, 0.2, 0, conn)
+    profiler.record("SELECT * FROM ventes WHERE station = 4", None, 0.3, 0, conn)
+    
+    entry = profiler.report()[0]
+    assert entry["slow_count"] == 2 and entry["full_scans"] == ["ventes"]
+    assert profiler.slow_count == 2
+    assert profiler.slow_queries[-1]["full_scans"] == ["ventes"]
+
+
+def test_manager_records_fingerprints(db):
+    for client_id in range(3):
+        db.execute_query("SELECT nom FROM clients WHERE id = ?", (client_id,), use_cache=False)
+    fingerprints = {entry["fingerprint"]: entry for entry in db.get_performance_stats()["fingerprints"]}
+    assert fingerprints["SELECT nom FROM clients WHERE id = ?"]["count"] == 3
+
+
+# ----------------------------------------------------------------------
+# Migrations
+# ----------------------------------------------------------------------
+def test_migrations_reach_latest_version(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "gaz_station.db")
+    db = DatabaseManager(path)
+    with db.get_connection(read_only=True) as conn:
+        assert migrations.current_version(conn) == migrations.latest_version()
+        applied = conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0]
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(clients)")}
+    assert {"entreprise", "type_client", "credit_limite", "statut"} <= columns
+    db.close_all_connections()
+    
+    # Réouverture d'une base à jour: aucune migration ni maintenance
+    def unexpected(*args, **kwargs):
+        raise AssertionError("travail inattendu au démarrage")
+    
+    monkeypatch.setattr(DatabaseManager, "optimize", unexpected)
+    db = DatabaseManager(path)
+    try:
+        with db.get_connection(read_only=True) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == applied
+    finally:
+        db.close_all_connections()
+
+
+def test_migrations_upgrade_unversioned_database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "ancienne.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, nom TEXT NOT NULL,
+                    prenom TEXT, telephone TEXT, solde_actuel REAL DEFAULT 0,
+                    date_creation TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    conn.execute("INSERT INTO clients (nom, solde_actuel) VALUES ('Existant', 12.5)")
+    conn.commit()
+    conn.close()
+    
+    db = DatabaseManager(path)
+    try:
+        assert db.execute_query("SELECT nom, solde_actuel, statut FROM clients", use_cache=False) == \
+            [("Existant", 12.5, "actif")]
+    finally:
+        db.close_all_connections()
+
+
+def test_optimize_is_an_explicit_maintenance_call(db):
+    db.execute_query("SELECT COUNT(*) FROM clients WHERE nom = ?", ("A",), use_cache=False)
+    db.optimize()
+    with db.get_connection(read_only=True) as conn:
+        # Les lecteurs retrouvent leur restriction après la maintenance
+        assert conn.execute("PRAGMA query_only").fetchone()[0] == 1
+
+
+# ----------------------------------------------------------------------
+# Répartition des ventes par station
+# ----------------------------------------------------------------------
+@pytest.fixture
+def sharded_db(tmp_path, monkeypatch):
+    """Base dont les ventes sont réparties dans un fichier par station"""
+    monkeypatch.chdir(tmp_path)
+    manager = DatabaseManager(str(tmp_path / "gaz_station.db"), shard_dir=str(tmp_path / "stations"))
+    yield manager
+    manager.close_all_connections()
+
+
+def add_sale(db, client_id, date_transaction=None, station_id=1, quantite=10.0, prix=12.5, carburant_id=1):
+    return db.execute_insert("""
+        INSERT INTO transactions (station_id, client_id, carburant_id, quantite, prix_unitaire,
+                                  montant_total, date_transaction)
+        VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+    """, (station_id, client_id, carburant_id, quantite, prix, round(quantite * prix, 2), date_transaction),
+        table="transactions")
+
+
+def shard_rows(db, station_id):
+    conn = sqlite3.connect(db.shards.shard_path(station_id))
+    try:
+        return conn.execute(f"SELECT id, client_id FROM transactions_{station_id} ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_sharded_inserts_land_in_station_files(sharded_db):
+    client_id = add_client(sharded_db)
+    first = add_sale(sharded_db, client_id, station_id=1)
+    second = add_sale(sharded_db, client_id, station_id=2)
+    
+    # Chaque station a sa plage d'identifiants
+    assert first // sharding.ID_RANGE == 1
+    assert second // sharding.ID_RANGE == 2
+    assert shard_rows(sharded_db, 1) == [(first, client_id)]
+    assert shard_rows(sharded_db, 2) == [(second, client_id)]
+    with sharded_db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM main.transactions").fetchone()[0] == 0
+    # La vue de fédération réunit les stations
+    assert sharded_db.execute_query("SELECT id FROM transactions ORDER BY id", use_cache=False) == \
+        [(first,), (second,)]
+
+
+def test_sharded_update_and_delete_are_routed(sharded_db):
+    client_id = add_client(sharded_db)
+    sale_id = add_sale(sharded_db, client_id, station_id=1)
+    
+    assert sharded_db.execute_update("UPDATE transactions SET quantite = 20 WHERE id = ?",
+                                     (sale_id,), table="transactions") == 1
+    # Changement de station: la ligne change de fichier
+    sharded_db.execute_update("UPDATE transactions SET station_id = 3 WHERE id = ?",
+                              (sale_id,), table="transactions")
+    assert shard_rows(sharded_db, 1) == []
+    assert shard_rows(sharded_db, 3) == [(sale_id, client_id)]
+    assert sharded_db.execute_query("SELECT station_id, quantite FROM transactions WHERE id = ?",
+                                    (sale_id,), use_cache=False) == [(3, 20.0)]
+    
+    assert sharded_db.execute_update("DELETE FROM transactions WHERE id = ?",
+                                     (sale_id,), table="transactions") == 1
+    assert shard_rows(sharded_db, 3) == []
+
+
+def test_sharded_insert_rejects_unknown_station(sharded_db):
+    client_id = add_client(sharded_db)
+    with pytest.raises(sqlite3.Error, match="Station sans fichier"):
+        add_sale(sharded_db, client_id, station_id=99)
+    assert sharded_db.execute_query("SELECT COUNT(*) FROM transactions", use_cache=False) == [(0,)]
+
+
+def test_enable_shards_moves_existing_sales(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "gaz_station.db")
+    db = DatabaseManager(path)
+    client_id = add_client(db)
+    sale_id = add_sale(db, client_id, station_id=2)
+    db.close_all_connections()
+    
+    db = DatabaseManager(path, shard_dir=str(tmp_path / "stations"))
+    try:
+        assert shard_rows(db, 2) == [(sale_id, client_id)]
+        assert db.execute_query("SELECT id FROM transactions", use_cache=False) == [(sale_id,)]
+    finally:
+        db.close_all_connections()
+
+
+def test_refresh_shards_retires_borrowed_readers(sharded_db):
+    with sharded_db.get_connection(read_only=True) as stale:
+        sharded_db.execute_insert("INSERT INTO stations (nom) VALUES (?)", ("Station 7",), table="stations")
+        sharded_db.refresh_shards()
+    # Le lecteur rendu date d'avant la nouvelle attache: il est fermé, pas recyclé
+    with pytest.raises(sqlite3.ProgrammingError):
+        stale.execute("SELECT 1")
+    client_id = add_client(sharded_db)
+    sale_id = add_sale(sharded_db, client_id, station_id=7)
+    assert sharded_db.execute_query("SELECT id FROM transactions WHERE station_id = 7", use_cache=False) == \
+        [(sale_id,)]
+
+
+# ----------------------------------------------------------------------
+# Journal des modifications et réplication vers le siège
+# ----------------------------------------------------------------------
+def outbox(db):
+    return db.execute_query("SELECT nom_table, operation, ligne_id FROM journal_modifications ORDER BY seq",
+                            use_cache=False)
+
+
+def test_capture_triggers_record_changes(db):
+    client_id = add_client(db, "Capturé")
+    db.execute_update("UPDATE clients SET nom = ? WHERE id = ?", ("Renommé", client_id), table="clients")
+    db.execute_update("DELETE FROM clients WHERE id = ?", (client_id,), table="clients")
+    assert outbox(db) == [("clients", "INSERT", client_id), ("clients", "UPDATE", client_id),
+                          ("clients", "DELETE", client_id)]
+
+
+def test_replication_ships_to_central_and_ignores_replays(db, tmp_path):
+    central_path = str(tmp_path / "siege.db")
+    replicator = replication.Replicator(db, "station-a", central_path, batch_size=2)
+    first = add_client(db, "Premier")
+    add_client(db, "Second")
+    db.execute_update("UPDATE clients SET nom = ? WHERE id = ?", ("Premier bis", first), table="clients")
+    
+    assert replicator.ship() == 3
+    assert replicator.pending() == 0
+    central = replication.CentralStore(central_path)
+    assert central.last_seq("station-a") == replicator.position()
+    
+    # Un lot rejoué n'est jamais appliqué deux fois
+    batch = {"source": "station-a", "depuis": 0,
+             "changes": [{"seq": 1, "table": "clients", "operation": "INSERT", "id": first,
+                          "data": {"id": first, "nom": "Ancien nom"}}]}
+    assert central.apply_batch(batch) == 0
+    conn = sqlite3.connect(central_path)
+    try:
+        assert conn.execute("SELECT nom FROM clients WHERE source = 'station-a' AND id = ?",
+                            (first,)).fetchone() == ("Premier bis",)
+    finally:
+        conn.close()
+    
+    assert replicator.purge() == 3
+    assert outbox(db) == []
+
+
+def test_central_holds_back_batch_after_gap(tmp_path):
+    central = replication.CentralStore(str(tmp_path / "siege.db"))
+    batch = {"source": "station-b", "depuis": 5,
+             "changes": [{"seq": 6, "table": "clients", "operation": "DELETE", "id": 1, "data": None}]}
+    with pytest.raises(replication.ReplicationGapError):
+        central.apply_batch(batch)
+    assert central.last_seq("station-b") == 0
+
+
+def test_drop_directory_batches_apply_in_order(db, tmp_path):
+    drop_dir = tmp_path / "depot"
+    drop_dir.mkdir()
+    replicator = replication.Replicator(db, "station-c", str(drop_dir), batch_size=1)
+    add_client(db, "Un")
+    add_client(db, "Deux")
+    assert replicator.ship() == 2
+    
+    central = replication.CentralStore(str(tmp_path / "siege.db"))
+    assert central.apply_directory(str(drop_dir)) == 2
+    # Les fichiers appliqués sont rangés: une seconde passe n'applique rien
+    assert central.apply_directory(str(drop_dir)) == 0
+    assert len(os.listdir(drop_dir / "appliques")) == 2
+
+
+def test_sharded_writes_are_captured_but_not_the_split(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "gaz_station.db")
+    db = DatabaseManager(path)
+    client_id = add_client(db)
+    add_sale(db, client_id, station_id=1)
+    before = outbox(db)
+    db.close_all_connections()
+    
+    db = DatabaseManager(path, shard_dir=str(tmp_path / "stations"))
+    try:
+        # Le déplacement vers les fichiers des stations n'est pas une modification métier
+        assert outbox(db) == before
+        sale_id = add_sale(db, client_id, station_id=2)
+        assert outbox(db)[-1] == ("transactions", "INSERT", sale_id)
+    finally:
+        db.close_all_connections()
+
+
+# ----------------------------------------------------------------------
+# Cohérence du cache entre processus
+# ----------------------------------------------------------------------
+def test_cache_sees_commits_from_another_manager(db):
+    other = DatabaseManager(db.db_path)
+    try:
+        assert db.execute_query(CLIENTS_QUERY) == []
+        db.execute_query(FUELS_QUERY)
+        invalidations = db.stats["coherence_invalidations"]
+        
+        add_client(other, "Autre terminal")
+        assert db.execute_query(CLIENTS_QUERY) == [("Autre terminal",)]
+        assert db.stats["coherence_invalidations"] == invalidations + 1
+        # Seules les entrées qui lisent la table modifiée sont écartées
+        hits = db.stats["cache_hits"]
+        db.execute_query(FUELS_QUERY)
+        assert db.stats["cache_hits"] == hits + 1
+    finally:
+        other.close_all_connections()
+
+
+def test_own_writes_do_not_count_as_foreign_changes(db):
+    db.execute_query(CLIENTS_QUERY)
+    add_client(db)
+    assert db.execute_query(CLIENTS_QUERY) == [("Client",)]
+    db.execute_query(FUELS_QUERY)
+    hits = db.stats["cache_hits"]
+    db.execute_query(FUELS_QUERY)
+    assert db.stats["cache_hits"] == hits + 1
+
+
+# ----------------------------------------------------------------------
+# Sauvegardes à chaud
+# ----------------------------------------------------------------------
+def test_backup_copy_is_verified_and_readable(db, tmp_path):
+    add_client(db, "Sauvegardé")
+    manager = backup.BackupManager(db, str(tmp_path / "sauvegardes"), pages=1, sleep=0)
+    written = manager.backup_now()
+    
+    assert len(written) == 1 and written[0].endswith(".db")
+    assert not any(name.endswith(".partiel") for name in os.listdir(tmp_path / "sauvegardes"))
+    conn = sqlite3.connect(written[0])
+    try:
+        assert conn.execute("SELECT nom FROM clients").fetchall() == [("Sauvegardé",)]
+    finally:
+        conn.close()
+    assert manager.get_metrics()["runs"] == 1 and manager.get_metrics()["kept"] == 1
+
+
+def test_rotation_keeps_daily_weekly_and_monthly_backups():
+    stamps = [f"202601{day:02d}_120000" for day in range(1, 32)] + ["20260101_080000", "20251215_120000"]
+    kept = backup.kept_stamps(stamps, daily=3, weekly=2, monthly=3)
+    
+    # Trois derniers jours, dernière sauvegarde de deux semaines ISO, puis de trois mois
+    assert kept == {"20260131_120000", "20260130_120000", "20260129_120000",
+                    "20260125_120000", "20251215_120000"}
+
+
+def test_rotate_removes_backups_out_of_rotation(db, tmp_path):
+    directory = tmp_path / "sauvegardes"
+    directory.mkdir()
+    for stamp in ("20260101_120000", "20260102_120000", "20260103_120000"):
+        (directory / f"gaz_station_{stamp}.db").write_bytes(b"")
+        (directory / f"gaz_station_{stamp}_station_1.db").write_bytes(b"")
+    (directory / "autre_20260101_120000.db").write_bytes(b"")
+    
+    manager = backup.BackupManager(db, str(directory), keep_daily=1, keep_weekly=0, keep_monthly=0)
+    assert manager.rotate() == 4
+    assert sorted(os.listdir(directory)) == ["autre_20260101_120000.db", "gaz_station_20260103_120000.db",
+                                             "gaz_station_20260103_120000_station_1.db"]
+
+
+# ----------------------------------------------------------------------
+# Checkpoints et clôture de poste
+# ----------------------------------------------------------------------
+def test_close_shift_truncates_wal(db):
+    add_client(db)
+    assert db.checkpoints.wal_size() > 0
+    busy, _, _ = db.close_shift()
+    assert busy == 0
+    assert db.checkpoints.wal_size() == 0
+
+
+# ----------------------------------------------------------------------
+# Archivage des exercices
+# ----------------------------------------------------------------------
+def test_archive_round_trip(db):
+    client_id = add_client(db)
+    archived_ids = [add_sale(db, client_id, f"2023-0{month}-15 10:00:00") for month in (1, 6, 9)]
+    kept_id = add_sale(db, client_id, "2024-02-01 10:00:00")
+    db.execute_insert("INSERT INTO paiements_avance (client_id, montant, mode_paiement, date_paiement) "
+                      "VALUES (?, 100, 'especes', '2023-04-01 12:00:00')", (client_id,), table="paiements_avance")
+    rows_before = db.execute_query("SELECT * FROM transactions ORDER BY id", use_cache=False)
+    
+    moved = db.archive_year(2023)
+    assert moved["transactions"] == 3 and moved["paiements_avance"] == 1
+    assert db.archived_years() == [2023]
+    assert db.verify_archive(2023)["transactions"] == 3
+    
+    hot = [row[0] for row in db.execute_query("SELECT id FROM transactions", use_cache=False)]
+    history = db.history_table("transactions", since=20230101)
+    assert hot == [kept_id]
+    assert sorted(row[0] for row in db.execute_query(f"SELECT id FROM {history}", use_cache=False)) == \
+        sorted(archived_ids + [kept_id])
+    assert db.history_table("transactions", since=20240101) == "transactions"
+    
+    restored = db.restore_year(2023)
+    assert restored["transactions"] == 3
+    assert db.archived_years() == []
+    assert db.execute_query("SELECT * FROM transactions ORDER BY id", use_cache=False) == rows_before
+
+
+def test_archive_refuses_open_year(db):
+    with pytest.raises(ValueError):
+        db.archive_year(date.today().year)
+
+
+def test_restore_waits_for_readers_attached_to_archive(db):
+    client_id = add_client(db)
+    add_sale(db, client_id, "2023-03-01 10:00:00")
+    db.archive_year(2023)
+    path = db.archives.archive_path(2023)
+    borrowed, release = threading.Event(), threading.Event()
+    seen = []
+    
+    def long_report():
+        with db.get_connection(read_only=True) as conn:
+            seen.append(conn)
+            conn.execute("SELECT COUNT(*) FROM historique_transactions").fetchone()
+            borrowed.set()
+            release.wait(5)
+    
+    thread = threading.Thread(target=long_report)
+    thread.start()
+    borrowed.wait(5)
+    threading.Timer(0.2, release.set).start()
+    db.restore_year(2023)
+    thread.join()
+    
+    # Le fichier n'est supprimé qu'après la restitution du lecteur, qui est fermé
+    assert release.is_set() and not os.path.exists(path)
+    with pytest.raises(sqlite3.ProgrammingError):
+        seen[0].execute("SELECT 1")
+    assert db.execute_query("SELECT COUNT(*) FROM transactions", use_cache=False) == [(1,)]
+
+
+# ----------------------------------------------------------------------
+# Validation des clés étrangères par lot
+# ----------------------------------------------------------------------
+def sale_row(client_id, station_id=1, carburant_id=1):
+    return {"station_id": station_id, "client_id": client_id, "carburant_id": carburant_id,
+            "quantite": 10, "prix_unitaire": 12.5, "montant_total": 125}
+
+
+def test_validate_many_reports_rows_with_missing_references(db):
+    client_id = add_client(db)
+    rows = [sale_row(client_id), sale_row(client_id + 1), sale_row(client_id, station_id=99), sale_row("3.0")]
+    with pytest.raises(ValueError) as error:
+        db.validate_many("transactions", rows)
+    message = str(error.value)
+    assert "Ligne 1" not in message
+    assert "Ligne 2: La référence 'client_id' n'existe pas dans la table 'clients'." in message
+    assert "Ligne 3: La référence 'station_id' n'existe pas dans la table 'stations'." in message
+    assert "Ligne 4" in message
+    assert db.validate_many("transactions", [sale_row(client_id)] * 3)
+
+
+def test_missing_ids_queries_in_chunks(db):
+    ids = [add_client(db, f"Client {i}") for i in range(5)]
+    before = db.stats["query_count"]
+    assert db._missing_ids("clients", set(ids) | {1000, 1001}, chunk_size=2) == {1000, 1001}
+    assert db.stats["query_count"] - before == 4
+
+
+def test_reference_registry_follows_writes(db):
+    stations = db.reference_ids("stations")
+    before = db.stats["query_count"]
+    assert db.reference_ids("stations") is stations
+    assert db._missing_ids("stations", {1, 99}) == {99}
+    assert db.stats["query_count"] == before
+    
+    station_id = db.execute_insert("INSERT INTO stations (nom) VALUES (?)", ("Nouvelle",), table="stations")
+    assert station_id in db.reference_ids("stations")
+
+
+def test_validate_data_keeps_row_by_row_messages(db):
+    with pytest.raises(ValueError, match="Le champ 'nom' est requis."):
+        db.validate_data("clients", {"nom": ""})
+    with pytest.raises(ValueError, match="La référence 'client_id' n'existe pas"):
+        db.validate_data("vehicules", {"client_id": 42, "matricule": "123-A-45"})
+
+
+def test_reference_registry_sees_other_processes(db):
+    db.reference_ids("carburants")
+    other = DatabaseManager(db.db_path)
+    try:
+        fuel_id = other.execute_insert("INSERT INTO carburants (nom, prix_unitaire) VALUES (?, ?)",
+                                       ("GPL", 7.5), table="carburants")
+    finally:
+        other.close_all_connections()
+    assert fuel_id in db.reference_ids("carburants")
+
+
+# ----------------------------------------------------------------------
+# Mémoïsation des valeurs dérivées
+# ----------------------------------------------------------------------
+def test_memoized_keys_lru_and_unhashable_arguments():
+    calls = []
+    
+    @memoize.memoized(maxsize=2, ttl=None, tables="clients")
+    def total(a, b=0):
+        calls.append((a, b))
+        return len(a) + b if isinstance(a, (list, bytearray)) else a + b
+    
+    assert total(1, 2) == total(1, b=2) == total(a=1, b=2) == 3
+    assert len(calls) == 1
+    total(2)
+    total(3)  # Évince l'entrée (1, 2), la moins récemment utilisée
+    total(1, 2)
+    assert len(calls) == 4 and total.cache_info()["evictions"] == 2
+    
+    # Une liste est figée en clé; un argument non hashable contourne le cache
+    assert total([1, 2]) == total([1, 2]) == 2
+    assert total(bytearray(b"ab")) == total(bytearray(b"ab")) == 2
+    assert len(calls) == 7 and total.cache_info()["uncacheable"] == 2
+    
+    memoize.invalidate_tables({"carburants"})
+    total([1, 2])
+    assert len(calls) == 7  # Table sans rapport: toujours en cache
+    memoize.invalidate_tables({"*"})
+    total([1, 2])
+    assert len(calls) == 8
+
+
+def test_client_exposure_in_centimes_follows_writes(db):
+    client_id = db.execute_insert("INSERT INTO clients (nom, credit_limite) VALUES (?, ?)",
+                                  ("Crédit", 1.005), table="clients")
+    exposure = db.client_exposure(client_id)
+    # 1.005 DH vaut 101 centimes (arrondi demi vers le haut, sans erreur de flottant)
+    assert exposure["credit_limite"] == 101 and exposure["disponible"] == 101
+    assert db.client_exposure(client_id) is exposure
+    
+    add_sale(db, client_id, quantite=2, prix=0.25)
+    assert db.client_exposure(client_id)["ventes_credit"] == 50
+    assert db.client_exposure(999) is None
+
+
+def test_memoized_results_are_invalidated_per_manager(db, tmp_path):
+    other = DatabaseManager(str(tmp_path / "autre.db"))
+    try:
+        ours = db.station_kpis(1)
+        theirs = other.station_kpis(1)
+        add_sale(other, add_client(other), station_id=1)
+        # Une vente dans l'autre base ne vide pas les valeurs calculées sur celle-ci
+        assert db.station_kpis(1) is ours
+        assert other.station_kpis(1) is not theirs
+        assert other.station_kpis(1)["ventes"] == 1
+    finally:
+        other.close_all_connections()
+
+
+def test_memoized_results_see_other_processes(db):
+    client_id = add_client(db)
+    assert db.station_kpis(2)["ventes"] == 0
+    other = DatabaseManager(db.db_path)
+    try:
+        add_sale(other, client_id, station_id=2)
+    finally:
+        other.close_all_connections()
+    # La vérification de cohérence précède la lecture du résultat mémoïsé
+    assert db.station_kpis(2)["ventes"] == 1
+
+
+def test_client_credit_text():
+    assert client_credit_text(None) == ""
+    assert client_credit_text({"disponible": None}) == ""
+    assert client_credit_text({"disponible": 12345}) == " | Crédit disponible: 123.45 DH"
+
+
+def test_station_kpi_cards():
+    pytest.importorskip("reportlab")  # main_window importe la facturation PDF
+    from modules.main_window import station_kpi_cards
+    cards = station_kpi_cards({"ventes": 2, "litres": 30.5, "chiffre_affaires": 45000,
+                               "panier_moyen": 22500, "clients": 1})
+    assert ("Chiffre d'affaires", "450.00 DH") in cards and ("Litres", "30.50 L") in cards
+
+
+# ----------------------------------------------------------------------
+# Cumuls journaliers des ventes
+# ----------------------------------------------------------------------
+# Cumuls tenus par les triggers comparés au calcul direct sur les ventes
+DAILY_SALES = "SELECT jour, station_id, carburant_id, nb, ROUND(litres, 6), montant_centimes FROM ventes_journalieres"
+DIRECT_SALES = """
+    SELECT jour, station_id, carburant_id, COUNT(*), ROUND(SUM(quantite), 6), SUM(montant_centimes)
+    FROM {source} WHERE jour IS NOT NULL GROUP BY jour, station_id, carburant_id
+"""
+
+
+def daily_sales(db):
+    return sorted(db.execute_query(DAILY_SALES, use_cache=False))
+
+
+def direct_sales(db):
+    source = db.history_table("transactions")
+    return sorted(db.execute_query(DIRECT_SALES.format(source=source), use_cache=False))
+
+
+def test_daily_sales_follow_inserts_updates_and_deletes(db):
+    client_id = add_client(db)
+    ids = [add_sale(db, client_id, "2024-05-01 10:00:00", quantite=10 + i, station_id=1 + i % 2)
+           for i in range(4)]
+    add_sale(db, client_id, "2024-05-02 08:30:00", carburant_id=2)
+    assert daily_sales(db) == direct_sales(db)
+    
+    db.execute_update("UPDATE transactions SET quantite = 40, montant_total = 500, station_id = 3 WHERE id = ?",
+                      (ids[0],), table="transactions")
+    db.execute_update("UPDATE transactions SET date_transaction = '2024-05-03 09:00:00' WHERE id = ?",
+                      (ids[1],), table="transactions")
+    db.execute_update("DELETE FROM transactions WHERE id = ?", (ids[2],), table="transactions")
+    assert daily_sales(db) == direct_sales(db)
+    
+    # Plus aucune vente ce jour-là pour la station: la ligne disparaît
+    db.execute_update("DELETE FROM transactions WHERE jour = 20240502", (), table="transactions")
+    assert not db.execute_query("SELECT 1 FROM ventes_journalieres WHERE jour = 20240502", use_cache=False)
+    assert daily_sales(db) == direct_sales(db)
+
+
+def test_daily_sales_survive_archive_and_restore(db):
+    client_id = add_client(db)
+    for day in ("2023-03-01 10:00:00", "2023-03-01 15:00:00", "2023-11-20 09:00:00", "2024-05-01 10:00:00"):
+        add_sale(db, client_id, day)
+    expected = daily_sales(db)
+    assert [row[0] // 10000 for row in expected].count(2023) == 2
+    
+    db.archive_year(2023)
+    assert daily_sales(db) == expected
+    
+    # Le recalcul lit aussi les exercices archivés
+    db.rebuild_daily_sales()
+    assert daily_sales(db) == expected == direct_sales(db)
+    
+    db.restore_year(2023)
+    assert daily_sales(db) == expected == direct_sales(db)
+
+
+def test_daily_sales_migration_covers_archived_years_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "gaz_station.db")
+    db = DatabaseManager(path)
+    client_id = add_client(db)
+    add_sale(db, client_id, "2023-03-01 10:00:00")
+    add_sale(db, client_id, "2024-05-01 10:00:00")
+    expected = daily_sales(db)
+    db.archive_year(2023)
+    
+    # Base restée à la version 7: la migration 8 ne voit que les ventes courantes
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM ventes_journalieres")
+        conn.execute("DELETE FROM schema_version WHERE version >= 8")
+    db.close_all_connections()
+    
+    db = DatabaseManager(path)
+    try:
+        # La reprise, une fois les archives attachées, couvre l'exercice archivé
+        assert daily_sales(db) == expected
+    finally:
+        db.close_all_connections()
+    
+    # Base à jour: aucun recalcul au démarrage
+    def unexpected(*args, **kwargs):
+        raise AssertionError("recalcul inattendu au démarrage")
+    
+    monkeypatch.setattr(migrations, "rebuild_daily_sales", unexpected)
+    db = DatabaseManager(path)
+    try:
+        assert daily_sales(db) == expected
+    finally:
+        db.close_all_connections()
+
+
+# ----------------------------------------------------------------------
+# Soldes à date (mouvements et points de solde)
+# ----------------------------------------------------------------------
+def add_movement(db, client_id, date_mouvement, centimes):
+    return db.execute_insert("""
+        INSERT INTO mouvements_compte (client_id, date_mouvement, montant_centimes, type_mouvement)
+        VALUES (?, ?, ?, 'ajustement')
+    """, (client_id, date_mouvement, centimes), table="mouvements_compte")
+
+
+def points(db, client_id):
+    return db.execute_query("SELECT date_point, solde_centimes FROM soldes_clients_points "
+                            "WHERE client_id = ? ORDER BY date_point", (client_id,), use_cache=False)
+
+
+def test_balance_as_of_uses_balance_points(db):
+    client_id = add_client(db)
+    add_movement(db, client_id, "2024-01-10 10:00:00", 10000)
+    add_movement(db, client_id, "2024-02-05 10:00:00", -2550)
+    add_movement(db, client_id, "2024-03-20 10:00:00", 700)
+    
+    db.record_balance_points("2024-02-01")
+    db.record_balance_points("2024-03-01")
+    assert points(db, client_id) == [("2024-02-01", 10000), ("2024-03-01", 7450)]
+    
+    assert db.client_balance_as_of(client_id, "2024-01-09") == 0
+    assert db.client_balance_as_of(client_id, "2024-01-31") == 10000
+    assert db.client_balance_as_of(client_id, "2024-02-05") == 7450
+    assert db.client_balance_as_of(client_id, "2024-03-31") == 8150
+    
+    statement = db.client_statement(client_id, "2024-02-01", "2024-03-31")
+    assert statement["ouverture"] == 10000
+    assert [m["solde"] for m in statement["mouvements"]] == [7450, 8150]
+    assert statement["cloture"] == 8150
+
+
+def test_backdated_movement_drops_later_points(db):
+    client_id = add_client(db)
+    add_movement(db, client_id, "2024-01-10 10:00:00", 10000)
+    db.record_balance_points("2024-02-01")
+    db.record_balance_points("2024-03-01")
+    
+    # Écriture antidatée: les points postérieurs sont périmés
+    movement_id = add_movement(db, client_id, "2024-02-15 10:00:00", -4000)
+    assert points(db, client_id) == [("2024-02-01", 10000)]
+    assert db.client_balance_as_of(client_id, "2024-03-31") == 6000
+    
+    db.execute_update("UPDATE mouvements_compte SET montant_centimes = -1000 WHERE id = ?",
+                      (movement_id,), table="mouvements_compte")
+    assert db.client_balance_as_of(client_id, "2024-03-31") == 9000
+    db.execute_update("DELETE FROM mouvements_compte WHERE id = ?", (movement_id,), table="mouvements_compte")
+    assert db.client_balance_as_of(client_id, "2024-03-31") == 10000
+    
+    db.record_balance_points("2024-03-01")
+    assert points(db, client_id) == [("2024-02-01", 10000), ("2024-03-01", 10000)]
+
+
+def test_adjust_client_balance_records_movement(db):
+    client_id = add_client(db)
+    db.adjust_client_balance(client_id, 12345, type_mouvement="paiement", libelle="Avance")
+    db.adjust_client_balance(client_id, -345, type_mouvement="vente")
+    solde_centimes, solde_actuel = db.execute_query(
+        "SELECT solde_centimes, solde_actuel FROM clients WHERE id = ?", (client_id,), use_cache=False)[0]
+    assert solde_centimes == 12000 and solde_actuel == 120.0
+    assert db.execute_query("SELECT SUM(montant_centimes) FROM mouvements_compte WHERE client_id = ?",
+                            (client_id,), use_cache=False)[0][0] == 12000
+
+
+def test_moved_movement_drops_points_of_both_clients(db):
+    first, second = add_client(db, "Premier"), add_client(db, "Second")
+    movement_id = add_movement(db, first, "2024-03-20 10:00:00", 5000)
+    add_movement(db, second, "2024-01-10 10:00:00", 2000)
+    for point in ("2024-02-01", "2024-03-01", "2024-04-01"):
+        db.record_balance_points(point)
+    assert points(db, first) == [("2024-04-01", 5000)]
+    
+    # Antidaté: le point du 1er avril de l'ancien client et du nouveau sont faux
+    db.execute_update("UPDATE mouvements_compte SET client_id = ?, date_mouvement = ? WHERE id = ?",
+                      (second, "2024-02-15 10:00:00", movement_id), table="mouvements_compte")
+    assert points(db, first) == []
+    assert points(db, second) == [("2024-02-01", 2000)]
+    assert db.client_balance_as_of(first, "2024-04-30") == 0
+    assert db.client_balance_as_of(second, "2024-04-30") == 7000
+    
+    # Postdaté: les points à partir de l'ancienne date sont faux
+    db.record_balance_points("2024-03-01")
+    db.record_balance_points("2024-04-01")
+    db.execute_update("UPDATE mouvements_compte SET date_mouvement = ? WHERE id = ?",
+                      ("2024-04-10 10:00:00", movement_id), table="mouvements_compte")
+    assert points(db, second) == [("2024-02-01", 2000)]
+    assert db.client_balance_as_of(second, "2024-03-31") == 2000
+
+
+def test_close_shift_records_month_balance_point(db):
+    client_id = add_client(db)
+    add_movement(db, client_id, "2024-01-10 10:00:00", 10000)
+    db.close_shift()
+    month_start = date.today().replace(day=1).strftime("%Y-%m-%d")
+    assert points(db, client_id) == [(month_start, 10000)]
+
+
+def test_startup_does_not_record_balance_points(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "gaz_station.db")
+    db = DatabaseManager(path)
+    add_movement(db, add_client(db), "2024-01-10 10:00:00", 10000)
+    db.close_all_connections()
+    
+    def unexpected(*args, **kwargs):
+        raise AssertionError("point de solde inattendu au démarrage")
+    
+    monkeypatch.setattr(DatabaseManager, "record_balance_points", unexpected)
+    DatabaseManager(path).close_all_connections()
+
+
+# ----------------------------------------------------------------------
+# Recherche des clients
+# ----------------------------------------------------------------------
+
+@pytest.fixture
+def search_db(db):
+    for nom, telephone, matricule in [("Benali", "06 12 34 56 78", "12345-A-6"),
+                                      ("Tazi", "0661 00 00 00", "777-B-1"),
+                                      ("Alaoui", "0522 11 22 33", "4040-D-9")]:
+        client_id = db.execute_insert("INSERT INTO clients (nom, telephone) VALUES (?, ?)",
+                                      (nom, telephone), table="clients")
+        db.execute_insert("INSERT INTO vehicules (client_id, matricule) VALUES (?, ?)",
+                          (client_id, matricule), table="vehicules")
+    return db
+
+
+def found(db, term):
+    return [row[1] for row in db.search_clients(term)]
+
+
+def test_search_index_is_detected_on_first_search(search_db):
+    assert search_db.client_search_fts is None
+    found(search_db, "nal")
+    assert search_db.client_search_fts is True
+
+
+def test_search_clients_by_name_phone_and_plate(search_db):
+    assert found(search_db, "nal") == ["Benali"]
+    assert found(search_db, "0612345678") == ["Benali"]
+    assert found(search_db, "06-12 34") == ["Benali"]
+    assert found(search_db, "777-B") == ["Tazi"]
+    assert found(search_db, "x") == []
+
+
+def test_search_short_term_and_missing_index_use_like(search_db):
+    assert found(search_db, "Ta") == ["Tazi"]
+    search_db.client_search_fts = False
+    assert found(search_db, "laou") == ["Alaoui"]
+    assert found(search_db, "0522 11") == ["Alaoui"]
@@ -8,11 +8,11 @@ from tkinter import ttk, messagebox
 import sys
 import os
 
-# Add the modules directory to the path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'modules'))
+# Add the project directory to the path (modules is imported as a package)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from database import DatabaseManager
-from client_management_simple import ClientManagement
+from modules.database import DatabaseManager
+from modules.client_management_simple import ClientManagement
 
 
 def main():